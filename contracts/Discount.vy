@@ -33,6 +33,32 @@ interface ChainlinkOracle:
     def latestRoundData() -> LatestRoundData: view
     def decimals() -> uint256: view
 
+struct Intent:
+    contributor: address
+    amount_in: uint256
+    min_locked: uint256
+    lock: address
+    callback: address
+    deadline: uint256
+    v: uint256
+    r: uint256
+    s: uint256
+
+struct PreviewRequest:
+    lock: address
+    amount_in: uint256
+    delegate: bool
+
+struct PreviewResult:
+    amount: uint256
+    discount: uint256
+    status: uint256
+
+struct LockDiscount:
+    weeks: uint256
+    discount: uint256
+    status: uint256
+
 interface DiscountCallback:
     def delegated(_lock: address, _account: address, _amount_spent: uint256, _amount_locked: uint256): nonpayable
 
@@ -40,11 +66,17 @@ yfi: public(immutable(ERC20))
 veyfi: public(immutable(VotingEscrow))
 chainlink_oracle: public(immutable(ChainlinkOracle))
 management: public(immutable(address))
+oracle_cache: public(immutable(bool))
 
-month: public(uint256)
-expiration: public(uint256)
+packed_month: uint256 # packed month and expiration
 team_allowances: HashMap[address, uint256] # team -> packed allowance
+standing_allowances: public(HashMap[address, uint256]) # team -> recurring monthly allowance
 contributor_allowances: HashMap[address, uint256] # contributor -> packed allowance
+contributor_roots: public(HashMap[uint256, bytes32]) # month -> merkle root of contributor allowances
+contributor_claims: public(HashMap[address, uint256]) # contributor -> month of last merkle claim
+nonces: public(HashMap[address, uint256]) # contributor -> number of settled intents
+packed_round: uint256 # packed answer cached by a purchase and the time it was cached
+deposits: public(HashMap[address, uint256]) # contributor -> ETH deposited for signed buy intents
 
 SCALE: constant(uint256) = 10**18
 PRICE_DISCOUNT_SLOPE: constant(uint256) = 245096 * 10**10
@@ -61,6 +93,32 @@ CAP_DISCOUNT_WEEKS: constant(uint256) = 208
 ALLOWANCE_MASK: constant(uint256) = 2**192 - 1
 MONTH_SHIFT: constant(int128) = -192
 MONTH_MASK: constant(uint256) = 2**64 - 1
+EXPIRATION_MASK: constant(uint256) = 2**192 - 1
+ROUND_PRICE_MASK: constant(uint256) = 2**128 - 1
+ROUND_CACHED_SHIFT: constant(int128) = -128
+MAX_PROOF_LENGTH: constant(uint256) = 32
+
+# packed allowance amounts: four 64 bit amounts in gwei per word, the first one in the highest bits
+PACKED_AMOUNTS: constant(uint256) = 64
+PACKED_AMOUNT_UNIT: constant(uint256) = 10**9
+PACKED_AMOUNT_SHIFT: constant(int128) = 64
+PACKED_AMOUNT_OFFSET: constant(int128) = -192
+
+MAX_INTENTS: constant(uint256) = 128
+MAX_BULK: constant(uint256) = 256
+
+# status of rows of the bulk views, the reason the single row view would revert
+STATUS_OK: constant(uint256) = 0
+STATUS_NO_LOCK: constant(uint256) = 1
+STATUS_LOCK_EXPIRED: constant(uint256) = 2
+STATUS_LOCK_TOO_SHORT: constant(uint256) = 3
+STATUS_DELEGATE_LOCK_TOO_SHORT: constant(uint256) = 4
+STATUS_INVALID_PRICE: constant(uint256) = 5
+
+DOMAIN_TYPE_HASH: constant(bytes32) = keccak256("EIP712Domain(string name,string version,uint256 chainId,address verifyingContract)")
+INTENT_TYPE_HASH: constant(bytes32) = keccak256("BuyIntent(address contributor,uint256 amount_in,uint256 min_locked,address lock,address callback,uint256 nonce,uint256 deadline)")
+NAME_HASH: constant(bytes32) = keccak256("yDiscount")
+VERSION_HASH: constant(bytes32) = keccak256("1")
 
 event NewMonth:
     month: indexed(uint256)
@@ -72,6 +130,10 @@ event TeamAllowance:
     month: uint256
     expiration: uint256
 
+event StandingAllowance:
+    team: indexed(address)
+    allowance: uint256
+
 event ContributorAllowance:
     team: indexed(address)
     contributor: indexed(address)
@@ -79,6 +141,25 @@ event ContributorAllowance:
     month: uint256
     expiration: uint256
 
+event ContributorRoot:
+    month: indexed(uint256)
+    root: bytes32
+    expiration: uint256
+
+event ContributorClaim:
+    contributor: indexed(address)
+    allowance: uint256
+    month: uint256
+    expiration: uint256
+
+event Deposit:
+    contributor: indexed(address)
+    amount: uint256
+
+event Withdraw:
+    contributor: indexed(address)
+    amount: uint256
+
 event Buy:
     contributor: indexed(address)
     amount_in: uint256
@@ -87,21 +168,49 @@ event Buy:
     lock: address
 
 @external
-def __init__(_yfi: address, _veyfi: address, _chainlink_oracle: address, _management: address):
+def __init__(_yfi: address, _veyfi: address, _chainlink_oracle: address, _management: address, _oracle_cache: bool):
     """
     @notice Constructor
     @param _yfi YFI address
     @param _veyfi veYFI address
     @param _chainlink_oracle Chainlink oracle address
     @param _management Management address
+    @param _oracle_cache
+        True: purchases reuse the oracle round read by an earlier purchase in the same block
+        False: every purchase reads the oracle
     """
     yfi = ERC20(_yfi)
     veyfi = VotingEscrow(_veyfi)
     chainlink_oracle = ChainlinkOracle(_chainlink_oracle)
     management = _management
+    oracle_cache = _oracle_cache
     assert ChainlinkOracle(_chainlink_oracle).decimals() == 18
     assert ERC20(_yfi).approve(_veyfi, max_value(uint256), default_return_value=True)
 
+@external
+@view
+def month() -> uint256:
+    """
+    @notice Get current month
+    @return Month counter, incremented every time a new month is triggered
+    """
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    return month
+
+@external
+@view
+def expiration() -> uint256:
+    """
+    @notice Get expiration of the current month
+    @return Timestamp at which all allowances of the current month expire
+    """
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    return expiration
+
 @external
 @view
 def team_allowance(_team: address) -> uint256:
@@ -109,12 +218,40 @@ def team_allowance(_team: address) -> uint256:
     @notice Get available allowance for a particular team
     @param _team Team to query allowance for
     @return Allowance amount
+    @dev Teams without an allowance this month receive their standing allowance
+    """
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    return self._team_allowance(_team, month, expiration)
+
+@external
+@view
+def bulk_team_allowances(_teams: DynArray[address, MAX_BULK]) -> DynArray[uint256, MAX_BULK]:
+    """
+    @notice Get available allowances for multiple teams
+    @param _teams Teams to query allowances for
+    @return Allowance amounts
     """
-    allowance: uint256 = 0
     month: uint256 = 0
-    allowance, month = self._unpack_allowance(self.team_allowances[_team])
-    if month != self.month or block.timestamp >= self.expiration:
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    allowances: DynArray[uint256, MAX_BULK] = []
+    for team in _teams:
+        allowances.append(self._team_allowance(team, month, expiration))
+    return allowances
+
+@internal
+@view
+def _team_allowance(_team: address, _month: uint256, _expiration: uint256) -> uint256:
+    if block.timestamp >= _expiration:
         return 0
+
+    allowance: uint256 = 0
+    allowance_month: uint256 = 0
+    allowance, allowance_month = self._unpack_allowance(self.team_allowances[_team])
+    if allowance_month != _month:
+        return self.standing_allowances[_team]
     return allowance
 
 @external
@@ -125,10 +262,34 @@ def contributor_allowance(_contributor: address) -> uint256:
     @param _contributor Contributor to query allowance for
     @return Allowance amount
     """
-    allowance: uint256 = 0
     month: uint256 = 0
-    allowance, month = self._unpack_allowance(self.contributor_allowances[_contributor])
-    if month != self.month or block.timestamp >= self.expiration:
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    return self._contributor_allowance(_contributor, month, expiration)
+
+@external
+@view
+def bulk_contributor_allowances(_contributors: DynArray[address, MAX_BULK]) -> DynArray[uint256, MAX_BULK]:
+    """
+    @notice Get available allowances for multiple contributors
+    @param _contributors Contributors to query allowances for
+    @return Allowance amounts
+    """
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    allowances: DynArray[uint256, MAX_BULK] = []
+    for contributor in _contributors:
+        allowances.append(self._contributor_allowance(contributor, month, expiration))
+    return allowances
+
+@internal
+@view
+def _contributor_allowance(_contributor: address, _month: uint256, _expiration: uint256) -> uint256:
+    allowance: uint256 = 0
+    allowance_month: uint256 = 0
+    allowance, allowance_month = self._unpack_allowance(self.contributor_allowances[_contributor])
+    if allowance_month != _month or block.timestamp >= _expiration:
         return 0
     return allowance
 
@@ -141,28 +302,86 @@ def set_team_allowances(_teams: DynArray[address, 256], _allowances: DynArray[ui
     @param _new_month
         True: trigger a new month, invalidating previous allowances for all teams and contributors
         False: modify allowances for current month
+    @dev Overrides the standing allowance of the teams for this month only
     """
     assert msg.sender == management
     assert len(_teams) == len(_allowances)
     
-    month: uint256 = self.month
+    month: uint256 = 0
     expiration: uint256 = 0
-    if _new_month:
-        month += 1
-        expiration = block.timestamp + ALLOWANCE_EXPIRATION_TIME
-        self.month = month
-        self.expiration = expiration
-        log NewMonth(month, expiration)
-    else:
-        expiration = self.expiration
-        assert expiration > block.timestamp
+    month, expiration = self._update_month(_new_month)
+
+    for i in range(256):
+        if i == len(_teams):
+            break
+        team: address = _teams[i]
+        allowance: uint256 = _allowances[i]
+        assert team != empty(address)
+        self.team_allowances[team] = self._pack_allowance(allowance, month)
+        log TeamAllowance(team, allowance, month, expiration)
+
+@external
+def set_team_allowances_packed(_teams: DynArray[address, 256], _allowances: DynArray[uint256, PACKED_AMOUNTS], _new_month: bool = True):
+    """
+    @notice Set new allowance for multiple teams, using packed allowance amounts
+    @param _teams Teams to set allowances for
+    @param _allowances
+        Allowance amounts in gwei, four 64 bit amounts per word starting at the highest bits.
+        Unused amounts of the last word are zero
+    @param _new_month
+        True: trigger a new month, invalidating previous allowances for all teams and contributors
+        False: modify allowances for current month
+    @dev Overrides the standing allowance of the teams for this month only
+    """
+    assert msg.sender == management
+    assert len(_allowances) == (len(_teams) + 3) / 4
+
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._update_month(_new_month)
+
+    amounts: uint256 = 0
+    for i in range(256):
+        if i == len(_teams):
+            break
+        if i % 4 == 0:
+            amounts = _allowances[i / 4]
+        team: address = _teams[i]
+        allowance: uint256 = shift(amounts, PACKED_AMOUNT_OFFSET) * PACKED_AMOUNT_UNIT
+        amounts = shift(amounts, PACKED_AMOUNT_SHIFT)
+        assert team != empty(address)
+        self.team_allowances[team] = self._pack_allowance(allowance, month)
+        log TeamAllowance(team, allowance, month, expiration)
+
+    assert amounts == 0
+
+@external
+def set_standing_allowances(_teams: DynArray[address, 256], _allowances: DynArray[uint256, 256]):
+    """
+    @notice Set recurring allowance for multiple teams
+    @param _teams Teams to set standing allowances for
+    @param _allowances Allowance amounts, granted every month unless overridden
+    @dev Also applies to the current month for teams that have not been given or used an allowance yet
+    """
+    assert msg.sender == management
+    assert len(_teams) == len(_allowances)
 
     for i in range(256):
         if i == len(_teams):
             break
         assert _teams[i] != empty(address)
-        self.team_allowances[_teams[i]] = self._pack_allowance(_allowances[i], month)
-        log TeamAllowance(_teams[i], _allowances[i], month, expiration)
+        assert _allowances[i] <= ALLOWANCE_MASK
+        self.standing_allowances[_teams[i]] = _allowances[i]
+        log StandingAllowance(_teams[i], _allowances[i])
+
+@external
+def new_month():
+    """
+    @notice Trigger a new month, invalidating previous allowances for all teams and contributors
+    @dev Teams with a standing allowance receive it in full
+    """
+    assert msg.sender == management
+    self._update_month(True)
 
 @external
 def set_contributor_allowances(_contributors: DynArray[address, 256], _allowances: DynArray[uint256, 256]):
@@ -173,38 +392,174 @@ def set_contributor_allowances(_contributors: DynArray[address, 256], _allowance
     """
     assert len(_contributors) == len(_allowances)
 
+    month: uint256 = 0
+    expiration: uint256 = 0
     team_allowance: uint256 = 0
+    month, expiration, team_allowance = self._allocatable_allowance()
+
+    for i in range(256):
+        if i == len(_contributors):
+            break
+        contributor: address = _contributors[i]
+        allowance: uint256 = _allowances[i]
+        assert contributor != empty(address)
+        if allowance == 0:
+            continue
+
+        team_allowance -= allowance
+        contributor_allowance: uint256 = 0
+        contributor_month: uint256 = 0
+        contributor_allowance, contributor_month = self._unpack_allowance(self.contributor_allowances[contributor])
+        if contributor_month != month:
+            contributor_allowance = 0
+        contributor_allowance += allowance
+
+        self.contributor_allowances[contributor] = self._pack_allowance(contributor_allowance, month)
+        log ContributorAllowance(msg.sender, contributor, contributor_allowance, month, expiration)
+
+    self.team_allowances[msg.sender] = self._pack_allowance(team_allowance, month)
+
+@external
+def set_contributor_allowances_packed(_contributors: DynArray[address, 256], _allowances: DynArray[uint256, PACKED_AMOUNTS]):
+    """
+    @notice Allocate team allowance to contributors, using packed allowance amounts
+    @param _contributors Contributors to allocate allowances to
+    @param _allowances
+        Allowance amounts in gwei, four 64 bit amounts per word starting at the highest bits.
+        Unused amounts of the last word are zero
+    """
+    assert len(_allowances) == (len(_contributors) + 3) / 4
+
     month: uint256 = 0
-    team_allowance, month = self._unpack_allowance(self.team_allowances[msg.sender])
-    assert team_allowance > 0
-    assert month == self.month and self.expiration > block.timestamp, "allowance expired"
+    expiration: uint256 = 0
+    team_allowance: uint256 = 0
+    month, expiration, team_allowance = self._allocatable_allowance()
 
+    amounts: uint256 = 0
     for i in range(256):
         if i == len(_contributors):
             break
-        assert _contributors[i] != empty(address)
-        if _allowances[i] == 0:
+        if i % 4 == 0:
+            amounts = _allowances[i / 4]
+        contributor: address = _contributors[i]
+        allowance: uint256 = shift(amounts, PACKED_AMOUNT_OFFSET) * PACKED_AMOUNT_UNIT
+        amounts = shift(amounts, PACKED_AMOUNT_SHIFT)
+        assert contributor != empty(address)
+        if allowance == 0:
             continue
 
-        team_allowance -= _allowances[i]
+        team_allowance -= allowance
         contributor_allowance: uint256 = 0
         contributor_month: uint256 = 0
-        contributor_allowance, contributor_month = self._unpack_allowance(self.contributor_allowances[_contributors[i]])
+        contributor_allowance, contributor_month = self._unpack_allowance(self.contributor_allowances[contributor])
         if contributor_month != month:
             contributor_allowance = 0
-        contributor_allowance += _allowances[i]
+        contributor_allowance += allowance
 
-        self.contributor_allowances[_contributors[i]] = self._pack_allowance(contributor_allowance, month)
-        log ContributorAllowance(msg.sender, _contributors[i], contributor_allowance, month, self.expiration)
+        self.contributor_allowances[contributor] = self._pack_allowance(contributor_allowance, month)
+        log ContributorAllowance(msg.sender, contributor, contributor_allowance, month, expiration)
 
+    assert amounts == 0
     self.team_allowances[msg.sender] = self._pack_allowance(team_allowance, month)
 
 @internal
 @view
-def _spot_price() -> uint256:
+def _allocatable_allowance() -> (uint256, uint256, uint256):
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+
+    team_allowance: uint256 = 0
+    team_month: uint256 = 0
+    team_allowance, team_month = self._unpack_allowance(self.team_allowances[msg.sender])
+    if team_month != month:
+        team_allowance = self.standing_allowances[msg.sender]
+        assert team_allowance > 0, "allowance expired"
+    else:
+        assert team_allowance > 0
+    assert expiration > block.timestamp, "allowance expired"
+    return month, expiration, team_allowance
+
+@external
+def set_contributor_root(_root: bytes32, _new_month: bool = True):
+    """
+    @notice Set merkle root of contributor allowances
+    @param _root Root of the tree with (contributor, allowance, month) leaves
+    @param _new_month
+        True: trigger a new month, invalidating previous allowances for all teams and contributors
+        False: replace the root for current month. Contributors that already claimed keep their allowance
+    @dev Contributors claim their allowance by proving it on their first purchase through `buy_with_proof`
+    """
+    assert msg.sender == management
+    assert _root != empty(bytes32)
+
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._update_month(_new_month)
+    self.contributor_roots[month] = _root
+    log ContributorRoot(month, _root, expiration)
+
+@internal
+def _update_month(_new_month: bool) -> (uint256, uint256):
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    if _new_month:
+        month += 1
+        expiration = block.timestamp + ALLOWANCE_EXPIRATION_TIME
+        self.packed_month = self._pack_month(month, expiration)
+        log NewMonth(month, expiration)
+    else:
+        assert expiration > block.timestamp
+    return month, expiration
+
+@internal
+@view
+def _oracle_price() -> (uint256, uint256):
     data: LatestRoundData = chainlink_oracle.latestRoundData()
     assert block.timestamp < data.updated + ORACLE_STALE_TIME
-    return convert(data.answer, uint256)
+    return convert(data.answer, uint256), data.updated
+
+@internal
+@view
+def _valid_spot_price() -> uint256:
+    """
+    @dev Spot price like `_spot_price`, or zero instead of reverting if the oracle round is stale or not positive
+    """
+    data: LatestRoundData = chainlink_oracle.latestRoundData()
+    if data.answer > 0 and block.timestamp < data.updated + ORACLE_STALE_TIME:
+        return convert(data.answer, uint256)
+    return 0
+
+@internal
+@view
+def _spot_price() -> uint256:
+    price: uint256 = 0
+    updated: uint256 = 0
+    price, updated = self._oracle_price()
+    return price
+
+@internal
+def _update_spot_price() -> uint256:
+    """
+    @dev Spot price for a purchase. With the oracle cache, the round read by the first
+        purchase of a block is reused by the later ones in the same block only
+    """
+    price: uint256 = 0
+    updated: uint256 = 0
+    if not oracle_cache:
+        price, updated = self._oracle_price()
+        return price
+
+    cached: uint256 = 0
+    price, cached = self._unpack_round(self.packed_round)
+    if cached == block.timestamp:
+        return price
+
+    price, updated = self._oracle_price()
+    if price > 0 and price <= ROUND_PRICE_MASK:
+        self.packed_round = self._pack_round(price, block.timestamp)
+    return price
 
 @external
 @view
@@ -216,10 +571,15 @@ def spot_price() -> uint256:
 
 @internal
 @view
-def _discount(_account: address) -> (uint256, uint256):
+def _locked(_account: address) -> LockedBalance:
     locked: LockedBalance = veyfi.locked(_account)
     assert locked.amount > 0
-    weeks: uint256 = min(locked.end / WEEK - block.timestamp / WEEK, CAP_DISCOUNT_WEEKS)
+    return locked
+
+@internal
+@view
+def _discount(_locked: LockedBalance) -> (uint256, uint256):
+    weeks: uint256 = min(_locked.end / WEEK - block.timestamp / WEEK, CAP_DISCOUNT_WEEKS)
     return weeks, PRICE_DISCOUNT_BIAS + PRICE_DISCOUNT_SLOPE * weeks
 
 @external
@@ -231,25 +591,50 @@ def discount(_account: address) -> uint256:
     """
     weeks: uint256 = 0
     discount: uint256 = 0
-    weeks, discount = self._discount(_account)
+    weeks, discount = self._discount(self._locked(_account))
     return discount
 
 @internal
 @view
-def _preview(_lock: address, _amount_in: uint256, _delegate: bool) -> (uint256, uint256):
-    locked: LockedBalance = veyfi.locked(_lock)
-    assert locked.amount > 0
+def _lock_discount(_locked: LockedBalance) -> LockDiscount:
+    """
+    @dev Weeks and discount of a lock, with the status `discount` would revert with
+    """
+    if _locked.amount == 0:
+        return LockDiscount({weeks: 0, discount: 0, status: STATUS_NO_LOCK})
+    if _locked.end / WEEK < block.timestamp / WEEK:
+        return LockDiscount({weeks: 0, discount: 0, status: STATUS_LOCK_EXPIRED})
+    weeks: uint256 = 0
+    discount: uint256 = 0
+    weeks, discount = self._discount(_locked)
+    return LockDiscount({weeks: weeks, discount: discount, status: STATUS_OK})
+
+@external
+@view
+def bulk_discounts(_accounts: DynArray[address, MAX_BULK]) -> DynArray[LockDiscount, MAX_BULK]:
+    """
+    @notice Get lock weeks and discounts for multiple accounts
+    @param _accounts Accounts to query discounts for
+    @return Weeks until lock end, discount in 18 decimals and status of every account.
+        Accounts without a lock or with an expired lock have a nonzero status and no discount
+    """
+    discounts: DynArray[LockDiscount, MAX_BULK] = []
+    for account in _accounts:
+        discounts.append(self._lock_discount(veyfi.locked(account)))
+    return discounts
 
+@internal
+@view
+def _preview(_locked: LockedBalance, _price: uint256, _amount_in: uint256, _delegate: bool) -> (uint256, uint256):
     weeks: uint256 = 0
     discount: uint256 = 0
-    weeks, discount = self._discount(_lock)
-    price: uint256 = self._spot_price()
+    weeks, discount = self._discount(_locked)
     if _delegate:
         assert weeks >= DELEGATE_MIN_LOCK_WEEKS, "delegate lock too short"
         discount = DELEGATE_DISCOUNT
     else:
         assert weeks >= MIN_LOCK_WEEKS, "lock too short"
-    price = price * (SCALE - discount) / SCALE
+    price: uint256 = _price * (SCALE - discount) / SCALE
     return _amount_in * SCALE / price, discount
 
 @external
@@ -263,9 +648,45 @@ def preview(_lock: address, _amount_in: uint256, _delegate: bool) -> uint256:
     """
     amount: uint256 = 0
     discount: uint256 = 0
-    amount, discount = self._preview(_lock, _amount_in, _delegate)
+    amount, discount = self._preview(self._locked(_lock), self._spot_price(), _amount_in, _delegate)
     return amount
 
+@external
+@view
+def bulk_previews(_requests: DynArray[PreviewRequest, MAX_BULK]) -> DynArray[PreviewResult, MAX_BULK]:
+    """
+    @notice Preview multiple YFI purchases at the same spot price
+    @param _requests Lock, amount of ETH to spend and whether the lock belongs to a third party, per purchase
+    @return YFI amount, discount and status of every purchase.
+        Purchases that would revert have a nonzero status and no amount or discount
+    """
+    price: uint256 = self._valid_spot_price()
+    results: DynArray[PreviewResult, MAX_BULK] = []
+    for request in _requests:
+        locked: LockedBalance = veyfi.locked(request.lock)
+        # statuses take the precedence of the reverts in `preview`: no lock, invalid price, lock too short
+        lock: LockDiscount = LockDiscount({weeks: 0, discount: 0, status: STATUS_NO_LOCK})
+        if locked.amount > 0:
+            lock = self._lock_discount(locked)
+            if price == 0:
+                lock.status = STATUS_INVALID_PRICE
+        if lock.status == STATUS_OK:
+            if request.delegate:
+                if lock.weeks < DELEGATE_MIN_LOCK_WEEKS:
+                    lock.status = STATUS_DELEGATE_LOCK_TOO_SHORT
+                lock.discount = DELEGATE_DISCOUNT
+            elif lock.weeks < MIN_LOCK_WEEKS:
+                lock.status = STATUS_LOCK_TOO_SHORT
+        discounted: uint256 = price * (SCALE - lock.discount) / SCALE
+        if lock.status == STATUS_OK and discounted == 0:
+            lock.status = STATUS_INVALID_PRICE
+
+        if lock.status == STATUS_OK:
+            results.append(PreviewResult({amount: request.amount_in * SCALE / discounted, discount: lock.discount, status: STATUS_OK}))
+        else:
+            results.append(PreviewResult({amount: 0, discount: 0, status: lock.status}))
+    return results
+
 @external
 @payable
 def buy(_min_locked: uint256, _lock: address = msg.sender, _callback: address = empty(address)) -> uint256:
@@ -278,27 +699,186 @@ def buy(_min_locked: uint256, _lock: address = msg.sender, _callback: address =
     """
     assert msg.value > 0
 
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+
     allowance: uint256 = 0
+    allowance_month: uint256 = 0
+    allowance, allowance_month = self._unpack_allowance(self.contributor_allowances[msg.sender])
+    assert allowance > 0
+    assert allowance_month == month and expiration > block.timestamp, "allowance expired"
+    locked: uint256 = self._buy(msg.sender, msg.value, allowance, month, 0, _min_locked, _lock, _callback)
+    raw_call(management, b"", value=msg.value)
+    return locked
+
+@external
+@payable
+def buy_with_proof(
+    _allowance: uint256,
+    _proof: DynArray[bytes32, MAX_PROOF_LENGTH],
+    _min_locked: uint256,
+    _lock: address = msg.sender,
+    _callback: address = empty(address)
+) -> uint256:
+    """
+    @notice Claim allowance from the merkle root of this month and buy YFI at a discount
+    @param _allowance Allowance of the contributor in the merkle tree
+    @param _proof Merkle proof of the allowance. Ignored if already claimed this month
+    @param _min_locked Minimum amount of YFI to be locked
+    @param _lock Owner of the lock to add to
+    @param _callback Contract to call after adding to the lock
+    @return Amount of YFI added to lock
+    """
+    assert msg.value > 0
+
     month: uint256 = 0
-    allowance, month = self._unpack_allowance(self.contributor_allowances[msg.sender])
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    assert expiration > block.timestamp, "allowance expired"
+
+    allowance: uint256 = 0
+    allowance_month: uint256 = 0
+    allowance, allowance_month = self._unpack_allowance(self.contributor_allowances[msg.sender])
+    if allowance_month != month:
+        allowance = 0
+
+    if self.contributor_claims[msg.sender] != month:
+        leaf: bytes32 = keccak256(_abi_encode(msg.sender, _allowance, month))
+        assert self._verify_proof(_proof, self.contributor_roots[month], leaf), "invalid proof"
+        self.contributor_claims[msg.sender] = month
+        allowance += _allowance
+        log ContributorClaim(msg.sender, _allowance, month, expiration)
+
     assert allowance > 0
-    assert month == self.month and self.expiration > block.timestamp, "allowance expired"
-    
-    allowance -= msg.value
-    self.contributor_allowances[msg.sender] = self._pack_allowance(allowance, month)
+    locked: uint256 = self._buy(msg.sender, msg.value, allowance, month, 0, _min_locked, _lock, _callback)
+    raw_call(management, b"", value=msg.value)
+    return locked
+
+@external
+@payable
+def deposit(_contributor: address = msg.sender):
+    """
+    @notice Deposit ETH to pay for signed buy intents
+    @param _contributor Contributor whose intents the deposit pays for
+    """
+    assert _contributor != empty(address)
+    assert msg.value > 0
+    self.deposits[_contributor] += msg.value
+    log Deposit(_contributor, msg.value)
+
+@external
+def withdraw_deposit(_amount: uint256):
+    """
+    @notice Withdraw ETH deposited for signed buy intents
+    @param _amount Amount of ETH to withdraw
+    """
+    deposit: uint256 = self.deposits[msg.sender]
+    assert _amount > 0 and _amount <= deposit, "insufficient deposit"
+    self.deposits[msg.sender] = deposit - _amount
+    raw_call(msg.sender, b"", value=_amount)
+    log Withdraw(msg.sender, _amount)
+
+@external
+def settle(_intents: DynArray[Intent, MAX_INTENTS]) -> DynArray[uint256, MAX_INTENTS]:
+    """
+    @notice Settle signed buy intents of multiple contributors
+    @param _intents Intents, each signed by its contributor according to EIP-712
+    @return Amounts of YFI added to the locks
+    @dev The ETH of every intent is taken from the deposit of its contributor
+    """
+    month: uint256 = 0
+    expiration: uint256 = 0
+    month, expiration = self._unpack_month(self.packed_month)
+    assert expiration > block.timestamp, "allowance expired"
+
+    price: uint256 = self._update_spot_price()
+    domain_separator: bytes32 = self._domain_separator()
+    total: uint256 = 0
+    locked: DynArray[uint256, MAX_INTENTS] = []
+    for intent in _intents:
+        assert intent.amount_in > 0
+        assert intent.deadline >= block.timestamp, "intent expired"
+
+        nonce: uint256 = self.nonces[intent.contributor]
+        digest: bytes32 = keccak256(concat(
+            b"\x19\x01",
+            domain_separator,
+            keccak256(_abi_encode(
+                INTENT_TYPE_HASH,
+                intent.contributor,
+                intent.amount_in,
+                intent.min_locked,
+                intent.lock,
+                intent.callback,
+                nonce,
+                intent.deadline
+            ))
+        ))
+        assert intent.contributor != empty(address)
+        assert ecrecover(digest, intent.v, intent.r, intent.s) == intent.contributor, "invalid signature"
+        self.nonces[intent.contributor] = nonce + 1
+
+        allowance: uint256 = 0
+        allowance_month: uint256 = 0
+        allowance, allowance_month = self._unpack_allowance(self.contributor_allowances[intent.contributor])
+        assert allowance > 0
+        assert allowance_month == month, "allowance expired"
+
+        deposit: uint256 = self.deposits[intent.contributor]
+        assert deposit >= intent.amount_in, "insufficient deposit"
+        self.deposits[intent.contributor] = deposit - intent.amount_in
+        total += intent.amount_in
+        locked.append(self._buy(intent.contributor, intent.amount_in, allowance, month, price, intent.min_locked, intent.lock, intent.callback))
+
+    raw_call(management, b"", value=total)
+    return locked
+
+@external
+@view
+def domain_separator() -> bytes32:
+    """
+    @notice Get EIP-712 domain separator for signed buy intents
+    """
+    return self._domain_separator()
+
+@internal
+@view
+def _domain_separator() -> bytes32:
+    return keccak256(_abi_encode(DOMAIN_TYPE_HASH, NAME_HASH, VERSION_HASH, chain.id, self))
+
+@internal
+def _buy(
+    _contributor: address,
+    _amount_in: uint256,
+    _allowance: uint256,
+    _month: uint256,
+    _price: uint256,
+    _min_locked: uint256,
+    _lock: address,
+    _callback: address
+) -> uint256:
+    """
+    @dev `_price` is the spot price `settle` read for all of its intents. Purchases pass zero
+        and read it after the allowance and lock checks, like `preview`
+    """
+    self.contributor_allowances[_contributor] = self._pack_allowance(_allowance - _amount_in, _month)
 
     # reverts if user has no lock or duration is too short
+    lock: LockedBalance = self._locked(_lock)
+    price: uint256 = _price
+    if price == 0:
+        price = self._update_spot_price()
     locked: uint256 = 0
     discount: uint256 = 0
-    locked, discount = self._preview(_lock, msg.value, _lock != msg.sender)
+    locked, discount = self._preview(lock, price, _amount_in, _lock != _contributor)
     assert locked >= _min_locked, "price change"
 
     veyfi.modify_lock(locked, 0, _lock)
     if _callback != empty(address):
-        DiscountCallback(_callback).delegated(_lock, msg.sender, msg.value, locked)
+        DiscountCallback(_callback).delegated(_lock, _contributor, _amount_in, locked)
 
-    raw_call(management, b"", value=msg.value)
-    log Buy(msg.sender, msg.value, locked, discount, _lock)
+    log Buy(_contributor, _amount_in, locked, discount, _lock)
     return locked
 
 @external
@@ -321,3 +901,37 @@ def _pack_allowance(_allowance: uint256, _month: uint256) -> uint256:
 @pure
 def _unpack_allowance(_packed: uint256) -> (uint256, uint256):
     return _packed & ALLOWANCE_MASK, shift(_packed, MONTH_SHIFT)
+
+@internal
+@pure
+def _verify_proof(_proof: DynArray[bytes32, MAX_PROOF_LENGTH], _root: bytes32, _leaf: bytes32) -> bool:
+    if _root == empty(bytes32):
+        return False
+    node: bytes32 = _leaf
+    for sibling in _proof:
+        if convert(node, uint256) < convert(sibling, uint256):
+            node = keccak256(concat(node, sibling))
+        else:
+            node = keccak256(concat(sibling, node))
+    return node == _root
+
+@internal
+@pure
+def _pack_month(_month: uint256, _expiration: uint256) -> uint256:
+    assert _month <= MONTH_MASK and _expiration <= EXPIRATION_MASK
+    return _expiration | shift(_month, -MONTH_SHIFT)
+
+@internal
+@pure
+def _unpack_month(_packed: uint256) -> (uint256, uint256):
+    return shift(_packed, MONTH_SHIFT), _packed & EXPIRATION_MASK
+
+@internal
+@pure
+def _pack_round(_price: uint256, _cached: uint256) -> uint256:
+    return _price | shift(_cached, -ROUND_CACHED_SHIFT)
+
+@internal
+@pure
+def _unpack_round(_packed: uint256) -> (uint256, uint256):
+    return _packed & ROUND_PRICE_MASK, shift(_packed, ROUND_CACHED_SHIFT)
@@ -0,0 +1,313 @@
+"""
+Submit a month of team or contributor allowances from a CSV file.
+
+The CSV has an `account` and an `allowance` column. Rows are validated against the
+on-chain state before anything is sent, rows that would not change anything are dropped,
+and the remaining rows are split into the fewest batches that stay below a gas budget.
+
+Batches are signed with locally assigned nonces and broadcast together. Every signed
+transaction is written to a journal before it is broadcast, so an interrupted run can be
+resumed: confirmed batches are skipped, pending transactions are broadcast again unchanged
+and batches whose nonce was consumed by another transaction are signed again. Contributor
+allowances are additive, so a batch is never sent twice under different nonces while its
+first transaction can still be mined.
+"""
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import click
+from ape import chain, project
+from ape.cli import ConnectedProviderCommand, account_option
+from eth_hash.auto import keccak
+from eth_utils import to_checksum_address
+
+# rough costs of the setters, measured with tests/benchmark.py. The contributor base
+# includes reading the standing allowance of a team on its first allocation of a month
+TEAM_BASE_GAS = 50_000
+TEAM_ENTRY_GAS = 25_000
+CONTRIBUTOR_BASE_GAS = 55_000
+CONTRIBUTOR_ENTRY_GAS = 26_000
+GAS_MARGIN = 1.1
+BLOCK_GAS_BUDGET = 15_000_000
+RECEIPT_TIMEOUT = 120
+MAX_BATCH_SIZE = 256
+MAX_ALLOWANCE = 2**192 - 1
+
+TEAMS = "teams"
+CONTRIBUTORS = "contributors"
+
+class AllocationError(RuntimeError):
+    """
+    @notice The allocation cannot be sent given the current on-chain state
+    """
+
+def read_allocations(path):
+    """
+    @notice Read and check the rows of an allocation CSV file
+    @return List of (checksummed account, allowance)
+    @dev Raises `ValueError` naming the line of the first invalid row
+    """
+    rows = []
+    seen = set()
+    with open(path, newline="") as f:
+        for line, row in enumerate(csv.DictReader(f), start=2):
+            try:
+                account = to_checksum_address(row["account"].strip())
+            except ValueError:
+                raise ValueError(f"line {line}: invalid account {row['account']!r}") from None
+            try:
+                allowance = int(row["allowance"])
+            except ValueError:
+                raise ValueError(f"line {line}: invalid allowance {row['allowance']!r}") from None
+            if account in seen:
+                raise ValueError(f"line {line}: duplicate account {account}")
+            if int(account, 16) == 0:
+                raise ValueError(f"line {line}: zero address")
+            if not 0 <= allowance <= MAX_ALLOWANCE:
+                raise ValueError(f"line {line}: invalid allowance {allowance}")
+            seen.add(account)
+            rows.append((account, allowance))
+    return rows
+
+def plan_batches(rows, base_gas, entry_gas, gas_budget=BLOCK_GAS_BUDGET):
+    """
+    @notice Split rows into the fewest batches whose estimated gas stays within the budget
+    @dev Batches are of equal size, up to one row, so the last one is not left nearly empty.
+        Raises `ValueError` if the budget does not fit a single row
+    """
+    capacity = min(MAX_BATCH_SIZE, (gas_budget - base_gas) // entry_gas)
+    if capacity <= 0:
+        raise ValueError("gas budget too small for a single row")
+    if not rows:
+        return []
+    count = -(-len(rows) // capacity)
+    size, extra = divmod(len(rows), count)
+    batches = []
+    start = 0
+    for i in range(count):
+        stop = start + size + (i < extra)
+        batches.append(rows[start:stop])
+        start = stop
+    return batches
+
+class Journal:
+    def __init__(self, path, data):
+        self.path = Path(path)
+        self.data = data
+
+    @classmethod
+    def load(cls, path):
+        path = Path(path)
+        return cls(path, json.loads(path.read_text())) if path.exists() else None
+
+    @property
+    def batches(self):
+        return self.data["batches"]
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.write_text(json.dumps(self.data, indent=1))
+        os.replace(tmp, self.path)
+
+class Allocation:
+    def __init__(self, discount, sender, mode, rows, journal, new_month=True, gas_budget=BLOCK_GAS_BUDGET):
+        """
+        @param discount Discount contract
+        @param sender Management for team allowances, the team for contributor allowances
+        @param mode `teams` or `contributors`
+        @param rows List of (account, allowance)
+        @param journal Path of the journal file, an existing journal of the same allocation is resumed
+        @param new_month Whether team allowances start a new month
+        @param gas_budget Maximum estimated gas of a single batch
+        """
+        if mode not in (TEAMS, CONTRIBUTORS):
+            raise ValueError(f"invalid mode {mode!r}")
+        self.discount = discount
+        self.sender = sender
+        self.mode = mode
+        self.new_month = new_month and mode == TEAMS
+        self.gas_budget = gas_budget
+        self.web3 = chain.provider.web3
+        self.base_gas, self.entry_gas = (
+            (TEAM_BASE_GAS, TEAM_ENTRY_GAS) if mode == TEAMS else (CONTRIBUTOR_BASE_GAS, CONTRIBUTOR_ENTRY_GAS)
+        )
+
+        key = "0x" + keccak(json.dumps([
+            chain.chain_id, str(discount.address), str(sender.address), mode, self.new_month, rows,
+        ]).encode()).hex()
+        self.journal = Journal.load(journal)
+        if self.journal is None:
+            self.journal = Journal(journal, {"key": key, "batches": []})
+            self.journal.data["batches"] = [
+                {"accounts": [a for a, _ in batch], "allowances": [str(v) for _, v in batch]}
+                for batch in plan_batches(self.effective(rows), self.base_gas, self.entry_gas, gas_budget)
+            ]
+        if self.journal.data["key"] != key:
+            raise ValueError("journal belongs to a different allocation")
+
+    def effective(self, rows):
+        """
+        @notice Drop rows that do not change any allowance
+        @dev A zero contributor allowance is skipped by the contract. A zero team allowance
+            only matters if it overrides a standing or current allowance of the team
+        """
+        if self.mode == CONTRIBUTORS:
+            return [(a, v) for a, v in rows if v > 0]
+        previous = self.discount.standing_allowances if self.new_month else self.discount.team_allowance
+        return [(a, v) for a, v in rows if v > 0 or previous(a) > 0]
+
+    @property
+    def pending(self):
+        return [b for b in self.journal.batches if b.get("status") != "confirmed"]
+
+    def validate(self):
+        """
+        @notice Check that all unconfirmed batches can succeed given the current state
+        @dev Raises `AllocationError` naming the first check that fails
+        """
+        now = chain.pending_timestamp
+        if self.mode == TEAMS:
+            if self.sender.address != self.discount.management():
+                raise AllocationError("sender is not management")
+            first = self.journal.batches[0] if self.journal.batches else {}
+            if (not self.new_month or first.get("status") == "confirmed") and self.discount.expiration() <= now:
+                raise AllocationError("month expired")
+            return
+
+        remaining = sum(int(v) for b in self.pending for v in b["allowances"])
+        available = self.discount.team_allowance(self.sender)
+        if remaining and self.discount.expiration() <= now:
+            raise AllocationError("month expired")
+        if remaining > available:
+            raise AllocationError(f"allocation of {remaining} exceeds team allowance of {available}")
+
+    def transaction(self, index, batch, nonce):
+        accounts, allowances = batch["accounts"], [int(v) for v in batch["allowances"]]
+        if self.mode == TEAMS:
+            method, args = self.discount.set_team_allowances, (accounts, allowances, self.new_month and index == 0)
+        else:
+            method, args = self.discount.set_contributor_allowances, (accounts, allowances)
+        gas = min(self.gas_budget, int((self.base_gas + len(batch["accounts"]) * self.entry_gas) * GAS_MARGIN))
+        txn = method.as_transaction(*args, sender=self.sender, nonce=nonce, gas_limit=gas, sign=True)
+        return txn.serialize_transaction(), txn.txn_hash
+
+    def receipt(self, batch):
+        try:
+            return self.web3.eth.get_transaction_receipt(batch["tx"])
+        except Exception:
+            return None
+
+    def refresh(self):
+        """
+        @notice Update the status of sent batches from the chain
+        @dev A batch without receipt whose nonce is used up was replaced and has to be signed again
+        """
+        sent = [b for b in self.journal.batches if b.get("status") == "sent"]
+        if not sent:
+            return
+        nonce = self.web3.eth.get_transaction_count(self.sender.address)
+        for batch in sent:
+            receipt = self.receipt(batch)
+            if receipt is not None:
+                batch["status"] = "confirmed" if receipt["status"] else "failed"
+            elif batch["nonce"] < nonce:
+                batch["status"] = "replaced"
+        self.journal.save()
+
+    def sign(self, batches):
+        """
+        @notice Assign nonces to batches and sign them
+        @dev Nonces continue after the transactions of this journal that can still be mined
+        """
+        live = [b["nonce"] + 1 for b in self.journal.batches if b.get("status") == "sent"]
+        nonce = max([self.web3.eth.get_transaction_count(self.sender.address, "pending"), *live])
+        for batch in batches:
+            index = self.journal.batches.index(batch)
+            raw, tx = self.transaction(index, batch, nonce)
+            batch.update(nonce=nonce, raw="0x" + raw.hex(), tx="0x" + bytes(tx).hex(), status="sent")
+            nonce += 1
+        # the journal has to know the transactions before they can be mined
+        self.journal.save()
+
+    def broadcast(self, batches):
+        for batch in sorted(batches, key=lambda b: b["nonce"]):
+            try:
+                self.web3.eth.send_raw_transaction(batch["raw"])
+            except Exception:
+                # already known or mined, the receipt decides
+                pass
+
+    def wait(self, batches):
+        def receipt(batch):
+            return self.web3.eth.wait_for_transaction_receipt(batch["tx"], timeout=RECEIPT_TIMEOUT)
+
+        with ThreadPoolExecutor(max_workers=min(len(batches), 16) or 1) as executor:
+            for batch, result in zip(batches, executor.map(receipt, batches)):
+                batch["status"] = "confirmed" if result["status"] else "failed"
+                batch["gas_used"] = result["gasUsed"]
+        self.journal.save()
+
+    def send(self, batches):
+        unsigned = [b for b in batches if b.get("status") != "sent"]
+        self.sign(unsigned)
+        self.broadcast(batches)
+        self.wait(batches)
+
+    def run(self):
+        """
+        @notice Send all batches that are not confirmed yet
+        @return List of batches with their final status
+        """
+        self.refresh()
+        self.validate()
+        pending = self.pending
+        if pending and self.new_month and pending[0] is self.journal.batches[0]:
+            # later batches modify the month started by the first one, which has to succeed first
+            self.send(pending[:1])
+            if pending[0]["status"] != "confirmed":
+                raise AllocationError("new month batch failed")
+            pending = pending[1:]
+        if pending:
+            self.send(pending)
+        return self.journal.batches
+
+@click.command(cls=ConnectedProviderCommand)
+@click.argument("mode", type=click.Choice([TEAMS, CONTRIBUTORS]))
+@click.argument("discount")
+@click.argument("allocations", type=click.Path(exists=True, dir_okay=False))
+@account_option("--sender")
+@click.option("--overwrite", is_flag=True, help="Modify team allowances of the current month instead of starting a new one")
+@click.option("--gas-budget", default=BLOCK_GAS_BUDGET, help="Maximum estimated gas of a single batch")
+@click.option("--journal", help="Journal file, defaults to the CSV file with a .journal.json suffix")
+@click.option("--dry-run", is_flag=True, help="Only validate and show the batches")
+def cli(mode, discount, allocations, sender, overwrite, gas_budget, journal, dry_run):
+    """
+    Set the team or contributor allowances in the CSV file ALLOCATIONS on the Discount contract at DISCOUNT
+    """
+    if journal is None:
+        journal = allocations + ".journal.json"
+    try:
+        rows = read_allocations(allocations)
+    except ValueError as e:
+        raise click.ClickException(f"{allocations}: {e}")
+    try:
+        allocation = Allocation(
+            project.Discount.at(discount), sender, mode, rows, journal, not overwrite, gas_budget,
+        )
+        if dry_run:
+            allocation.refresh()
+            allocation.validate()
+            batches = allocation.journal.batches
+        else:
+            batches = allocation.run()
+    except (ValueError, AllocationError) as e:
+        raise click.ClickException(str(e))
+
+    for i, batch in enumerate(batches):
+        click.echo(f"batch {i}: {len(batch['accounts'])} rows, {batch.get('status', 'planned')} {batch.get('tx', '')}".rstrip())
+    failed = sum(1 for b in batches if b.get("status") == "failed")
+    if failed:
+        raise click.ClickException(f"{failed} batches failed, run again to retry")
@@ -0,0 +1,202 @@
+"""
+Backtest of the discount parameters over recorded Chainlink rounds.
+
+The YFI/USD and ETH/USD round files are merged in a single streaming pass and combined
+into the YFI/ETH price the way `DoubleChainlinkOracle.latestRoundData` does: the answer is
+`yfi * 10**18 / eth` of the latest rounds of both feeds, and its `updated` is the older of
+the two. Purchases while that round is older than `ORACLE_STALE_TIME` revert and are counted
+as missed.
+
+A population of contributors buys every month according to a purchase behaviour. Only
+the purchases of the current month are kept in memory, so years of rounds are replayed
+with bounded memory. Every parameter set is replayed by its own process.
+"""
+import csv
+import heapq
+import random
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, fields
+from functools import partial
+
+import click
+
+from scripts import quote
+
+SCALE = 10**18
+ORACLE_STALE_TIME = 2 * 60 * 60
+MONTH = 30 * 24 * 60 * 60
+LOCK_WEEKS = [2, 4, 13, 26, 52, 104, 156, 208, 260]
+TIMINGS = ["uniform", "early", "late"]
+RESULT_FIELDS = ["purchases", "missed", "rejected", "eth_in", "yfi_out", "value", "cost", "effective_discount"]
+
+@dataclass
+class Parameters:
+    name: str = "current"
+    price_discount_slope: int = quote.PRICE_DISCOUNT_SLOPE
+    price_discount_bias: int = quote.PRICE_DISCOUNT_BIAS
+    cap_discount_weeks: int = quote.CAP_DISCOUNT_WEEKS
+    min_lock_weeks: int = quote.MIN_LOCK_WEEKS
+    delegate_discount: int = quote.DELEGATE_DISCOUNT
+    delegate_min_lock_weeks: int = quote.DELEGATE_MIN_LOCK_WEEKS
+
+    def preview(self, weeks, delegate, price, amount_in):
+        """
+        @notice YFI bought for `amount_in`, mirrors `Discount._preview`
+        @return YFI amount, or None if the purchase reverts
+        """
+        if delegate:
+            if weeks < self.delegate_min_lock_weeks:
+                return None
+            discount = self.delegate_discount
+        else:
+            if weeks < self.min_lock_weeks:
+                return None
+            discount = self.price_discount_bias + self.price_discount_slope * min(weeks, self.cap_discount_weeks)
+        price = price * (SCALE - discount) // SCALE if discount < SCALE else 0
+        if price == 0:
+            return None
+        return amount_in * SCALE // price
+
+@dataclass
+class Population:
+    contributors: int = 50
+    allowance: int = SCALE
+    buy_probability: float = 0.7
+    delegate_fraction: float = 0.1
+    timing: str = "uniform"
+    seed: int = 0
+
+    def locks(self):
+        """
+        @notice Lock weeks and delegation of every contributor. Contributors keep their lock length by extending it
+        """
+        rng = random.Random(self.seed)
+        return [(rng.choice(LOCK_WEEKS), rng.random() < self.delegate_fraction) for _ in range(self.contributors)]
+
+    def purchases(self, month, start, locks):
+        """
+        @notice Purchases of a month, sorted by time
+        @return List of (timestamp, lock weeks, delegate)
+        """
+        rng = random.Random(f"{self.seed}:{month}")
+        purchases = []
+        for weeks, delegate in locks:
+            if rng.random() >= self.buy_probability:
+                continue
+            offset = rng.random()
+            if self.timing == "early":
+                offset *= 0.1
+            elif self.timing == "late":
+                offset = 0.9 + 0.1 * offset
+            purchases.append((start + int(offset * MONTH), weeks, delegate))
+        return sorted(purchases)
+
+def read_rounds(path):
+    """
+    @notice Stream (updated, answer) of a round file with `answer` and `updated_at` columns, ordered by time
+    """
+    last = 0
+    with open(path, newline="") as f:
+        for row in csv.DictReader(f):
+            updated = int(row["updated_at"])
+            assert updated >= last, f"{path}: rounds out of order at {updated}"
+            last = updated
+            yield updated, int(row["answer"])
+
+def combined_rounds(yfi_rounds, eth_rounds):
+    """
+    @notice Stream the rounds of `DoubleChainlinkOracle`, one for every update of either feed
+    @return Iterator of (timestamp, answer, updated). The answer is None if the oracle would revert
+    """
+    latest = [None, None]
+    events = heapq.merge(((t, 0, a) for t, a in yfi_rounds), ((t, 1, a) for t, a in eth_rounds))
+    for timestamp, feed, answer in events:
+        latest[feed] = (answer, timestamp)
+        if None in latest:
+            continue
+        (yfi, yfi_updated), (eth, eth_updated) = latest
+        # vyper divides towards zero, and the discount reverts on a non-positive price
+        answer = yfi * SCALE // eth if yfi > 0 and eth > 0 else None
+        yield timestamp, answer, min(yfi_updated, eth_updated)
+
+def backtest(yfi_path, eth_path, parameters, population):
+    """
+    @notice Replay monthly purchases of the population against the recorded rounds
+    @return Report row with the totals of the parameter set
+    """
+    rounds = combined_rounds(read_rounds(yfi_path), read_rounds(eth_path))
+    locks = population.locks()
+    totals = dict.fromkeys(RESULT_FIELDS, 0)
+    current = next(rounds, None)
+    following = next(rounds, None)
+    first = current[0] if current is not None else 0
+    month = 0
+    # purchases after the last recorded round are not replayed
+    while following is not None:
+        for timestamp, weeks, delegate in population.purchases(month, first + month * MONTH, locks):
+            while following is not None and following[0] <= timestamp:
+                current, following = following, next(rounds, None)
+            if following is None:
+                break
+            _, price, updated = current
+            if price is None or timestamp >= updated + ORACLE_STALE_TIME:
+                totals["missed"] += 1
+                continue
+            amount = parameters.preview(weeks, delegate, price, population.allowance)
+            if amount is None:
+                totals["rejected"] += 1
+                continue
+            totals["purchases"] += 1
+            totals["eth_in"] += population.allowance
+            totals["yfi_out"] += amount
+            totals["value"] += amount * price // SCALE
+        month += 1
+        while following is not None and following[0] <= first + month * MONTH:
+            current, following = following, next(rounds, None)
+
+    totals["cost"] = totals["value"] - totals["eth_in"]
+    totals["effective_discount"] = totals["cost"] / totals["value"] if totals["value"] else 0
+    return {**asdict(parameters), **totals}
+
+def run(yfi_path, eth_path, parameter_sets, population, workers=None):
+    """
+    @notice Backtest many parameter sets in parallel, one process per set
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(partial(backtest, yfi_path, eth_path, population=population), parameter_sets))
+
+def read_parameters(path):
+    """
+    @notice Parameter sets of a CSV file, missing columns default to the current contract
+    """
+    names = {f.name for f in fields(Parameters)}
+    with open(path, newline="") as f:
+        return [
+            Parameters(**{k: v if k == "name" else int(v) for k, v in row.items() if k in names and v != ""})
+            for row in csv.DictReader(f)
+        ]
+
+@click.command()
+@click.argument("yfi_rounds", type=click.Path(exists=True, dir_okay=False))
+@click.argument("eth_rounds", type=click.Path(exists=True, dir_okay=False))
+@click.option("--parameters", "parameters_file", type=click.Path(exists=True, dir_okay=False), help="CSV file of parameter sets, defaults to the current contract")
+@click.option("--contributors", default=Population.contributors, help="Number of contributors")
+@click.option("--allowance", default=Population.allowance, help="Monthly allowance of every contributor in wei")
+@click.option("--buy-probability", default=Population.buy_probability, help="Probability that a contributor buys in a month")
+@click.option("--delegate-fraction", default=Population.delegate_fraction, help="Fraction of contributors buying into a delegated lock")
+@click.option("--timing", type=click.Choice(TIMINGS), default=Population.timing, help="When in the month contributors buy")
+@click.option("--seed", default=0, help="Random seed")
+@click.option("--workers", type=int, help="Number of processes, defaults to the number of cores")
+@click.option("--out", type=click.File("w"), default="-", help="CSV report, defaults to stdout")
+def cli(yfi_rounds, eth_rounds, parameters_file, contributors, allowance, buy_probability, delegate_fraction, timing, seed, workers, out):
+    """
+    Backtest discount parameters over the recorded Chainlink rounds in YFI_ROUNDS and ETH_ROUNDS
+    """
+    parameter_sets = read_parameters(parameters_file) if parameters_file else [Parameters()]
+    population = Population(contributors, allowance, buy_probability, delegate_fraction, timing, seed)
+    rows = run(yfi_rounds, eth_rounds, parameter_sets, population, workers)
+    writer = csv.DictWriter(out, [f.name for f in fields(Parameters)] + RESULT_FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    for row in rows:
+        click.echo(f"{row['name']}: cost {row['cost'] / SCALE:.4f} ETH, effective discount {row['effective_discount']:.4f}", err=True)
@@ -0,0 +1,143 @@
+"""
+Paged reads of the bulk views of `Discount` for dashboards and reconciliation.
+
+Accounts are split into pages of at most `PAGE_SIZE` rows, the bound of the bulk views, and
+all pages of a read are sent in a single JSON-RPC batch. Reads are pinned to one block, so
+the rows of thousands of accounts are consistent with each other.
+
+Rows that `discount` or `preview` would revert on are reported with the status codes of
+`scripts/quote.py` instead.
+"""
+import asyncio
+import csv
+
+import click
+from eth_abi import decode
+from eth_utils import to_checksum_address
+
+from scripts import quote
+from scripts.liability import indexed_contributors
+from scripts.quote_service import Rpc, calldata
+
+PAGE_SIZE = 256
+LOCK_DISCOUNT = "(uint256,uint256,uint256)"
+PREVIEW_REQUEST = "(address,uint256,bool)"
+PREVIEW_RESULT = "(uint256,uint256,uint256)"
+STATUS_NAMES = {
+    quote.OK: "ok",
+    quote.NO_LOCK: "no lock",
+    quote.LOCK_EXPIRED: "lock expired",
+    quote.LOCK_TOO_SHORT: "lock too short",
+    quote.DELEGATE_LOCK_TOO_SHORT: "delegate lock too short",
+    quote.INVALID_PRICE: "invalid price",
+}
+FIELDS = ["account", "allowance", "weeks", "discount", "status", "amount_out", "preview_status"]
+
+def pages(rows, page_size=PAGE_SIZE):
+    return [rows[i:i + page_size] for i in range(0, len(rows), page_size)]
+
+async def block_number(rpc):
+    """
+    @notice Latest block number, to pin the pages of a read to
+    """
+    return hex(int(await rpc.call("eth_blockNumber", []), 16))
+
+async def paged(rpc, discount, method, argument_type, result_type, rows, block="latest", page_size=PAGE_SIZE):
+    """
+    @notice Call a bulk view with all rows, one page per call in a single batch
+    @return Results of all rows, in order
+    """
+    signature = f"{method}({argument_type}[])"
+    results = await rpc.batch([
+        ("eth_call", [{"to": discount, "data": calldata(signature, [f"{argument_type}[]"], [page])}, block])
+        for page in pages(rows, page_size)
+    ])
+    return [row for result in results for row in decode([f"{result_type}[]"], bytes.fromhex(result[2:]))[0]]
+
+async def team_allowances(rpc, discount, teams, block="latest", page_size=PAGE_SIZE):
+    """
+    @notice Available allowances of many teams
+    """
+    return await paged(rpc, discount, "bulk_team_allowances", "address", "uint256", teams, block, page_size)
+
+async def contributor_allowances(rpc, discount, contributors, block="latest", page_size=PAGE_SIZE):
+    """
+    @notice Available allowances of many contributors
+    """
+    return await paged(rpc, discount, "bulk_contributor_allowances", "address", "uint256", contributors, block, page_size)
+
+async def discounts(rpc, discount, accounts, block="latest", page_size=PAGE_SIZE):
+    """
+    @notice Lock weeks and discounts of many accounts
+    @return List of (weeks, discount, status)
+    """
+    return await paged(rpc, discount, "bulk_discounts", "address", LOCK_DISCOUNT, accounts, block, page_size)
+
+async def previews(rpc, discount, requests, block="latest", page_size=PAGE_SIZE):
+    """
+    @notice Preview many purchases
+    @param requests List of (lock, amount in, delegate)
+    @return List of (amount, discount, status)
+    @dev Every page reads the oracle once, pages of the same block see the same price
+    """
+    return await paged(rpc, discount, "bulk_previews", PREVIEW_REQUEST, PREVIEW_RESULT, requests, block, page_size)
+
+async def report(uri, discount, contributors, block=None, page_size=PAGE_SIZE):
+    """
+    @notice Allowance, discount and preview of spending the full allowance for every contributor
+    @param block Block number to read at, defaults to the latest block
+    @return List of report rows
+    """
+    contributors = [to_checksum_address(c) for c in contributors]
+    async with Rpc(uri) as rpc:
+        block = hex(block) if block is not None else await block_number(rpc)
+        allowances, locks = await asyncio.gather(
+            contributor_allowances(rpc, discount, contributors, block, page_size),
+            discounts(rpc, discount, contributors, block, page_size),
+        )
+        results = await previews(rpc, discount, [(c, a, False) for c, a in zip(contributors, allowances)], block, page_size)
+
+    return [
+        {
+            "account": contributor,
+            "allowance": allowance,
+            "weeks": weeks,
+            "discount": lock_discount,
+            "status": STATUS_NAMES[status],
+            "amount_out": amount,
+            "preview_status": STATUS_NAMES[preview_status],
+        }
+        for contributor, allowance, (weeks, lock_discount, status), (amount, _, preview_status)
+        in zip(contributors, allowances, locks, results)
+    ]
+
+@click.command()
+@click.argument("uri")
+@click.argument("discount")
+@click.option("--db", help="Database of scripts/indexer.py to read the contributors from")
+@click.option("--contributors", "contributors_file", type=click.File(), help="File with one contributor per line")
+@click.option("--block", type=int, help="Block number to read at, defaults to the latest block")
+@click.option("--page-size", default=PAGE_SIZE, help="Rows per bulk view call")
+@click.option("--out", type=click.File("w"), default="-", help="CSV report, defaults to stdout")
+def cli(uri, discount, db, contributors_file, block, page_size, out):
+    """
+    Report allowances, discounts and full allowance previews of contributors of the Discount contract at DISCOUNT
+    """
+    if db:
+        contributors = indexed_contributors(db)
+    elif contributors_file:
+        contributors = [line.strip() for line in contributors_file if line.strip()]
+    else:
+        raise click.UsageError("either --db or --contributors is required")
+    if not 0 < page_size <= PAGE_SIZE:
+        raise click.BadParameter(f"must be between 1 and {PAGE_SIZE}", param_hint="--page-size")
+
+    rows = asyncio.run(report(uri, discount, contributors, block, page_size))
+    writer = csv.DictWriter(out, FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    click.echo(
+        f"{len(rows)} contributors, {sum(1 for r in rows if r['allowance'])} with an allowance, "
+        f"{sum(1 for r in rows if r['preview_status'] != 'ok')} that cannot buy into their own lock",
+        err=True,
+    )
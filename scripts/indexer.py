@@ -0,0 +1,249 @@
+"""
+Incremental indexer of `Discount` events into a local SQLite database.
+
+Logs are fetched in block range pages and the last processed block is checkpointed,
+so every run only has to fetch new blocks. Hashes of recent blocks are kept to detect
+reorgs, in which case the affected blocks are rolled back and indexed again.
+
+Amounts can exceed 64 bits and are stored as decimal text. The `bigsum` aggregate sums
+them exactly.
+"""
+import sqlite3
+
+import click
+from ape import chain, project
+from ape.cli import ConnectedProviderCommand
+from ape.types import LogFilter
+
+PAGE_SIZE = 2_000
+REORG_DEPTH = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (id INTEGER PRIMARY KEY CHECK (id = 0), block INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS blocks (number INTEGER PRIMARY KEY, hash TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS months (
+    block INTEGER, log_index INTEGER, month INTEGER, expiration INTEGER,
+    PRIMARY KEY (block, log_index)
+);
+CREATE TABLE IF NOT EXISTS team_allowances (
+    block INTEGER, log_index INTEGER, team TEXT, allowance TEXT, month INTEGER,
+    PRIMARY KEY (block, log_index)
+);
+CREATE TABLE IF NOT EXISTS contributor_allowances (
+    block INTEGER, log_index INTEGER, team TEXT, contributor TEXT, allowance TEXT, amount TEXT, month INTEGER,
+    PRIMARY KEY (block, log_index)
+);
+CREATE TABLE IF NOT EXISTS claims (
+    block INTEGER, log_index INTEGER, contributor TEXT, allowance TEXT, month INTEGER,
+    PRIMARY KEY (block, log_index)
+);
+CREATE TABLE IF NOT EXISTS buys (
+    block INTEGER, log_index INTEGER, tx TEXT, contributor TEXT, amount_in TEXT, amount_out TEXT,
+    discount TEXT, lock TEXT, month INTEGER,
+    PRIMARY KEY (block, log_index)
+);
+CREATE INDEX IF NOT EXISTS months_month ON months (month);
+CREATE INDEX IF NOT EXISTS team_allowances_month ON team_allowances (month, team);
+CREATE INDEX IF NOT EXISTS contributor_allowances_team ON contributor_allowances (month, team);
+CREATE INDEX IF NOT EXISTS contributor_allowances_contributor ON contributor_allowances (month, contributor, block, log_index);
+CREATE INDEX IF NOT EXISTS claims_contributor ON claims (month, contributor, block, log_index);
+CREATE INDEX IF NOT EXISTS buys_contributor ON buys (month, contributor, block, log_index);
+"""
+
+EVENT_TABLES = ["months", "team_allowances", "contributor_allowances", "claims", "buys"]
+
+class BigSum:
+    def __init__(self):
+        self.total = 0
+
+    def step(self, value):
+        if value is not None:
+            self.total += int(value)
+
+    def finalize(self):
+        return str(self.total)
+
+class Indexer:
+    def __init__(self, discount, path, start_block=0, page_size=PAGE_SIZE, reorg_depth=REORG_DEPTH):
+        """
+        @param discount Discount contract to index
+        @param path SQLite database file
+        @param start_block Deployment block of the contract
+        @param page_size Number of blocks per log request
+        @param reorg_depth Number of recent blocks to check for reorgs
+        """
+        self.discount = discount
+        self.page_size = page_size
+        self.reorg_depth = reorg_depth
+        self.db = sqlite3.connect(path)
+        self.db.create_aggregate("bigsum", 1, BigSum)
+        self.db.executescript(SCHEMA)
+        self.db.execute("INSERT OR IGNORE INTO checkpoint VALUES (0, ?)", (start_block - 1,))
+        self.db.commit()
+
+    @property
+    def checkpoint(self):
+        return self.db.execute("SELECT block FROM checkpoint").fetchone()[0]
+
+    def sync(self, stop_block=None):
+        """
+        @notice Index all new events up to `stop_block`, defaulting to the chain head
+        @return Number of indexed events
+        """
+        self.rollback_reorg()
+        head = chain.blocks.height if stop_block is None else stop_block
+        events = list(self.discount.contract_type.events)
+        count = 0
+        for start in range(self.checkpoint + 1, head + 1, self.page_size):
+            stop = min(start + self.page_size - 1, head)
+            log_filter = LogFilter(addresses=[self.discount.address], events=events, start_block=start, stop_block=stop)
+            with self.db:
+                for log in chain.provider.get_contract_logs(log_filter):
+                    self.insert(log)
+                    count += 1
+                self.remember_blocks(start, stop)
+                self.db.execute("UPDATE checkpoint SET block = ?", (stop,))
+        return count
+
+    def rollback_reorg(self):
+        """
+        @notice Roll back indexed blocks that are no longer part of the chain
+        @return First block that was rolled back, or None
+        """
+        stored = self.db.execute("SELECT number, hash FROM blocks ORDER BY number DESC").fetchall()
+        for number, block_hash in stored:
+            if number <= chain.blocks.height and chain.provider.get_block(number).hash.hex() == block_hash:
+                safe = number
+                break
+        else:
+            if not stored:
+                return None
+            safe = stored[-1][0] - 1
+
+        if safe >= self.checkpoint:
+            return None
+        with self.db:
+            for table in EVENT_TABLES:
+                self.db.execute(f"DELETE FROM {table} WHERE block > ?", (safe,))
+            self.db.execute("DELETE FROM blocks WHERE number > ?", (safe,))
+            self.db.execute("UPDATE checkpoint SET block = ?", (safe,))
+        return safe + 1
+
+    def remember_blocks(self, start, stop):
+        for number in range(max(start, stop - self.reorg_depth + 1), stop + 1):
+            self.db.execute("INSERT OR REPLACE INTO blocks VALUES (?, ?)", (number, chain.provider.get_block(number).hash.hex()))
+        self.db.execute("DELETE FROM blocks WHERE number <= ?", (stop - self.reorg_depth,))
+
+    def current_month(self):
+        row = self.db.execute("SELECT month FROM months ORDER BY block DESC, log_index DESC LIMIT 1").fetchone()
+        return row[0] if row else 0
+
+    def balance(self, month, contributor):
+        """
+        @notice Remaining allowance of a contributor according to the indexed events
+        """
+        last = self.db.execute(
+            "SELECT block, log_index, allowance FROM contributor_allowances WHERE month = ? AND contributor = ? "
+            "ORDER BY block DESC, log_index DESC LIMIT 1",
+            (month, contributor),
+        ).fetchone()
+        block, log_index, balance = last if last else (-1, -1, "0")
+        after = "month = ? AND contributor = ? AND (block > ? OR (block = ? AND log_index > ?))"
+        args = (month, contributor, block, block, log_index)
+        claimed = self.db.execute(f"SELECT bigsum(allowance) FROM claims WHERE {after}", args).fetchone()[0]
+        spent = self.db.execute(f"SELECT bigsum(amount_in) FROM buys WHERE {after}", args).fetchone()[0]
+        return int(balance) + int(claimed or 0) - int(spent or 0)
+
+    def insert(self, log):
+        args = log.event_arguments
+        key = (log.block_number, log.log_index)
+        if log.event_name == "NewMonth":
+            self.db.execute("INSERT INTO months VALUES (?, ?, ?, ?)", (*key, args["month"], args["expiration"]))
+        elif log.event_name == "TeamAllowance":
+            self.db.execute(
+                "INSERT INTO team_allowances VALUES (?, ?, ?, ?, ?)",
+                (*key, args["team"], str(args["allowance"]), args["month"]),
+            )
+        elif log.event_name == "ContributorAllowance":
+            # the event contains the new total allowance of the contributor, store the amount added by this team as well
+            amount = args["allowance"] - self.balance(args["month"], args["contributor"])
+            self.db.execute(
+                "INSERT INTO contributor_allowances VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*key, args["team"], args["contributor"], str(args["allowance"]), str(amount), args["month"]),
+            )
+        elif log.event_name == "ContributorClaim":
+            self.db.execute(
+                "INSERT INTO claims VALUES (?, ?, ?, ?, ?)",
+                (*key, args["contributor"], str(args["allowance"]), args["month"]),
+            )
+        elif log.event_name == "Buy":
+            self.db.execute(
+                "INSERT INTO buys VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    *key, str(log.transaction_hash), args["contributor"], str(args["amount_in"]),
+                    str(args["amount_out"]), str(args["discount"]), args["lock"], self.current_month(),
+                ),
+            )
+
+    def team_spend(self, month):
+        """
+        @notice Allowance allocated by every team and purchases attributed to it
+        @dev Purchases of contributors in multiple teams are split pro rata to the allocations of each team
+        @return Mapping of team to (allocated, spent)
+        """
+        allocations = self.db.execute(
+            "SELECT team, contributor, bigsum(amount) FROM contributor_allowances WHERE month = ? GROUP BY team, contributor",
+            (month,),
+        ).fetchall()
+        spent = dict(self.db.execute(
+            "SELECT contributor, bigsum(amount_in) FROM buys WHERE month = ? GROUP BY contributor", (month,)
+        ).fetchall())
+        totals = {}
+        for _, contributor, amount in allocations:
+            totals[contributor] = totals.get(contributor, 0) + int(amount)
+
+        report = {}
+        for team, contributor, amount in allocations:
+            allocated, attributed = report.get(team, (0, 0))
+            share = int(spent.get(contributor, 0)) * int(amount) // totals[contributor] if totals[contributor] else 0
+            report[team] = (allocated + int(amount), attributed + share)
+        return report
+
+    def discount_distribution(self, month):
+        """
+        @notice Purchases of a month grouped by discount
+        @return List of (discount, number of purchases, ETH in, YFI out)
+        """
+        rows = self.db.execute(
+            "SELECT discount, count(*), bigsum(amount_in), bigsum(amount_out) FROM buys WHERE month = ? GROUP BY discount",
+            (month,),
+        ).fetchall()
+        return sorted((int(d), n, int(a), int(b)) for d, n, a, b in rows)
+
+    def delegation(self, month):
+        """
+        @notice Purchases of a month split by delegated and own locks
+        @return Mapping of "delegated" and "self" to (number of purchases, ETH in, YFI out)
+        """
+        rows = self.db.execute(
+            "SELECT lock != contributor, count(*), bigsum(amount_in), bigsum(amount_out) FROM buys WHERE month = ? "
+            "GROUP BY lock != contributor",
+            (month,),
+        ).fetchall()
+        report = {"self": (0, 0, 0), "delegated": (0, 0, 0)}
+        for delegated, n, a, b in rows:
+            report["delegated" if delegated else "self"] = (n, int(a), int(b))
+        return report
+
+@click.command(cls=ConnectedProviderCommand)
+@click.argument("discount")
+@click.option("--db", default="discount.db", help="SQLite database file")
+@click.option("--start-block", default=0, help="Deployment block of the contract")
+@click.option("--page-size", default=PAGE_SIZE, help="Number of blocks per log request")
+def cli(discount, db, start_block, page_size):
+    """
+    Index events of the Discount contract at DISCOUNT
+    """
+    indexer = Indexer(project.Discount.at(discount), db, start_block, page_size)
+    count = indexer.sync()
+    click.echo(f"indexed {count} events up to block {indexer.checkpoint}")
@@ -0,0 +1,48 @@
+"""
+Storage layout of `Discount`, shared by every script that reads its storage directly.
+
+The layout is the `storage_layout` output of `vyper -f layout`, stored in
+`scripts/discount_layout.json` so that reading it needs no compiler. Run `ape run layout`
+after changing the storage of the contract, `tests/test_scripts.py` checks that the stored
+layout matches the compiler.
+"""
+import json
+import subprocess
+from pathlib import Path
+
+import click
+
+CONTRACT = Path(__file__).parent.parent / "contracts" / "Discount.vy"
+LAYOUT_FILE = Path(__file__).parent / "discount_layout.json"
+
+def compile_layout(path=CONTRACT):
+    """
+    @notice Storage layout of a contract according to the compiler version of its pragma
+    @return Mapping of storage variable to its type and slot
+    @dev Uses the compilers installed by ape-vyper, compile the project once to install it
+    """
+    import vvm
+    from vvm.install import get_executable
+
+    version = vvm.detect_vyper_version_from_source(Path(path).read_text(), check_installable=False)
+    output = subprocess.run(
+        [str(get_executable(version)), "-f", "layout", str(path)], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output)["storage_layout"]
+
+def read_layout(path=LAYOUT_FILE):
+    return json.loads(Path(path).read_text())
+
+LAYOUT = read_layout()
+# storage variable -> slot
+SLOTS = {name: entry["slot"] for name, entry in LAYOUT.items()}
+
+@click.command()
+def cli():
+    """
+    Write the storage layout of the Discount contract to scripts/discount_layout.json
+    """
+    layout = compile_layout()
+    LAYOUT_FILE.write_text(json.dumps(layout, indent=2) + "\n")
+    for name, entry in layout.items():
+        click.echo(f"{entry['slot']}: {name} {entry['type']}")
@@ -0,0 +1,210 @@
+"""
+Worst case YFI outflow of the outstanding contributor allowances of the current month.
+
+The live packed `contributor_allowances` and the locks of all contributors are read in
+batched JSON-RPC requests. The YFI needed if every allowance is spent in full is then
+evaluated with the discount rules of `Discount._preview` on a grid of spot prices and
+exercise times up to the expiration of the month, as the discount of a lock shrinks every
+week it gets closer to its end.
+
+Contributors whose own lock is missing or too short can still buy into a delegated lock at
+`DELEGATE_DISCOUNT`, which is assumed unless disabled. Allowances of a merkle root that
+were not claimed yet are not in storage and not included. The spot price is the oracle answer.
+
+The grid is evaluated in wei with the integer math of `scripts/quote.py`, so every cell is
+the exact sum of what `preview` returns for the contributors. Discounts only change from
+week to week, so exercise times are grouped by week, and contributors with the same
+discount share a discounted price. Contributors whose discount does not change until the
+expiration, like those with capped or delegated discounts, are divided once for the whole
+grid and the others once per week, which takes a fraction of a second for tens of
+thousands of contributors.
+"""
+import asyncio
+import csv
+import sqlite3
+from fractions import Fraction
+
+import click
+import numpy as np
+from eth_abi import decode
+
+from scripts import quote
+from scripts.quote_service import (
+    ALLOWANCE_MASK, CONTRIBUTOR_ALLOWANCES_SLOT, EXPIRATION_MASK, MONTH_SHIFT, PACKED_MONTH_SLOT, Rpc, calldata,
+    mapping_slot,
+)
+
+DAY = 24 * 60 * 60
+BATCH_SIZE = 500
+PRICE_FACTORS = [0.5, 0.75, 0.9, 1.0, 1.1, 1.25, 1.5]
+FIELDS = ["price", "exercise_time", "outflow", "balance", "coverage"]
+
+def outflow(allowances, lock_amounts, lock_ends, times, prices, delegate=True):
+    """
+    @notice YFI needed if every allowance is spent at once, mirrors `Discount._preview`
+    @param allowances Outstanding allowances in ETH
+    @param lock_amounts Amounts in the locks of the contributors, zero if there is no lock
+    @param lock_ends Lock end timestamps
+    @param times Exercise timestamps
+    @param prices Spot prices in 18 decimals
+    @param delegate Whether contributors without a suitable lock of their own buy into a delegated lock
+    @return Object array of YFI amounts in wei with a row per price and a column per exercise time
+    """
+    allowances = np.asarray(allowances, dtype=object)
+    lock_amounts = np.asarray(lock_amounts, dtype=object)
+    lock_ends = np.asarray(lock_ends, dtype=np.int64)
+    times = np.asarray(times, dtype=np.int64)
+    prices = np.array([int(p) for p in prices], dtype=object)
+    grid = np.zeros((len(prices), len(times)), dtype=object)
+    if not len(times):
+        return grid
+
+    live = allowances > 0
+    scaled = allowances[live] * quote.SCALE
+    has_lock = (lock_amounts > 0)[live]
+    lock_ends = lock_ends[live]
+
+    def purchases(week):
+        # discount of every contributor and whether they can buy at all
+        weeks, discounts = quote.discount(lock_ends, week * quote.WEEK)
+        own = has_lock & (weeks >= quote.MIN_LOCK_WEEKS)
+        if not delegate:
+            return discounts, own
+        # buying into a delegated lock is better than a short lock of their own
+        return np.where(own, np.maximum(discounts, quote.DELEGATE_DISCOUNT), quote.DELEGATE_DISCOUNT), np.ones_like(own)
+
+    def total(buys, discounts):
+        # YFI bought by the selected contributors at every price
+        values, groups = np.unique(discounts[buys], return_inverse=True)
+        discounted = prices[:, None] * (quote.SCALE - values.astype(object)) // quote.SCALE
+        # purchases at a discounted price of zero revert, a divisor above every amount skips them
+        discounted[discounted == 0] = 1 << 256
+        return (scaled[buys] // discounted[:, groups]).sum(axis=1)
+
+    # exercise times in the same week see the same discounts
+    weeks_of_times, columns = np.unique(times // quote.WEEK, return_inverse=True)
+    first_discounts, first_valid = purchases(weeks_of_times[0])
+    last_discounts, last_valid = purchases(weeks_of_times[-1])
+    # discounts only shrink over time, so contributors with the same discount in the first and
+    # last week keep it in between and are only divided once
+    fixed = (first_discounts == last_discounts) & (first_valid == last_valid)
+    constant = total(fixed & first_valid, first_discounts)
+    for j, week in enumerate(weeks_of_times):
+        discounts, valid = purchases(week)
+        grid[:, columns == j] = (constant + total(~fixed & valid, discounts))[:, None]
+    return grid
+
+async def load(uri, discount, contributors, batch_size=BATCH_SIZE):
+    """
+    @notice Read the month, live allowances and locks of the contributors and the YFI balance of the contract
+    @return Dictionary of the state, with arrays of allowances, lock amounts and lock ends
+    """
+    async with Rpc(uri) as rpc:
+        def address(result):
+            return decode(["address"], bytes.fromhex(result[2:]))[0]
+
+        block, yfi, veyfi, oracle, packed_month = await rpc.batch([
+            ("eth_getBlockByNumber", ["latest", False]),
+            ("eth_call", [{"to": discount, "data": calldata("yfi()")}, "latest"]),
+            ("eth_call", [{"to": discount, "data": calldata("veyfi()")}, "latest"]),
+            ("eth_call", [{"to": discount, "data": calldata("chainlink_oracle()")}, "latest"]),
+            ("eth_getStorageAt", [discount, hex(PACKED_MONTH_SLOT), "latest"]),
+        ])
+        yfi, veyfi, oracle, packed_month = address(yfi), address(veyfi), address(oracle), int(packed_month, 16)
+        balance, data = await rpc.batch([
+            ("eth_call", [{"to": yfi, "data": calldata("balanceOf(address)", ["address"], [discount])}, "latest"]),
+            ("eth_call", [{"to": oracle, "data": calldata("latestRoundData()")}, "latest"]),
+        ])
+
+        async def chunk(accounts):
+            calls = []
+            for account in accounts:
+                calls.append(("eth_getStorageAt", [discount, mapping_slot(CONTRIBUTOR_ALLOWANCES_SLOT, account), "latest"]))
+                calls.append(("eth_call", [{"to": veyfi, "data": calldata("locked(address)", ["address"], [account])}, "latest"]))
+            return await rpc.batch(calls)
+
+        results = [r for c in await asyncio.gather(
+            *(chunk(contributors[i:i + batch_size]) for i in range(0, len(contributors), batch_size))
+        ) for r in c]
+
+    month, expiration = packed_month >> MONTH_SHIFT, packed_month & EXPIRATION_MASK
+    timestamp = int(block["timestamp"], 16)
+    packed = [int(r, 16) for r in results[0::2]]
+    locks = [decode(["uint256", "uint256"], bytes.fromhex(r[2:])) for r in results[1::2]]
+    return {
+        "timestamp": timestamp,
+        "month": month,
+        "expiration": expiration,
+        "balance": int(balance, 16),
+        "price": decode(["uint80", "int256", "uint256", "uint256", "uint80"], bytes.fromhex(data[2:]))[1],
+        "allowances": [
+            p & ALLOWANCE_MASK if p >> MONTH_SHIFT == month and timestamp < expiration else 0 for p in packed
+        ],
+        "lock_amounts": [amount for amount, _ in locks],
+        "lock_ends": [end for _, end in locks],
+    }
+
+def exercise_times(now, expiration, step=DAY):
+    """
+    @notice Exercise times from now until the expiration of the month
+    """
+    return np.arange(now, max(expiration, now + 1), step, dtype=np.int64)
+
+def indexed_contributors(path):
+    """
+    @notice Contributors of the current month according to the database of `scripts/indexer.py`
+    """
+    db = sqlite3.connect(path)
+    month = db.execute("SELECT month FROM months ORDER BY block DESC, log_index DESC LIMIT 1").fetchone()
+    if month is None:
+        return []
+    rows = db.execute(
+        "SELECT contributor FROM contributor_allowances WHERE month = ? UNION SELECT contributor FROM claims WHERE month = ?",
+        (month[0], month[0]),
+    ).fetchall()
+    return sorted(r[0] for r in rows)
+
+@click.command()
+@click.argument("uri")
+@click.argument("discount")
+@click.option("--db", help="Database of scripts/indexer.py to read the contributors from")
+@click.option("--contributors", "contributors_file", type=click.File(), help="File with one contributor per line")
+@click.option("--price-factor", "price_factors", type=float, multiple=True, default=PRICE_FACTORS, help="Spot price multiple to evaluate, repeatable")
+@click.option("--step", default=DAY, help="Seconds between exercise times")
+@click.option("--no-delegate", is_flag=True, help="Do not assume purchases into delegated locks")
+@click.option("--out", type=click.File("w"), default="-", help="CSV grid, defaults to stdout")
+def cli(uri, discount, db, contributors_file, price_factors, step, no_delegate, out):
+    """
+    Project the worst case YFI outflow of the Discount contract at DISCOUNT using the node at URI
+    """
+    if db:
+        contributors = indexed_contributors(db)
+    elif contributors_file:
+        contributors = [line.strip() for line in contributors_file if line.strip()]
+    else:
+        raise click.UsageError("either --db or --contributors is required")
+
+    state = asyncio.run(load(uri, discount, contributors))
+    times = exercise_times(state["timestamp"], state["expiration"], step)
+    # exact multiples of the price, a float product would round at the 16th digit
+    prices = [int(state["price"] * Fraction(str(f))) for f in price_factors]
+    grid = outflow(state["allowances"], state["lock_amounts"], state["lock_ends"], times, prices, not no_delegate)
+
+    writer = csv.DictWriter(out, FIELDS)
+    writer.writeheader()
+    for i, price in enumerate(prices):
+        for j, time in enumerate(times):
+            writer.writerow({
+                "price": price / quote.SCALE,
+                "exercise_time": int(time),
+                "outflow": grid[i, j] / quote.SCALE,
+                "balance": state["balance"] / quote.SCALE,
+                "coverage": state["balance"] / grid[i, j] if grid[i, j] else "inf",
+            })
+    worst = grid.max() if grid.size else 0
+    click.echo(
+        f"{sum(1 for a in state['allowances'] if a)} live allowances of {sum(state['allowances']) / quote.SCALE:.4f} ETH, "
+        f"worst case outflow {worst / quote.SCALE:.4f} YFI, balance {state['balance'] / quote.SCALE:.4f} YFI, "
+        f"coverage {state['balance'] / worst if worst else float('inf'):.2f}",
+        err=True,
+    )
@@ -0,0 +1,88 @@
+"""
+Merkle tree of monthly contributor allowances, as verified by `Discount.buy_with_proof`.
+
+Leaves are `keccak256(abi.encode(contributor, allowance, month))`, internal nodes hash
+their two children in sorted order, so proofs do not need to carry the position of a node.
+"""
+import json
+
+import click
+from eth_hash.auto import keccak
+from eth_utils import to_checksum_address
+
+def leaf(contributor, allowance, month):
+    # abi encoding of (address, uint256, uint256), written out to keep large trees fast
+    return keccak(
+        bytes(12) + bytes.fromhex(str(contributor)[2:]) + allowance.to_bytes(32, "big") + month.to_bytes(32, "big")
+    )
+
+def hash_pair(a, b):
+    return keccak(a + b) if a < b else keccak(b + a)
+
+class MerkleTree:
+    def __init__(self, allowances, month):
+        """
+        @param allowances Mapping of contributor address to allowance amount
+        @param month Month the allowances are valid for
+        """
+        assert len(allowances) > 0, "empty tree"
+        self.month = month
+        self.allowances = {str(c).lower(): a for c, a in allowances.items()}
+        self.leaves = {c: leaf(c, a, month) for c, a in self.allowances.items()}
+
+        layer = sorted(self.leaves.values())
+        self.positions = {node: i for i, node in enumerate(layer)}
+        self.layers = [layer]
+        while len(layer) > 1:
+            layer = [
+                hash_pair(layer[i], layer[i + 1]) if i + 1 < len(layer) else layer[i]
+                for i in range(0, len(layer), 2)
+            ]
+            self.layers.append(layer)
+
+    @property
+    def root(self):
+        return self.layers[-1][0]
+
+    def proof(self, contributor):
+        """
+        @notice Generate proof for a single contributor
+        @return List of sibling hashes from leaf to root
+        """
+        index = self.positions[self.leaves[str(contributor).lower()]]
+        proof = []
+        for layer in self.layers[:-1]:
+            sibling = index ^ 1
+            if sibling < len(layer):
+                proof.append(layer[sibling])
+            index //= 2
+        return proof
+
+    def proofs(self):
+        """
+        @notice Generate proofs for all contributors
+        @return Mapping of contributor to (allowance, proof)
+        """
+        return {c: (a, self.proof(c)) for c, a in self.allowances.items()}
+
+def verify(proof, root, node):
+    for sibling in proof:
+        node = hash_pair(node, sibling)
+    return node == root
+
+@click.command()
+@click.argument("allowances", type=click.File())
+@click.argument("month", type=int)
+def cli(allowances, month):
+    """
+    Build the tree for a JSON object of contributor -> allowance and print the root and all proofs
+    """
+    tree = MerkleTree({c: int(a) for c, a in json.load(allowances).items()}, month)
+    click.echo(json.dumps({
+        "month": tree.month,
+        "root": "0x" + tree.root.hex(),
+        "proofs": {
+            to_checksum_address(c): {"allowance": str(a), "proof": ["0x" + p.hex() for p in proof]}
+            for c, (a, proof) in tree.proofs().items()
+        },
+    }, indent=2))
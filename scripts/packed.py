@@ -0,0 +1,48 @@
+"""
+Encoder for the allowance amounts of `Discount.set_team_allowances_packed` and
+`Discount.set_contributor_allowances_packed`.
+
+Amounts are passed in gwei as 64 bit integers, four to a word with the first amount in the
+highest bits. An allowance of 1.5 ETH takes 8 bytes of calldata, 4 of them zero, instead of
+the 32 byte word of the ABI encoded array.
+"""
+UNIT = 10**9
+AMOUNT_BITS = 64
+AMOUNTS_PER_WORD = 4
+MAX_AMOUNTS = 256
+MAX_AMOUNT = (2**AMOUNT_BITS - 1) * UNIT
+
+def encode_allowances(allowances):
+    """
+    @notice Pack allowance amounts into words
+    @param allowances Allowance amounts in wei, whole gwei of at most 64 bits
+    @dev Raises `ValueError` for amounts the contract cannot decode
+    """
+    if len(allowances) > MAX_AMOUNTS:
+        raise ValueError("too many allowances")
+    words = []
+    for i in range(0, len(allowances), AMOUNTS_PER_WORD):
+        word = 0
+        chunk = allowances[i:i + AMOUNTS_PER_WORD]
+        for allowance in chunk + [0] * (AMOUNTS_PER_WORD - len(chunk)):
+            if not 0 <= allowance <= MAX_AMOUNT:
+                raise ValueError(f"allowance {allowance} out of range")
+            if allowance % UNIT:
+                raise ValueError(f"allowance {allowance} is not a whole gwei amount")
+            word = word << AMOUNT_BITS | allowance // UNIT
+        words.append(word)
+    return words
+
+def decode_allowances(words, count):
+    """
+    @notice Unpack the first `count` amounts of words created by `encode_allowances`
+    @return Allowance amounts in wei
+    """
+    if (count + AMOUNTS_PER_WORD - 1) // AMOUNTS_PER_WORD != len(words):
+        raise ValueError(f"{len(words)} words do not hold {count} amounts")
+    mask = 2**AMOUNT_BITS - 1
+    allowances = []
+    for i in range(count):
+        shift = AMOUNT_BITS * (AMOUNTS_PER_WORD - 1 - i % AMOUNTS_PER_WORD)
+        allowances.append((words[i // AMOUNTS_PER_WORD] >> shift & mask) * UNIT)
+    return allowances
@@ -0,0 +1,236 @@
+"""
+Gas profiler for transactions to `Discount`, based on `debug_traceTransaction`.
+
+The opcode trace of every transaction is split into its call frames. Each frame is named
+after the contract and method it calls, and storage reads and writes of `Discount` are
+named after the variable they access. Mapping slots are resolved from the preimages of
+the `SHA3` operations in the trace.
+
+Gas of many transactions is aggregated into folded stacks, which `flamegraph.pl` and
+speedscope render as a flame graph. The gas spent in a frame includes the cost of calling
+it, such as cold account access and value transfer. Calls that run no code, like the ETH
+forward to management, show up as frames without children.
+
+Tracing requires a node that supports `debug_traceTransaction`, such as anvil.
+"""
+from collections import Counter
+
+import click
+from ape import chain, project
+from ape.cli import ConnectedProviderCommand
+from eth_hash.auto import keccak
+from eth_utils import to_checksum_address
+
+from scripts.layout import SLOTS
+
+CALL_OPS = {"CALL", "CALLCODE", "DELEGATECALL", "STATICCALL", "CREATE", "CREATE2"}
+VALUE_CALL_OPS = {"CALL", "CALLCODE"}
+STORAGE_OPS = {"SLOAD", "SSTORE"}
+
+# slot -> storage variable of `Discount`
+STORAGE_SLOTS = {slot: name for name, slot in SLOTS.items()}
+
+TX_BASE_GAS = 21_000
+ZERO_BYTE_GAS = 4
+NONZERO_BYTE_GAS = 16
+
+def intrinsic_gas(data):
+    return TX_BASE_GAS + sum(ZERO_BYTE_GAS if b == 0 else NONZERO_BYTE_GAS for b in data)
+
+def memory_bytes(log):
+    return bytes.fromhex("".join(word.removeprefix("0x") for word in log.get("memory") or []))
+
+def word(value):
+    return int(value, 16)
+
+class Profiler:
+    def __init__(self, contract, names=None, selectors=None):
+        """
+        @param contract Address whose storage slots are named after `STORAGE_SLOTS`
+        @param names Mapping of address to contract name
+        @param selectors Mapping of 4 byte selector to method name
+        """
+        self.contract = contract.lower()
+        self.names = {a.lower(): n for a, n in (names or {}).items()}
+        self.selectors = selectors or {}
+        self.slots = dict(STORAGE_SLOTS)
+        self.stacks = Counter()
+        self.transactions = 0
+        self.gas_used = 0
+        self.refunds = 0
+
+    def frame(self, address, data):
+        name = self.names.get(address.lower(), address)
+        if len(data) < 4:
+            return f"{name}.transfer"
+        return f"{name}.{self.selectors.get(data[:4].hex(), '0x' + data[:4].hex())}"
+
+    def storage(self, address, op, slot):
+        if address.lower() != self.contract:
+            return op
+        return f"{op} {self.slots.get(slot, hex(slot))}"
+
+    def remember_hash(self, log, following):
+        """
+        @notice Name the slot computed by a `SHA3` of a mapping slot and key
+        """
+        stack = log["stack"]
+        offset, size = word(stack[-1]), word(stack[-2])
+        if size != 64 or following is None:
+            return
+        preimage = memory_bytes(log)[offset:offset + size]
+        base = int.from_bytes(preimage[:32], "big")
+        if base in STORAGE_SLOTS and len(preimage) == 64:
+            self.slots[word(following["stack"][-1])] = STORAGE_SLOTS[base]
+
+    def add(self, logs, to, data, gas_used):
+        """
+        @notice Attribute the gas of a transaction to its call frames and storage accesses
+        @param logs `structLogs` of the trace, with stack and memory
+        @param to Address the transaction calls
+        @param data Calldata of the transaction
+        @param gas_used Gas used according to the receipt
+        @return Counter of gas per folded stack of this transaction
+        """
+        stacks = Counter()
+        root = self.frame(to, data)
+        # frames are (path, storage address, index of the call op, inclusive gas)
+        frames = [[(root,), to, None, 0]]
+
+        def spend(key, gas):
+            stacks[key] += gas
+            for frame in frames:
+                frame[3] += gas
+
+        for i, log in enumerate(logs):
+            following = logs[i + 1] if i + 1 < len(logs) else None
+            path, address = frames[-1][0], frames[-1][1]
+            op = log["op"]
+
+            if op in CALL_OPS:
+                stack = log["stack"]
+                if op.startswith("CREATE"):
+                    child = path + (op,)
+                    target = address
+                else:
+                    target = to_checksum_address(f"0x{word(stack[-2]):040x}")
+                    offset, size = (word(stack[-4]), word(stack[-5])) if op in VALUE_CALL_OPS else (word(stack[-3]), word(stack[-4]))
+                    child = path + (self.frame(target, memory_bytes(log)[offset:offset + size]),)
+                if following is not None and following["depth"] > log["depth"]:
+                    frames.append([child, address if op in ("DELEGATECALL", "CALLCODE") else target, i, 0])
+                else:
+                    # nothing executed, e.g. a plain ETH transfer
+                    spend(child, log["gas"] - following["gas"] if following is not None else log["gasCost"])
+            elif op in STORAGE_OPS:
+                spend(path + (self.storage(address, op, word(log["stack"][-1])),), log["gasCost"])
+            else:
+                if op in ("SHA3", "KECCAK256"):
+                    self.remember_hash(log, following)
+                spend(path, log["gasCost"])
+
+            # returns to the calling frames, whose call op is charged what the call cost in total
+            while following is not None and len(frames) > following["depth"]:
+                child_path, _, call, inclusive = frames.pop()
+                total = logs[call]["gas"] - following["gas"]
+                spend(child_path, total - inclusive)
+
+        execution = sum(stacks.values())
+        intrinsic = intrinsic_gas(data)
+        stacks[(root, "[intrinsic]")] += intrinsic
+        self.refunds += intrinsic + execution - gas_used
+        self.stacks.update(stacks)
+        self.transactions += 1
+        self.gas_used += gas_used
+        return stacks
+
+    def trace(self, tx_hash):
+        """
+        @notice Trace a transaction on the connected node and add it to the profile
+        """
+        receipt = chain.provider.web3.eth.get_transaction_receipt(tx_hash)
+        tx = chain.provider.web3.eth.get_transaction(tx_hash)
+        result = chain.provider.make_request(
+            "debug_traceTransaction", [tx_hash, {"enableMemory": True, "disableStorage": True}]
+        )
+        return self.add(result["structLogs"], tx["to"], bytes(tx["input"]), receipt["gasUsed"])
+
+    def folded(self):
+        """
+        @notice Aggregated gas in the folded stack format of flame graph tools
+        """
+        return [f"{';'.join(path)} {gas}" for path, gas in sorted(self.stacks.items()) if gas > 0]
+
+    def summary(self):
+        """
+        @notice Inclusive gas per frame and per storage access, averaged over all transactions
+        @return List of (path, average gas) sorted by path
+        """
+        inclusive = Counter()
+        for path, gas in self.stacks.items():
+            for depth in range(1, len(path) + 1):
+                inclusive[path[:depth]] += gas
+        return sorted((path, gas / self.transactions) for path, gas in inclusive.items())
+
+def contract_names(discount):
+    """
+    @notice Names of `Discount` and the contracts and accounts it interacts with
+    """
+    names = {discount.address: "Discount", discount.yfi(): "YFI", discount.veyfi(): "VotingEscrow", discount.management(): "management"}
+    oracle = discount.chainlink_oracle()
+    names[oracle] = "ChainlinkOracle"
+    try:
+        double = project.DoubleChainlinkOracle.at(oracle)
+        names.update({oracle: "DoubleChainlinkOracle", double.yfi_oracle(): "YFI/USD", double.eth_oracle(): "ETH/USD"})
+    except Exception:
+        pass
+    return names
+
+def method_selectors():
+    """
+    @notice Selectors of all methods of the project contracts
+    """
+    selectors = {}
+    for contract_type in project.contracts.values():
+        for abi in contract_type.methods:
+            selectors[keccak(abi.selector.encode())[:4].hex()] = abi.name
+    return selectors
+
+@click.command(cls=ConnectedProviderCommand)
+@click.argument("discount")
+@click.argument("transactions", nargs=-1)
+@click.option("--start-block", type=int, help="Also profile all transactions to DISCOUNT from this block")
+@click.option("--stop-block", type=int, help="Last block to profile, defaults to the chain head")
+@click.option("--method", "methods", multiple=True, help="Only profile calls of these methods, repeatable")
+@click.option("--out", type=click.File("w"), default="-", help="Folded stacks, defaults to stdout")
+def cli(discount, transactions, start_block, stop_block, methods, out):
+    """
+    Profile the gas of TRANSACTIONS to the Discount contract at DISCOUNT per call frame and storage access
+    """
+    contract = project.Discount.at(discount)
+    selectors = method_selectors()
+    profiler = Profiler(contract.address, contract_names(contract), selectors)
+    hashes = list(transactions)
+    if start_block is not None:
+        for number in range(start_block, (chain.blocks.height if stop_block is None else stop_block) + 1):
+            for tx in chain.provider.web3.eth.get_block(number, full_transactions=True)["transactions"]:
+                if tx["to"] == contract.address:
+                    hashes.append(tx["hash"].hex())
+
+    for tx_hash in hashes:
+        tx = chain.provider.web3.eth.get_transaction(tx_hash)
+        if methods and selectors.get(bytes(tx["input"])[:4].hex()) not in methods:
+            continue
+        try:
+            profiler.trace(tx_hash)
+        except NotImplementedError:
+            raise click.ClickException("the provider does not support debug_traceTransaction")
+
+    out.write("".join(line + "\n" for line in profiler.folded()))
+    count = max(profiler.transactions, 1)
+    click.echo(
+        f"profiled {profiler.transactions} transactions, {profiler.gas_used // count} gas on average "
+        f"after {profiler.refunds // count} gas refund",
+        err=True,
+    )
+    for path, gas in profiler.summary():
+        click.echo(f"{'  ' * (len(path) - 1)}{path[-1]}: {gas:.0f}", err=True)
@@ -0,0 +1,69 @@
+"""
+Off-chain mirror of `Discount._discount` and `Discount._preview`.
+
+Quotes are evaluated for whole arrays of locks at once. Week and discount math fits in
+int64, amounts overflow it and are computed on object arrays of python integers, so every
+result matches the contract exactly, including the rounding of each integer division.
+"""
+import numpy as np
+
+SCALE = 10**18
+PRICE_DISCOUNT_SLOPE = 245096 * 10**10
+PRICE_DISCOUNT_BIAS = 9019616 * 10**10
+DELEGATE_DISCOUNT = 10**17
+
+WEEK = 7 * 24 * 60 * 60
+MIN_LOCK_WEEKS = 4
+DELEGATE_MIN_LOCK_WEEKS = 104
+CAP_DISCOUNT_WEEKS = 208
+
+# reasons for `preview` to revert
+OK = 0
+NO_LOCK = 1
+LOCK_EXPIRED = 2
+LOCK_TOO_SHORT = 3
+DELEGATE_LOCK_TOO_SHORT = 4
+INVALID_PRICE = 5 # stale or non-positive oracle answer, or a discounted price that rounds to zero
+
+def discount(lock_end, now):
+    """
+    @notice Discount for locks ending at `lock_end`, mirrors `Discount._discount`
+    @param lock_end Lock end timestamps
+    @param now Block timestamp
+    @return Tuple of weeks until lock end and discount in 18 decimals. Weeks are negative for expired locks
+    """
+    weeks = np.asarray(lock_end, dtype=np.int64) // WEEK - np.int64(now) // WEEK
+    weeks = np.minimum(weeks, CAP_DISCOUNT_WEEKS)
+    return weeks, PRICE_DISCOUNT_BIAS + PRICE_DISCOUNT_SLOPE * np.maximum(weeks, 0)
+
+def preview(lock_amount, lock_end, amount_in, delegate, price, now):
+    """
+    @notice Quote YFI purchases, mirrors `Discount._preview`
+    @param lock_amount Amounts in the locks, zero if there is no lock
+    @param lock_end Lock end timestamps
+    @param amount_in Amounts of ETH to spend
+    @param delegate Whether each lock belongs to a third party
+    @param price Spot price in 18 decimals, zero or negative if the oracle answer cannot be used
+    @param now Block timestamp
+    @return Tuple of YFI amounts, discounts and status codes. Rows with a nonzero status revert on-chain and have a zero amount
+    @dev Statuses follow `Discount.bulk_previews`: a missing lock takes precedence over an invalid price
+    """
+    lock_amount = np.asarray(lock_amount, dtype=object)
+    delegate = np.asarray(delegate, dtype=bool)
+    weeks, discounts = discount(lock_end, now)
+
+    status = np.full(weeks.shape, OK, dtype=np.int8)
+    status[weeks < np.where(delegate, DELEGATE_MIN_LOCK_WEEKS, MIN_LOCK_WEEKS)] = LOCK_TOO_SHORT
+    status[delegate & (status == LOCK_TOO_SHORT)] = DELEGATE_LOCK_TOO_SHORT
+    status[weeks < 0] = LOCK_EXPIRED
+    if price <= 0:
+        status[:] = INVALID_PRICE
+    status[lock_amount == 0] = NO_LOCK
+    discounts = np.where(delegate, DELEGATE_DISCOUNT, discounts)
+
+    discounted = int(price) * (SCALE - discounts.astype(object)) // SCALE
+    status[(status == OK) & (discounted <= 0)] = INVALID_PRICE
+    amount_in = np.asarray(amount_in, dtype=object)
+    # rows that are not OK are divided by one, both branches of `np.where` are evaluated
+    amounts = np.where(status == OK, amount_in * SCALE // np.where(status == OK, discounted, 1), 0)
+    return amounts, np.where(status == OK, discounts, 0), status
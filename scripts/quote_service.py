@@ -0,0 +1,380 @@
+"""
+Asyncio quote service for the contributor portal.
+
+Instead of calling `spot_price`, `discount`, `preview` and `contributor_allowance` of the
+contract for every page load, the service caches the latest block and oracle round, and
+reads the locks and packed allowances of all accounts that ask for a quote within a short
+window in a single JSON-RPC batch over a pooled connection. The quotes are computed locally
+with `scripts/quote.py`, so they match the contract exactly.
+
+The cached round is kept for `ttl` seconds, about a block, after which a new round is picked
+up. A round that is about to exceed `ORACLE_STALE_TIME` is only kept until it does. The oracle
+cache of the contract only applies within the block of the purchase that filled it, quotes of
+later blocks always use the oracle round.
+"""
+import asyncio
+import csv
+import os
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+
+import aiohttp
+import click
+from aiohttp import web
+from eth_abi import decode, encode
+from eth_hash.auto import keccak
+from eth_utils import to_checksum_address
+
+from scripts import quote
+from scripts.layout import SLOTS
+
+ORACLE_STALE_TIME = 2 * 60 * 60
+ALLOWANCE_MASK = 2**192 - 1
+MONTH_SHIFT = 192
+EXPIRATION_MASK = 2**192 - 1
+PACKED_MONTH_SLOT = SLOTS["packed_month"]
+CONTRIBUTOR_ALLOWANCES_SLOT = SLOTS["contributor_allowances"]
+
+ROUND_TTL = 12
+STALE_MARGIN = 5 * 60
+BATCH_WINDOW = 0.002
+MAX_BATCH_ACCOUNTS = 250
+POOL_SIZE = 8
+FIELDS = ["mode", "clients", "requests", "calls", "seconds", "p50_ms", "p99_ms"]
+
+def calldata(signature, types=(), args=()):
+    return "0x" + (keccak(signature.encode())[:4] + encode(list(types), list(args))).hex()
+
+def mapping_slot(slot, key):
+    return "0x" + keccak(encode(["uint256", "address"], [slot, key])).hex()
+
+class RpcError(RuntimeError):
+    pass
+
+class Rpc:
+    def __init__(self, uri, pool_size=POOL_SIZE):
+        """
+        @param uri RPC URL of the node
+        @param pool_size Maximum number of open connections
+        """
+        self.uri = uri
+        self.pool_size = pool_size
+        self.session = None
+        self.requests = 0
+        self.calls = 0
+
+    async def __aenter__(self):
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+        return self
+
+    async def __aexit__(self, *args):
+        await self.session.close()
+
+    async def batch(self, calls):
+        """
+        @notice Send a list of (method, params) in one request
+        @return List of results
+        """
+        payload = [{"jsonrpc": "2.0", "id": i, "method": method, "params": params} for i, (method, params) in enumerate(calls)]
+        self.requests += 1
+        self.calls += len(calls)
+        async with self.session.post(self.uri, json=payload) as response:
+            responses = {r["id"]: r for r in await response.json(content_type=None)}
+        for i, (method, _) in enumerate(calls):
+            if "error" in responses[i]:
+                raise RpcError(f"{method}: {responses[i]['error']}")
+        return [responses[i]["result"] for i in range(len(calls))]
+
+    async def call(self, method, params):
+        return (await self.batch([(method, params)]))[0]
+
+    async def eth_call(self, to, signature, types=(), args=()):
+        return await self.call("eth_call", [{"to": to, "data": calldata(signature, types, args)}, "latest"])
+
+@dataclass
+class Head:
+    timestamp: int
+    price: int
+    updated: int
+    fetched: float
+
+    @property
+    def stale(self):
+        return self.timestamp >= self.updated + ORACLE_STALE_TIME
+
+class RoundCache:
+    def __init__(self, rpc, oracle, ttl=ROUND_TTL, margin=STALE_MARGIN):
+        """
+        @param rpc Connection to the node
+        @param oracle Price oracle of the contract
+        @param ttl Seconds to keep a round before checking for a new one
+        @param margin Seconds before a round becomes stale from which it is only kept until it does
+        """
+        self.rpc = rpc
+        self.oracle = oracle
+        self.ttl = ttl
+        self.margin = margin
+        self.head = None
+        self.refreshing = None
+
+    def lifetime(self, head):
+        remaining = head.updated + ORACLE_STALE_TIME - head.timestamp
+        if 0 < remaining <= self.margin:
+            return min(self.ttl, remaining)
+        return self.ttl
+
+    async def get(self):
+        """
+        @notice Latest block timestamp and oracle round, fetched at most once at a time
+        """
+        head = self.head
+        if head is not None and time.monotonic() - head.fetched < self.lifetime(head):
+            return head
+        if self.refreshing is None:
+            self.refreshing = asyncio.ensure_future(self.refresh())
+        try:
+            return await asyncio.shield(self.refreshing)
+        finally:
+            if self.refreshing is not None and self.refreshing.done():
+                self.refreshing = None
+
+    async def refresh(self):
+        block, data = await self.rpc.batch([
+            ("eth_getBlockByNumber", ["latest", False]),
+            ("eth_call", [{"to": self.oracle, "data": calldata("latestRoundData()")}, "latest"]),
+        ])
+        timestamp = int(block["timestamp"], 16)
+        _, answer, _, updated, _ = decode(["uint80", "int256", "uint256", "uint256", "uint80"], bytes.fromhex(data[2:]))
+        self.head = Head(timestamp, answer, updated, time.monotonic())
+        return self.head
+
+@dataclass
+class Request:
+    account: str
+    lock: str
+    amount_in: int
+    future: asyncio.Future
+
+class QuoteService:
+    def __init__(self, rpc, discount, veyfi, oracle, ttl=ROUND_TTL, margin=STALE_MARGIN, window=BATCH_WINDOW,
+                 max_accounts=MAX_BATCH_ACCOUNTS):
+        """
+        @param rpc Connection to the node
+        @param discount Address of the Discount contract
+        @param veyfi Address of its voting escrow
+        @param oracle Address of its price oracle
+        @param window Seconds to collect quote requests before reading their state
+        @param max_accounts Maximum number of quotes read in a single batch
+        """
+        self.rpc = rpc
+        self.discount = discount
+        self.veyfi = veyfi
+        self.rounds = RoundCache(rpc, oracle, ttl, margin)
+        self.window = window
+        self.max_accounts = max_accounts
+        self.queue = []
+        self.timer = None
+        self.flushes = set()
+
+    @classmethod
+    async def connect(cls, rpc, discount, **kwargs):
+        """
+        @notice Create a service for the contract at `discount`, reading its dependencies from the chain
+        """
+        discount = to_checksum_address(discount)
+        veyfi, oracle = await rpc.batch([
+            ("eth_call", [{"to": discount, "data": calldata("veyfi()")}, "latest"]),
+            ("eth_call", [{"to": discount, "data": calldata("chainlink_oracle()")}, "latest"]),
+        ])
+        return cls(rpc, discount, *(to_checksum_address(decode(["address"], bytes.fromhex(r[2:]))[0]) for r in (veyfi, oracle)), **kwargs)
+
+    async def quote(self, account, amount_in=None, lock=None):
+        """
+        @notice Quote a purchase of `account`, mirroring `preview` and the related views
+        @param amount_in Amount of ETH to spend, defaults to the full allowance of the account
+        @param lock Lock to buy into, defaults to the lock of the account
+        @return Dictionary with the spot price, lock weeks, discount, allowance, YFI amount and a `quote` status code
+        """
+        account = to_checksum_address(account)
+        request = Request(account, account if lock is None else to_checksum_address(lock), amount_in, asyncio.get_running_loop().create_future())
+        self.queue.append(request)
+        if len(self.queue) >= self.max_accounts:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+        return await request.future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.queue:
+            batch, self.queue = self.queue[:self.max_accounts], self.queue[self.max_accounts:]
+            task = asyncio.ensure_future(self.resolve(batch))
+            self.flushes.add(task)
+            task.add_done_callback(self.flushes.discard)
+
+    async def resolve(self, batch):
+        try:
+            head, state = await asyncio.gather(self.rounds.get(), self.read(batch))
+            results = self.compute(batch, head, *state)
+        except Exception as e:
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+        for request, result in zip(batch, results):
+            if not request.future.done():
+                request.future.set_result(result)
+
+    async def read(self, batch):
+        """
+        @notice Read the month, and the lock and packed allowance of every request, in one batch
+        """
+        calls = [("eth_getStorageAt", [self.discount, hex(PACKED_MONTH_SLOT), "latest"])]
+        for request in batch:
+            calls.append(("eth_call", [{"to": self.veyfi, "data": calldata("locked(address)", ["address"], [request.lock])}, "latest"]))
+            calls.append(("eth_getStorageAt", [self.discount, mapping_slot(CONTRIBUTOR_ALLOWANCES_SLOT, request.account), "latest"]))
+        results = await self.rpc.batch(calls)
+        packed_month = int(results[0], 16)
+        locks = [decode(["uint256", "uint256"], bytes.fromhex(r[2:])) for r in results[1::2]]
+        return packed_month, locks, [int(r, 16) for r in results[2::2]]
+
+    def compute(self, batch, head, packed_month, locks, packed_allowances):
+        month, expiration = packed_month >> MONTH_SHIFT, packed_month & EXPIRATION_MASK
+        allowances = [
+            p & ALLOWANCE_MASK if p >> MONTH_SHIFT == month and head.timestamp < expiration else 0
+            for p in packed_allowances
+        ]
+        amounts_in = [a if r.amount_in is None else r.amount_in for r, a in zip(batch, allowances)]
+        delegate = [r.lock != r.account for r in batch]
+        weeks, _ = quote.discount([end for _, end in locks], head.timestamp)
+        # a stale round is quoted like a non-positive answer
+        amounts, discounts, status = quote.preview(
+            [amount for amount, _ in locks], [end for _, end in locks], amounts_in, delegate,
+            0 if head.stale else head.price, head.timestamp,
+        )
+        return [
+            {
+                "account": r.account,
+                "lock": r.lock,
+                "spot_price": head.price,
+                "weeks": int(weeks[i]),
+                "discount": int(discounts[i]) if status[i] == quote.OK else 0,
+                "allowance": allowances[i],
+                "amount_in": amounts_in[i],
+                "amount_out": int(amounts[i]) if status[i] == quote.OK else 0,
+                "status": int(status[i]),
+            }
+            for i, r in enumerate(batch)
+        ]
+
+async def naive_quote(rpc, discount, account, amount_in):
+    """
+    @notice Quote the way the portal does without the service, with one view call each
+    """
+    async def view(signature, types=(), args=()):
+        try:
+            return await rpc.eth_call(discount, signature, types, args)
+        except RpcError:
+            return None
+
+    return await asyncio.gather(
+        view("spot_price()"),
+        view("discount(address)", ["address"], [account]),
+        view("preview(address,uint256,bool)", ["address", "uint256", "bool"], [account, amount_in, False]),
+        view("contributor_allowance(address)", ["address"], [account]),
+    )
+
+async def benchmark(uri, discount, accounts, clients, naive=False, pool_size=POOL_SIZE, amount_in=10**18):
+    """
+    @notice Let `clients` concurrent clients request a quote each
+    @return Report row with the number of HTTP requests, JSON-RPC calls and the latency percentiles
+    """
+    async with Rpc(uri, pool_size) as rpc:
+        service = None if naive else await QuoteService.connect(rpc, discount)
+        requests, calls = rpc.requests, rpc.calls
+        latencies = []
+
+        async def client(account):
+            start = time.perf_counter()
+            if naive:
+                await naive_quote(rpc, discount, account, amount_in)
+            else:
+                await service.quote(account)
+            latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client(accounts[i % len(accounts)]) for i in range(clients)))
+        seconds = time.perf_counter() - start
+        latencies.sort()
+        return {
+            "mode": "naive" if naive else "service",
+            "clients": clients,
+            "requests": rpc.requests - requests,
+            "calls": rpc.calls - calls,
+            "seconds": round(seconds, 3),
+            "p50_ms": round(1000 * statistics.median(latencies), 1),
+            "p99_ms": round(1000 * latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)], 1),
+        }
+
+def app(service):
+    async def handle(request):
+        result = await service.quote(
+            request.match_info["account"],
+            int(request.query["amount_in"]) if "amount_in" in request.query else None,
+            request.query.get("lock"),
+        )
+        # amounts exceed the integer precision of javascript
+        return web.json_response({k: str(v) if isinstance(v, int) and k not in ("weeks", "status") else v for k, v in result.items()})
+
+    application = web.Application()
+    application.router.add_get("/quote/{account}", handle)
+    return application
+
+@click.group()
+def cli():
+    """
+    Quote service for the Discount contract
+    """
+
+@cli.command()
+@click.argument("uri")
+@click.argument("discount")
+@click.option("--port", default=8080, help="Port to listen on")
+@click.option("--ttl", default=ROUND_TTL, help="Seconds to cache the oracle round")
+def serve(uri, discount, port, ttl):
+    """
+    Serve quotes at /quote/<account>?amount_in=&lock= using the node at URI
+    """
+    async def start():
+        async with Rpc(uri) as rpc:
+            service = await QuoteService.connect(rpc, discount, ttl=ttl)
+            runner = web.AppRunner(app(service))
+            await runner.setup()
+            await web.TCPSite(runner, port=port).start()
+            click.echo(f"serving quotes on port {port}")
+            await asyncio.Event().wait()
+
+    asyncio.run(start())
+
+@cli.command(name="benchmark")
+@click.argument("uri")
+@click.argument("discount")
+@click.option("--clients", "client_counts", type=int, multiple=True, default=[1, 1000], help="Number of concurrent clients, repeatable")
+@click.option("--accounts", "accounts_file", type=click.File(), help="File with one account per line, defaults to random accounts")
+def benchmark_cli(uri, discount, client_counts, accounts_file):
+    """
+    Compare the service with one view call per value for concurrent clients against the node at URI
+    """
+    if accounts_file is None:
+        accounts = [to_checksum_address(os.urandom(20)) for _ in range(max(client_counts))]
+    else:
+        accounts = [line.strip() for line in accounts_file if line.strip()]
+    writer = csv.DictWriter(sys.stdout, FIELDS)
+    writer.writeheader()
+    for clients in client_counts:
+        for naive in (True, False):
+            writer.writerow(asyncio.run(benchmark(uri, discount, accounts, clients, naive)))
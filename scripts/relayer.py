@@ -0,0 +1,191 @@
+"""
+Relayer for signed buy intents, settled in batches through `Discount.settle`.
+
+Contributors deposit ETH with `Discount.deposit` and sign an EIP-712 `BuyIntent` off-chain.
+The relayer collects the intents, checks their signatures, nonces and that the deposit of the
+contributor covers them, and submits them in batches that stay below a gas budget. `settle`
+takes the ETH of every intent from the deposit of its contributor. A single reverting intent
+reverts its whole batch, so every intent is simulated before it is submitted.
+"""
+from dataclasses import dataclass
+
+from ape.exceptions import ContractLogicError
+from eth_abi import encode
+from eth_hash.auto import keccak
+from eth_keys import keys
+from eth_utils import to_checksum_address
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+DOMAIN_TYPE_HASH = keccak(b"EIP712Domain(string name,string version,uint256 chainId,address verifyingContract)")
+INTENT_TYPE_HASH = keccak(
+    b"BuyIntent(address contributor,uint256 amount_in,uint256 min_locked,address lock,address callback,uint256 nonce,uint256 deadline)"
+)
+MAX_INTENTS = 128
+
+# rough settlement costs, measured with tests/benchmark.py against the mocks
+SETTLE_BASE_GAS = 90_000
+INTENT_GAS = 55_000
+CALLBACK_GAS = 95_000
+BLOCK_GAS_BUDGET = 15_000_000
+
+@dataclass
+class Intent:
+    contributor: str
+    amount_in: int
+    min_locked: int
+    lock: str
+    callback: str
+    deadline: int
+    nonce: int
+    v: int = 0
+    r: int = 0
+    s: int = 0
+
+    def as_tuple(self):
+        """
+        @notice Argument for `Discount.settle`
+        """
+        return (
+            self.contributor, self.amount_in, self.min_locked, self.lock,
+            self.callback, self.deadline, self.v, self.r, self.s,
+        )
+
+def domain_separator(discount, chain_id):
+    return keccak(encode(
+        ["bytes32", "bytes32", "bytes32", "uint256", "address"],
+        [DOMAIN_TYPE_HASH, keccak(b"yDiscount"), keccak(b"1"), chain_id, str(discount)],
+    ))
+
+def intent_digest(intent, domain):
+    struct_hash = keccak(encode(
+        ["bytes32", "address", "uint256", "uint256", "address", "address", "uint256", "uint256"],
+        [
+            INTENT_TYPE_HASH, intent.contributor, intent.amount_in, intent.min_locked,
+            intent.lock, intent.callback, intent.nonce, intent.deadline,
+        ],
+    ))
+    return keccak(b"\x19\x01" + domain + struct_hash)
+
+def sign_intent(intent, domain, private_key):
+    """
+    @notice Sign an intent with the private key of its contributor
+    """
+    signature = keys.PrivateKey(private_key).sign_msg_hash(intent_digest(intent, domain))
+    intent.v, intent.r, intent.s = signature.v + 27, signature.r, signature.s
+    return intent
+
+def recover(intent, domain):
+    signature = keys.Signature(vrs=(intent.v - 27, intent.r, intent.s))
+    return signature.recover_public_key_from_msg_hash(intent_digest(intent, domain)).to_checksum_address()
+
+def intent_gas(intent):
+    return INTENT_GAS + (CALLBACK_GAS if intent.callback != ZERO_ADDRESS else 0)
+
+class Relayer:
+    def __init__(self, discount, chain_id, gas_budget=BLOCK_GAS_BUDGET, max_intents=MAX_INTENTS):
+        """
+        @param discount Discount contract
+        @param chain_id Chain id the intents are signed for
+        @param gas_budget Maximum estimated gas of a single settlement
+        @param max_intents Maximum number of intents in a single settlement
+        """
+        self.discount = discount
+        self.domain = domain_separator(discount.address, chain_id)
+        self.gas_budget = gas_budget
+        self.max_intents = max_intents
+        self.pending = []
+
+    def add(self, intent):
+        """
+        @notice Queue an intent after checking its signature, nonce and the deposit of its contributor
+        @dev Raises ValueError if the intent cannot be settled after the queued ones
+        """
+        intent.contributor = to_checksum_address(intent.contributor)
+        if recover(intent, self.domain) != intent.contributor:
+            raise ValueError("invalid signature")
+        queued = [i for i in self.pending if i.contributor == intent.contributor]
+        if intent.nonce != self.discount.nonces(intent.contributor) + len(queued):
+            raise ValueError("invalid nonce")
+        spent = sum(i.amount_in for i in queued) + intent.amount_in
+        if spent > self.discount.deposits(intent.contributor):
+            raise ValueError("insufficient deposit")
+        self.pending.append(intent)
+
+    def batches(self, now, deposits=None):
+        """
+        @notice Split the queued intents into batches that stay within the gas budget
+        @param now Timestamp of the next block. Expired intents are dropped
+        @param deposits Deposit of every queued contributor. Intents their deposit no longer covers are dropped
+        @dev Intents of the same contributor stay in signing order, so their nonces remain sequential.
+            Intents following a dropped intent of the same contributor are dropped as well
+        """
+        batches = []
+        batch = []
+        gas = SETTLE_BASE_GAS
+        dropped = set()
+        remaining = dict(deposits) if deposits is not None else None
+        for intent in self.pending:
+            unfunded = remaining is not None and intent.amount_in > remaining.get(intent.contributor, 0)
+            if intent.deadline < now or unfunded or intent.contributor in dropped:
+                dropped.add(intent.contributor)
+                continue
+            if remaining is not None:
+                remaining[intent.contributor] -= intent.amount_in
+            cost = intent_gas(intent)
+            if batch and (gas + cost > self.gas_budget or len(batch) == self.max_intents):
+                batches.append(batch)
+                batch = []
+                gas = SETTLE_BASE_GAS
+            batch.append(intent)
+            gas += cost
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def simulate(self, intents, sender):
+        """
+        @notice Split intents into the ones that settle and the ones that revert
+        @param intents Intents in signing order
+        @param sender Account that will submit the settlements
+        @return Intents that settle, intents that revert
+        @dev Every intent is simulated with `eth_call` after the accepted intents of its contributor,
+            so its nonce, allowance and deposit account for them. Intents following a reverting
+            intent of the same contributor revert as well
+        """
+        accepted = []
+        failed = []
+        settled = {}
+        for intent in intents:
+            prior = settled.setdefault(intent.contributor, [])
+            if prior is None:
+                failed.append(intent)
+                continue
+            try:
+                self.discount.settle.call([i.as_tuple() for i in prior + [intent]], sender=sender)
+            except ContractLogicError:
+                settled[intent.contributor] = None
+                failed.append(intent)
+                continue
+            prior.append(intent)
+            accepted.append(intent)
+        return accepted, failed
+
+    def submit(self, sender, now):
+        """
+        @notice Settle all queued intents
+        @param sender Account submitting the settlements
+        @param now Timestamp of the next block
+        @return Receipts of the settlement transactions, intents that were dropped instead of settled
+        @dev Deposits are read again, contributors may have withdrawn since their intents were queued.
+            Expired, unfunded and reverting intents are dropped, see `batches` and `simulate`
+        """
+        deposits = {c: self.discount.deposits(c) for c in {intent.contributor for intent in self.pending}}
+        queued = [intent for batch in self.batches(now, deposits) for intent in batch]
+        accepted, failed = self.simulate(queued, sender)
+        dropped = [intent for intent in self.pending if intent not in accepted]
+        self.pending = accepted
+        receipts = []
+        for batch in self.batches(now):
+            receipts.append(self.discount.settle([intent.as_tuple() for intent in batch], sender=sender))
+            self.pending = [intent for intent in self.pending if intent not in batch]
+        return receipts, dropped
@@ -0,0 +1,168 @@
+"""
+Load simulation of a full allowance month against `Discount` on the local chain.
+
+Every scenario deploys the contracts with mocks, then runs a month:
+management assigns the team allowances in chunks of 256, every team allocates its
+allowance to its contributors in chunks of 256, and a fraction of the contributors buy
+with locks of mixed length, some of them into a delegated lock.
+
+Gas, transaction count and wall clock time are reported per phase. Account creation,
+funding and locks are set up before the month starts and are not part of the numbers.
+"""
+import csv
+import random
+import time
+
+import click
+from ape import accounts, chain, project
+from ape.cli import ConnectedProviderCommand
+
+UNIT = 10**18
+WEEK = 7 * 24 * 60 * 60
+BATCH_SIZE = 256
+ALLOWANCE = 10**15
+LOCK_WEEKS = [4, 13, 26, 52, 104, 156, 208]
+DELEGATE_LOCK_WEEKS = 208
+FIELDS = ["teams", "contributors", "buyers", "phase", "transactions", "gas", "gas_per_contributor", "seconds", "tx_per_second"]
+
+def chunks(items, size=BATCH_SIZE):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+        self.transactions = 0
+        self.gas = 0
+        self.seconds = 0.0
+
+    def send(self, method, *args, **kwargs):
+        start = time.perf_counter()
+        receipt = method(*args, **kwargs)
+        self.seconds += time.perf_counter() - start
+        self.transactions += 1
+        self.gas += receipt.gas_used
+        return receipt
+
+def setup(deployer, n_accounts, lock_ends):
+    """
+    @notice Deploy the contracts and create funded accounts with locks
+    """
+    yfi = project.MockToken.deploy(sender=deployer)
+    veyfi = project.MockVotingEscrow.deploy(yfi, sender=deployer)
+    oracle = project.MockPriceOracle.deploy(sender=deployer)
+    management = accounts.test_accounts[1]
+    discount = project.Discount.deploy(yfi, veyfi, oracle, management, False, sender=deployer)
+    yfi.mint(discount, 10**9 * UNIT, sender=deployer)
+
+    users = [accounts.test_accounts.generate_test_account() for _ in range(n_accounts)]
+    for user, lock_end in zip(users, lock_ends):
+        deployer.transfer(user, 2 * ALLOWANCE + UNIT // 10)
+        if lock_end:
+            veyfi.set_locked(user, UNIT, lock_end, sender=deployer)
+    return discount, veyfi, oracle, management, users
+
+def simulate(n_teams, n_contributors, buy_fraction, delegate_fraction, seed):
+    """
+    @notice Run one month with `n_teams` teams sharing `n_contributors` contributors
+    @return List of per phase report rows
+    """
+    rng = random.Random(seed)
+    deployer = accounts.test_accounts[0]
+    now = chain.pending_timestamp
+    lock_ends = [0] * n_teams + [now + rng.choice(LOCK_WEEKS) * WEEK + WEEK for _ in range(n_contributors)]
+    lock_ends.append(now + DELEGATE_LOCK_WEEKS * WEEK)
+    discount, veyfi, oracle, management, users = setup(deployer, n_teams + n_contributors + 1, lock_ends)
+    teams = users[:n_teams]
+    contributors = users[n_teams:-1]
+    delegate = users[-1]
+    members = {team: contributors[i::n_teams] for i, team in enumerate(teams)}
+
+    phases = [Phase("set_team_allowances"), Phase("set_contributor_allowances"), Phase("buy")]
+    for i, batch in enumerate(chunks(teams)):
+        phases[0].send(
+            discount.set_team_allowances, batch, [len(members[t]) * ALLOWANCE for t in batch], i == 0, sender=management
+        )
+
+    for team in teams:
+        for batch in chunks(members[team]):
+            phases[1].send(discount.set_contributor_allowances, batch, [ALLOWANCE] * len(batch), sender=team)
+
+    oracle.set_price(2 * UNIT, sender=deployer)
+    buyers = rng.sample(contributors, round(len(contributors) * buy_fraction))
+    for buyer in buyers:
+        lock = delegate if rng.random() < delegate_fraction else buyer
+        phases[2].send(discount.buy, 0, lock, value=ALLOWANCE, sender=buyer)
+
+    rows = []
+    for phase in [*phases, None]:
+        selected = phases if phase is None else [phase]
+        transactions = sum(p.transactions for p in selected)
+        gas = sum(p.gas for p in selected)
+        seconds = sum(p.seconds for p in selected)
+        rows.append({
+            "teams": n_teams,
+            "contributors": n_contributors,
+            "buyers": len(buyers),
+            "phase": "total" if phase is None else phase.name,
+            "transactions": transactions,
+            "gas": gas,
+            "gas_per_contributor": round(gas / n_contributors),
+            "seconds": round(seconds, 3),
+            "tx_per_second": round(transactions / seconds, 1) if seconds else 0,
+        })
+    return rows
+
+def plot(rows, path):
+    try:
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise click.ClickException("plotting requires matplotlib")
+
+    totals = [r for r in rows if r["phase"] == "total"]
+    fig, (gas_ax, speed_ax) = plt.subplots(1, 2, figsize=(12, 5))
+    for n_teams in sorted({r["teams"] for r in totals}):
+        selected = [r for r in totals if r["teams"] == n_teams]
+        x = [r["contributors"] for r in selected]
+        gas_ax.plot(x, [r["gas_per_contributor"] for r in selected], marker="o", label=f"{n_teams} teams")
+        speed_ax.plot(x, [r["tx_per_second"] for r in selected], marker="o", label=f"{n_teams} teams")
+    gas_ax.set(xlabel="contributors", ylabel="gas per contributor", xscale="log")
+    speed_ax.set(xlabel="contributors", ylabel="transactions per second", xscale="log")
+    gas_ax.legend()
+    fig.tight_layout()
+    fig.savefig(path)
+
+@click.command(cls=ConnectedProviderCommand)
+@click.option("--teams", "team_counts", type=int, multiple=True, default=[10, 100, 1000], help="Number of teams, repeatable")
+@click.option("--contributors", "contributor_counts", type=int, multiple=True, default=[1000, 4000], help="Number of contributors, repeatable")
+@click.option("--buy-fraction", default=0.5, help="Fraction of contributors that buy")
+@click.option("--delegate-fraction", default=0.1, help="Fraction of purchases into a delegated lock")
+@click.option("--seed", default=0, help="Random seed")
+@click.option("--out", type=click.File("w"), default="-", help="CSV report, defaults to stdout")
+@click.option("--plot", "plot_path", help="Also plot the totals to this image file")
+def cli(team_counts, contributor_counts, buy_fraction, delegate_fraction, seed, out, plot_path):
+    """
+    Simulate allowance months on the local chain for every combination of team and contributor counts
+    """
+    rows = []
+    writer = csv.DictWriter(out, FIELDS)
+    writer.writeheader()
+    for n_teams in team_counts:
+        for n_contributors in contributor_counts:
+            if n_contributors < n_teams:
+                continue
+            snapshot = chain.snapshot()
+            try:
+                scenario = simulate(n_teams, n_contributors, buy_fraction, delegate_fraction, seed)
+            finally:
+                chain.restore(snapshot)
+            writer.writerows(scenario)
+            out.flush()
+            rows += scenario
+            total = scenario[-1]
+            click.echo(
+                f"{n_teams} teams, {n_contributors} contributors: {total['gas_per_contributor']} gas per contributor, "
+                f"{total['tx_per_second']} tx/s",
+                err=True,
+            )
+    if plot_path:
+        plot(rows, plot_path)
@@ -0,0 +1,242 @@
+"""
+Record and replay the mainnet state used by `tests/fork.py`.
+
+Recording runs the fork tests against an anvil fork whose upstream RPC goes through a
+proxy. Every code, balance, nonce and storage lookup of the fork is captured into a
+snapshot file, together with the fork block and the ABIs of the contracts the tests load.
+
+Replay starts anvil from a genesis block built from the snapshot, at the same block number
+and timestamp, so the tests run without any network access.
+"""
+import json
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import click
+
+CHAIN_ID = 31337
+GAS_LIMIT = 30_000_000
+STARTUP_TIMEOUT = 60
+STATE_METHODS = ["eth_getCode", "eth_getBalance", "eth_getTransactionCount", "eth_getStorageAt"]
+
+def rpc(uri, method, params):
+    request = urllib.request.Request(
+        uri,
+        json.dumps({"jsonrpc": "2.0", "id": 1, "method": method, "params": params}).encode(),
+        {"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request) as response:
+        result = json.load(response)
+    if "error" in result:
+        raise RuntimeError(f"{method}: {result['error']}")
+    return result["result"]
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def word(value):
+    return "0x" + int(value, 16).to_bytes(32, "big").hex()
+
+class RecordingProxy:
+    def __init__(self, upstream):
+        """
+        @param upstream RPC URL that requests are forwarded to
+        """
+        self.upstream = upstream
+        self.accounts = {}
+        self.lock = threading.Lock()
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                request = urllib.request.Request(proxy.upstream, body, {"Content-Type": "application/json"})
+                with urllib.request.urlopen(request) as response:
+                    data = response.read()
+                proxy.record(json.loads(body), json.loads(data))
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+
+    @property
+    def uri(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def record(self, request, response):
+        """
+        @notice Store the results of state lookups in a single or batched JSON-RPC exchange
+        """
+        requests = request if isinstance(request, list) else [request]
+        responses = response if isinstance(response, list) else [response]
+        results = {r["id"]: r.get("result") for r in responses}
+        with self.lock:
+            for r in requests:
+                result = results.get(r["id"])
+                if r["method"] not in STATE_METHODS or result is None:
+                    continue
+                account = self.accounts.setdefault(
+                    r["params"][0].lower(), {"code": "0x", "balance": "0x0", "nonce": "0x0", "storage": {}}
+                )
+                if r["method"] == "eth_getCode":
+                    account["code"] = result
+                elif r["method"] == "eth_getBalance":
+                    account["balance"] = result
+                elif r["method"] == "eth_getTransactionCount":
+                    account["nonce"] = result
+                else:
+                    account["storage"][word(r["params"][1])] = word(result)
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+def touched(accounts):
+    """
+    @notice Drop accounts without any state, i.e. lookups of addresses that only exist on the local chain
+    """
+    return {
+        address: account for address, account in accounts.items()
+        if account["code"] != "0x" or int(account["balance"], 16) or int(account["nonce"], 16)
+        or any(int(v, 16) for v in account["storage"].values())
+    }
+
+def to_genesis(snapshot):
+    """
+    @notice Genesis file for anvil `--init` that contains the state of the snapshot
+    """
+    return {
+        "config": {"chainId": CHAIN_ID},
+        "number": hex(snapshot["block"]["number"]),
+        "timestamp": hex(snapshot["block"]["timestamp"]),
+        "gasLimit": hex(GAS_LIMIT),
+        "difficulty": "0x0",
+        "alloc": snapshot["accounts"],
+    }
+
+@contextmanager
+def anvil(*args):
+    """
+    @notice Run an anvil node on a free port
+    @return RPC URL of the node
+    """
+    port = free_port()
+    process = subprocess.Popen(
+        [shutil.which("anvil"), "--port", str(port), "--block-base-fee-per-gas", "0", "--gas-price", "0", *args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    uri = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            try:
+                rpc(uri, "eth_chainId", [])
+                break
+            except OSError:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise RuntimeError("anvil did not start")
+                time.sleep(0.05)
+        yield uri
+    finally:
+        process.terminate()
+        process.wait()
+
+def load_state(uri, snapshot):
+    """
+    @notice Read all state of the snapshot from a node, which makes a fork fetch it from upstream
+    """
+    for address, account in snapshot["accounts"].items():
+        rpc(uri, "eth_getCode", [address, "latest"])
+        rpc(uri, "eth_getBalance", [address, "latest"])
+        for slot in account["storage"]:
+            rpc(uri, "eth_getStorageAt", [address, slot, "latest"])
+
+@contextmanager
+def replay(snapshot):
+    """
+    @notice Run a local node seeded with the state of a snapshot
+    @return Tuple of RPC URL and startup time in seconds
+    """
+    with TemporaryDirectory() as tmp:
+        genesis = Path(tmp) / "genesis.json"
+        genesis.write_text(json.dumps(to_genesis(snapshot)))
+        start = time.perf_counter()
+        with anvil("--init", str(genesis)) as uri:
+            load_state(uri, snapshot)
+            yield uri, time.perf_counter() - start
+
+def fork_startup(upstream, snapshot):
+    """
+    @notice Time to start a fork without cache and fetch the state of a snapshot
+    """
+    start = time.perf_counter()
+    with anvil("--fork-url", upstream, "--fork-block-number", str(snapshot["block"]["number"]), "--no-storage-caching") as uri:
+        load_state(uri, snapshot)
+        return time.perf_counter() - start
+
+def load(path):
+    return json.loads(Path(path).read_text())
+
+@click.group()
+def cli():
+    """
+    Snapshots of the mainnet state used by the fork tests
+    """
+
+@cli.command()
+@click.argument("upstream")
+@click.option("--block", type=int, help="Fork block, defaults to the latest block")
+@click.option("--contract", "contracts", multiple=True, help="Address of a contract whose ABI the tests load")
+@click.option("--tests", default="tests/fork.py", help="Tests to record")
+@click.option("--out", default="tests/fork_snapshot.json", help="Snapshot file")
+def record(upstream, block, contracts, tests, out):
+    """
+    Record the state used by the fork tests from the mainnet RPC at UPSTREAM
+    """
+    from ape import accounts, networks
+
+    if block is None:
+        block = int(rpc(upstream, "eth_blockNumber", []), 16)
+    header = rpc(upstream, "eth_getBlockByNumber", [hex(block), False])
+
+    with RecordingProxy(upstream) as proxy:
+        with anvil("--fork-url", proxy.uri, "--fork-block-number", str(block), "--no-storage-caching") as uri:
+            result = subprocess.run(
+                ["ape", "test", tests, "--network", "ethereum:mainnet-fork:foundry"],
+                env={**os.environ, "APE_FOUNDRY_HOST": uri},
+            )
+            assert result.returncode == 0, "fork tests failed"
+
+    # test accounts are funded by anvil itself
+    test_accounts = {a.address.lower() for a in accounts.test_accounts}
+    explorer = networks.ethereum.mainnet.explorer
+    snapshot = {
+        "block": {"number": block, "timestamp": int(header["timestamp"], 16)},
+        "accounts": {a: s for a, s in touched(proxy.accounts).items() if a not in test_accounts},
+        "contract_types": {c.lower(): explorer.get_contract_type(c).model_dump(mode="json", by_alias=True) for c in contracts},
+    }
+    snapshot["fork_startup"] = fork_startup(upstream, snapshot)
+    Path(out).write_text(json.dumps(snapshot, indent=1))
+    click.echo(f"recorded {len(snapshot['accounts'])} accounts at block {block} to {out}")
@@ -0,0 +1,239 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+from eth_hash.auto import keccak
+from eth_keys import keys
+
+from scripts.merkle import MerkleTree
+from scripts.packed import encode_allowances
+from scripts.relayer import ZERO_ADDRESS, Intent, sign_intent
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+UNIT = 10**18
+GAS_LIMIT = 1_000_000
+
+BATCH_SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 256]
+TREE_SIZES = [1, 256, 4096, 65536]
+INTENT_SIZES = [1, 16, 64]
+PACKED_SIZES = [32, 128, 256]
+ORACLE_CACHE = {False: "uncached", True: "cached"}
+BASELINE = Path(__file__).parent / "gas_baseline.json"
+TOLERANCE = float(os.environ.get("GAS_TOLERANCE", "0.01"))
+UPDATE = os.environ.get("GAS_UPDATE", "0") == "1"
+
+def addresses(n, offset=0):
+    return [f"0x{i + offset + 1:040x}" for i in range(n)]
+
+def allocation_rows(n, offset=0):
+    # addresses and amounts without the zero bytes of `addresses`, calldata cost depends on them
+    accounts = ["0x" + keccak((i + offset).to_bytes(32, "big"))[12:].hex() for i in range(n)]
+    return accounts, [UNIT + i * 10**15 for i in range(n)]
+
+@pytest.fixture(scope="module")
+def gas():
+    """
+    Record gas measurements and compare them against the stored baseline.
+    Measurements without a baseline entry fail, `GAS_UPDATE=1` writes all measurements to the baseline instead.
+    """
+    baseline = json.loads(BASELINE.read_text()) if BASELINE.exists() else {}
+    measured = {}
+
+    def record(name, value):
+        measured[name] = value
+        if UPDATE:
+            return
+        assert name in baseline, f"{name}: no baseline, run with GAS_UPDATE=1 to add it"
+        limit = baseline[name] * (1 + TOLERANCE)
+        assert value <= limit, f"{name}: {value} gas, baseline {baseline[name]}"
+
+    yield record
+
+    if UPDATE:
+        baseline.update(measured)
+        BASELINE.write_text(json.dumps(dict(sorted(baseline.items())), indent=2) + "\n")
+
+@pytest.fixture
+def setup_buy(chain, deployer, management, alice, bob, charlie, yfi, veyfi, oracle, discount):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    discount.set_team_allowances([alice], [10 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob], [10 * UNIT], sender=alice)
+    end = chain.pending_timestamp // WEEK * WEEK + 5 * 52 * WEEK
+    veyfi.set_locked(bob, UNIT, end, sender=deployer)
+    veyfi.set_locked(charlie, UNIT, end, sender=deployer)
+    yfi.mint(discount, 100 * UNIT, sender=deployer)
+
+@pytest.mark.parametrize("size", BATCH_SIZES)
+def test_set_team_allowances(gas, management, discount, size):
+    tx = discount.set_team_allowances(addresses(size), [UNIT] * size, sender=management)
+    gas(f"set_team_allowances[{size}]", tx.gas_used)
+
+@pytest.mark.parametrize("size", BATCH_SIZES)
+def test_set_team_allowances_overwrite(gas, management, discount, size):
+    teams = addresses(size)
+    discount.set_team_allowances(teams, [UNIT] * size, sender=management)
+    tx = discount.set_team_allowances(teams, [2 * UNIT] * size, False, sender=management)
+    gas(f"set_team_allowances_overwrite[{size}]", tx.gas_used)
+
+@pytest.mark.parametrize("size", BATCH_SIZES)
+def test_set_contributor_allowances(gas, management, alice, discount, size):
+    discount.set_team_allowances([alice], [size * UNIT], sender=management)
+    tx = discount.set_contributor_allowances(addresses(size), [UNIT] * size, sender=alice)
+    gas(f"set_contributor_allowances[{size}]", tx.gas_used)
+
+@pytest.mark.parametrize("size", BATCH_SIZES)
+def test_set_contributor_allowances_add(gas, management, alice, discount, size):
+    contributors = addresses(size)
+    discount.set_team_allowances([alice], [2 * size * UNIT], sender=management)
+    discount.set_contributor_allowances(contributors, [UNIT] * size, sender=alice)
+    tx = discount.set_contributor_allowances(contributors, [UNIT] * size, sender=alice)
+    gas(f"set_contributor_allowances_add[{size}]", tx.gas_used)
+
+@pytest.mark.parametrize("size", PACKED_SIZES)
+def test_set_team_allowances_packed(gas, management, discount, size):
+    # both calls start a month and write to empty allowance slots, each gets its own teams
+    discount.new_month(sender=management)
+    teams, allowances = allocation_rows(size)
+    abi = discount.set_team_allowances(teams, allowances, sender=management)
+    teams, allowances = allocation_rows(size, size)
+    packed = discount.set_team_allowances_packed(teams, encode_allowances(allowances), sender=management)
+    gas(f"set_team_allowances_abi[{size}]", abi.gas_used)
+    gas(f"set_team_allowances_packed[{size}]", packed.gas_used)
+    assert packed.gas_used < abi.gas_used
+
+@pytest.mark.parametrize("size", PACKED_SIZES)
+def test_set_contributor_allowances_packed(gas, management, alice, discount, size):
+    contributors, allowances = allocation_rows(size)
+    discount.set_team_allowances([alice], [2 * sum(allowances)], sender=management)
+    abi = discount.set_contributor_allowances(contributors, allowances, sender=alice)
+    contributors, allowances = allocation_rows(size, size)
+    packed = discount.set_contributor_allowances_packed(contributors, encode_allowances(allowances), sender=alice)
+    gas(f"set_contributor_allowances_abi[{size}]", abi.gas_used)
+    gas(f"set_contributor_allowances_packed[{size}]", packed.gas_used)
+    assert packed.gas_used < abi.gas_used
+
+def test_set_team_allowances_per_entry(gas, management, discount):
+    discount.set_team_allowances([], [], sender=management)
+    small = discount.set_team_allowances(addresses(128), [UNIT] * 128, sender=management)
+    large = discount.set_team_allowances(addresses(256, 128), [UNIT] * 256, sender=management)
+    gas("set_team_allowances_per_entry", (large.gas_used - small.gas_used) // 128)
+
+def test_set_contributor_allowances_per_entry(gas, management, alice, discount):
+    discount.set_team_allowances([alice], [384 * UNIT], sender=management)
+    small = discount.set_contributor_allowances(addresses(128), [UNIT] * 128, sender=alice)
+    large = discount.set_contributor_allowances(addresses(256, 128), [UNIT] * 256, sender=alice)
+    gas("set_contributor_allowances_per_entry", (large.gas_used - small.gas_used) // 128)
+
+def test_buy(gas, bob, discount, setup_buy):
+    tx = discount.buy(0, value=UNIT, sender=bob)
+    gas("buy", tx.gas_used)
+
+def test_buy_callback(gas, bob, discount, callback, setup_buy):
+    tx = discount.buy(0, bob, callback, value=UNIT, sender=bob)
+    gas("buy_callback", tx.gas_used)
+
+def test_buy_delegate(gas, bob, charlie, discount, setup_buy):
+    tx = discount.buy(0, charlie, value=UNIT, sender=bob)
+    gas("buy_delegate", tx.gas_used)
+
+def test_buy_delegate_callback(gas, bob, charlie, discount, callback, setup_buy):
+    tx = discount.buy(0, charlie, callback, value=UNIT, sender=bob)
+    gas("buy_delegate_callback", tx.gas_used)
+
+def test_new_month(gas, management, discount):
+    discount.new_month(sender=management)
+    tx = discount.new_month(sender=management)
+    gas("new_month", tx.gas_used)
+
+@pytest.mark.parametrize("size", BATCH_SIZES)
+def test_set_contributor_allowances_standing(gas, management, alice, discount, size):
+    discount.set_standing_allowances([alice], [size * UNIT], sender=management)
+    discount.new_month(sender=management)
+    tx = discount.set_contributor_allowances(addresses(size), [UNIT] * size, sender=alice)
+    gas(f"set_contributor_allowances_standing[{size}]", tx.gas_used)
+
+def test_set_contributor_root(gas, management, discount):
+    tx = discount.set_contributor_root(b"\x01" * 32, sender=management)
+    gas("set_contributor_root", tx.gas_used)
+
+@pytest.mark.parametrize("size", TREE_SIZES)
+def test_buy_with_proof(gas, chain, deployer, management, bob, yfi, veyfi, oracle, discount, size):
+    allowances = {address: UNIT for address in addresses(size - 1)}
+    allowances[bob.address] = 10 * UNIT
+    tree = MerkleTree(allowances, 1)
+    proof = tree.proof(bob.address)
+
+    oracle.set_price(2 * UNIT, sender=deployer)
+    discount.set_contributor_root(tree.root, sender=management)
+    veyfi.set_locked(bob, UNIT, chain.pending_timestamp // WEEK * WEEK + 5 * 52 * WEEK, sender=deployer)
+    yfi.mint(discount, 100 * UNIT, sender=deployer)
+    tx = discount.buy_with_proof(10 * UNIT, proof, 0, value=UNIT, sender=bob)
+    gas(f"buy_with_proof[{size}]", tx.gas_used)
+    tx = discount.buy_with_proof(10 * UNIT, [], 0, value=UNIT, sender=bob)
+    gas(f"buy_with_proof_claimed[{size}]", tx.gas_used)
+
+@pytest.mark.parametrize("size", INTENT_SIZES)
+def test_settle(gas, chain, deployer, management, alice, yfi, veyfi, oracle, discount, size):
+    signers = [keys.PrivateKey((i + 1).to_bytes(32, "big")) for i in range(size)]
+    contributors = [signer.public_key.to_checksum_address() for signer in signers]
+    oracle.set_price(2 * UNIT, sender=deployer)
+    discount.set_team_allowances([alice], [size * UNIT], sender=management)
+    discount.set_contributor_allowances(contributors, [UNIT] * size, sender=alice)
+    end = chain.pending_timestamp // WEEK * WEEK + 5 * 52 * WEEK
+    for contributor in contributors:
+        veyfi.set_locked(contributor, UNIT, end, sender=deployer)
+        discount.deposit(contributor, value=UNIT, sender=deployer)
+    yfi.mint(discount, 100 * UNIT, sender=deployer)
+
+    domain = discount.domain_separator()
+    deadline = chain.pending_timestamp + DAY
+    intents = [
+        sign_intent(Intent(contributor, UNIT, 0, contributor, ZERO_ADDRESS, deadline, 0), domain, signer.to_bytes())
+        for contributor, signer in zip(contributors, signers)
+    ]
+    tx = discount.settle([intent.as_tuple() for intent in intents], sender=deployer)
+    gas(f"settle[{size}]", tx.gas_used)
+    gas(f"settle_per_intent[{size}]", tx.gas_used // size)
+
+def test_preview(gas, bob, discount, setup_buy):
+    gas("preview", discount.preview.estimate_gas_cost(bob, UNIT, False))
+
+def test_preview_delegate(gas, charlie, discount, setup_buy):
+    gas("preview_delegate", discount.preview.estimate_gas_cost(charlie, UNIT, True))
+
+def test_double_oracle(gas, project, deployer):
+    yfi_oracle = project.MockChainlinkFeed.deploy(sender=deployer)
+    eth_oracle = project.MockChainlinkFeed.deploy(sender=deployer)
+    yfi_oracle.set_price(5_000 * 10**8, sender=deployer)
+    eth_oracle.set_price(2_000 * 10**8, sender=deployer)
+    chainlink_oracle = project.DoubleChainlinkOracle.deploy(yfi_oracle, eth_oracle, sender=deployer)
+    assert chainlink_oracle.latestRoundData().answer == 5 * UNIT // 2
+    gas("double_oracle_latest_round_data", chainlink_oracle.latestRoundData.estimate_gas_cost())
+
+def test_buy_oracle_cache(gas, project, chain, deployer, management, alice, bob, charlie, yfi, veyfi, same_block):
+    yfi_oracle = project.MockChainlinkFeed.deploy(sender=deployer)
+    eth_oracle = project.MockChainlinkFeed.deploy(sender=deployer)
+    yfi_oracle.set_price(5_000 * 10**8, sender=deployer)
+    eth_oracle.set_price(2_000 * 10**8, sender=deployer)
+    chainlink_oracle = project.DoubleChainlinkOracle.deploy(yfi_oracle, eth_oracle, sender=deployer)
+    end = chain.pending_timestamp // WEEK * WEEK + 5 * 52 * WEEK
+    veyfi.set_locked(bob, UNIT, end, sender=deployer)
+    veyfi.set_locked(charlie, UNIT, end, sender=deployer)
+
+    second = {}
+    for cache, label in ORACLE_CACHE.items():
+        discount = project.Discount.deploy(yfi, veyfi, chainlink_oracle, management, cache, sender=deployer)
+        discount.set_team_allowances([alice], [10 * UNIT], sender=management)
+        discount.set_contributor_allowances([bob, charlie], [5 * UNIT, 5 * UNIT], sender=alice)
+        yfi.mint(discount, 100 * UNIT, sender=deployer)
+
+        # the first purchase of the block reads the oracle, the second one reuses its round if the cache is enabled
+        first, second[cache] = same_block(
+            lambda: discount.buy(0, value=UNIT, sender=bob, gas_limit=GAS_LIMIT),
+            lambda: discount.buy(0, value=UNIT, sender=charlie, gas_limit=GAS_LIMIT),
+        )
+        gas(f"buy_double_oracle_first[{label}]", first.gas_used)
+        gas(f"buy_double_oracle[{label}]", second[cache].gas_used)
+    assert second[True].gas_used < second[False].gas_used
@@ -0,0 +1,101 @@
+"""
+Accounts, mock contracts and helpers shared by the test modules.
+
+Contracts are deployed once per module, the test isolation of ape reverts the chain to the
+state after deployment before every test.
+"""
+import pytest
+
+from scripts.relayer import intent_digest
+
+WEEK = 7 * 24 * 60 * 60
+UNIT = 10**18
+
+@pytest.fixture(scope="module")
+def deployer(accounts):
+    return accounts[0]
+
+@pytest.fixture(scope="module")
+def management(accounts):
+    return accounts[1]
+
+@pytest.fixture(scope="module")
+def alice(accounts):
+    return accounts[2]
+
+@pytest.fixture(scope="module")
+def bob(accounts):
+    return accounts[3]
+
+@pytest.fixture(scope="module")
+def charlie(accounts):
+    return accounts[4]
+
+@pytest.fixture(scope="module")
+def yfi(project, deployer):
+    return project.MockToken.deploy(sender=deployer)
+
+@pytest.fixture(scope="module")
+def veyfi(project, deployer, yfi):
+    return project.MockVotingEscrow.deploy(yfi, sender=deployer)
+
+@pytest.fixture(scope="module")
+def oracle(project, deployer):
+    return project.MockPriceOracle.deploy(sender=deployer)
+
+@pytest.fixture(scope="module")
+def discount(project, deployer, management, yfi, veyfi, oracle):
+    return project.Discount.deploy(yfi, veyfi, oracle, management, False, sender=deployer)
+
+@pytest.fixture(scope="module")
+def cached_discount(project, deployer, management, yfi, veyfi, oracle):
+    return project.Discount.deploy(yfi, veyfi, oracle, management, True, sender=deployer)
+
+@pytest.fixture(scope="module")
+def callback(project, deployer):
+    return project.MockCallback.deploy(sender=deployer)
+
+@pytest.fixture
+def setup_oracle_cache(chain, deployer, management, alice, yfi, veyfi, oracle):
+    """
+    Give contributors an allowance of alice and a long lock each, at a price of 2
+    """
+    def setup(discount, contributors):
+        oracle.set_price(2 * UNIT, sender=deployer)
+        discount.set_team_allowances([alice], [len(contributors) * UNIT], sender=management)
+        discount.set_contributor_allowances(contributors, [UNIT] * len(contributors), sender=alice)
+        end = chain.pending_timestamp // WEEK * WEEK + 5 * 52 * WEEK
+        for contributor in contributors:
+            veyfi.set_locked(contributor, UNIT, end, sender=deployer)
+        yfi.mint(discount, 10 * UNIT, sender=deployer)
+
+    return setup
+
+@pytest.fixture
+def same_block(chain):
+    """
+    Mine transactions into a single block, purchases in it share the cached oracle round.
+    Without automine a transaction defaults to the gas limit of the block, pass a lower `gas_limit`
+    """
+    def send(*transactions):
+        chain.provider.auto_mine = False
+        try:
+            hashes = [transaction().txn_hash for transaction in transactions]
+            chain.mine()
+        finally:
+            chain.provider.auto_mine = True
+        return [chain.provider.get_receipt(txn_hash) for txn_hash in hashes]
+
+    return send
+
+@pytest.fixture(scope="session")
+def sign():
+    """
+    Sign a buy intent with a test account, like a contributor would in their wallet
+    """
+    def sign(account, discount, intent):
+        signature = account.sign_raw_msghash(intent_digest(intent, discount.domain_separator()))
+        intent.v, intent.r, intent.s = signature.v, int.from_bytes(signature.r, "big"), int.from_bytes(signature.s, "big")
+        return intent
+
+    return sign
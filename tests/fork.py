@@ -1,7 +1,13 @@
+import os
+from pathlib import Path
+
 import ape
 from ape import Contract
+from ethpm_types import ContractType
 import pytest
 
+from scripts import snapshot
+
 DAY = 24 * 60 * 60
 WEEK = 7 * DAY
 UNIT = 10**18
@@ -13,6 +19,35 @@ CHAINLINK_ORACLE = '0x7c5d4F8345e66f68099581Db340cd65B078C41f4'
 YFIUSD_CHAINLINK_ORACLE = '0xA027702dbb89fbd58938e4324ac03B58d812b0E1'
 ETHUSD_CHAINLINK_ORACLE = '0x5f4eC3Df9cbd43714FE2740f5E3616155c5b8419'
 YCHAD = '0xFEB4acf3df3cDEA7399794D0869ef76A6EfAff52'
+SNAPSHOT = Path(__file__).parent / 'fork_snapshot.json'
+SKIP = os.environ.get('FORK_SKIP', '0') == '1'
+
+@pytest.fixture(scope='module', autouse=True)
+def fork_state(request, networks, chain):
+    # on a mainnet fork run against live state, otherwise replay the recorded snapshot
+    if chain.provider.network.is_fork:
+        yield None
+        return
+    if not SNAPSHOT.exists():
+        # a missing snapshot fails the run, unless the fork tests are explicitly skipped
+        message = f'no {SNAPSHOT.name}, record it with `ape run snapshot record <rpc> --contract {YFI} --contract {VEYFI} --contract {CHAINLINK_ORACLE}`'
+        if SKIP:
+            pytest.skip(f'{message} (FORK_SKIP=1)')
+        pytest.fail(message, pytrace=False)
+
+    state = snapshot.load(SNAPSHOT)
+    with snapshot.replay(state) as (uri, startup):
+        reporter = request.config.pluginmanager.get_plugin('terminalreporter')
+        reporter.write_line(
+            f"replay startup {startup:.2f}s, live fork {state['fork_startup']:.2f}s ({state['fork_startup'] / startup:.1f}x faster)"
+        )
+        with networks.ethereum.local.use_provider('foundry', provider_settings={'host': uri}):
+            yield state
+
+def contract(address, fork_state):
+    if fork_state is None:
+        return Contract(address)
+    return Contract(address, contract_type=ContractType.model_validate(fork_state['contract_types'][address.lower()]))
 
 @pytest.fixture
 def deployer(accounts):
@@ -39,12 +74,12 @@ def ychad(accounts):
     return accounts[YCHAD]
 
 @pytest.fixture
-def yfi():
-    return Contract(YFI)
+def yfi(fork_state):
+    return contract(YFI, fork_state)
 
 @pytest.fixture
-def veyfi():
-    return Contract(VEYFI)
+def veyfi(fork_state):
+    return contract(VEYFI, fork_state)
 
 @pytest.fixture
 def chainlink_oracle(project, deployer):
@@ -52,7 +87,7 @@ def chainlink_oracle(project, deployer):
 
 @pytest.fixture
 def discount(project, deployer, management, yfi, veyfi, chainlink_oracle):
-    return project.Discount.deploy(yfi, veyfi, chainlink_oracle, management, sender=deployer)
+    return project.Discount.deploy(yfi, veyfi, chainlink_oracle, management, False, sender=deployer)
 
 def test_oracle(chainlink_oracle, discount):
     assert discount.spot_price() == chainlink_oracle.latestRoundData().answer
@@ -86,8 +121,8 @@ def test_buy(chain, management, alice, bob, ychad, yfi, veyfi, discount):
     discount.buy(0, value=price, sender=alice)
     assert abs(veyfi.locked(alice).amount / 2 / UNIT - 1) < 1e-10
 
-def test_double_oracle(chainlink_oracle):
-    oracle = Contract(CHAINLINK_ORACLE)
+def test_double_oracle(fork_state, chainlink_oracle):
+    oracle = contract(CHAINLINK_ORACLE, fork_state)
     a = oracle.latestRoundData()[1]
     b = chainlink_oracle.latestRoundData()[1]
     assert abs(a-b)/a < 0.01
@@ -0,0 +1,573 @@
+"""
+Stateful fuzzing of the allowance and buy state machine.
+
+Every run executes a random sequence of management, team and contributor actions against
+a single deployment, predicts the outcome of each call with a python model and checks
+invariants after every step. The contracts are deployed once per module and reset between
+runs through the chain snapshot of the test isolation, instead of being redeployed.
+
+The actions cover team allowances, standing allowances, contributor allowances, merkle
+roots and claims, purchases, deposits and signed intents settled in batches. Runs alternate
+between a deployment without and one with oracle cache, whose cached round is part of the
+model.
+
+Invariants are checked on raw storage, which is an order of magnitude faster to read than
+calling the views. Allowances and their conservation are checked after every step, the rest
+of the storage every `CHECK_INTERVAL` steps. The views are checked for every account an
+action touches.
+
+`FUZZ_RUNS` and `FUZZ_STEPS` control the number of sequences and their length,
+`FUZZ_SEED` selects the first seed. A failing check reports the last `TRACE_STEPS` steps
+leading up to it.
+"""
+import os
+import random
+
+import ape
+import pytest
+from eth_abi import encode
+from eth_hash.auto import keccak
+
+from scripts import quote
+from scripts.layout import SLOTS
+from scripts.merkle import MerkleTree
+from scripts.relayer import ZERO_ADDRESS, Intent
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+UNIT = 10**18
+ALLOWANCE_EXPIRATION_TIME = 30 * DAY
+ORACLE_STALE_TIME = 2 * 60 * 60
+SUPPLY = 10**6 * UNIT
+MONTH_SHIFT = 192
+ALLOWANCE_MASK = 2**192 - 1
+ROUND_CACHED_SHIFT = 128
+
+RUNS = int(os.environ.get("FUZZ_RUNS", "10"))
+STEPS = int(os.environ.get("FUZZ_STEPS", "300"))
+SEED = int(os.environ.get("FUZZ_SEED", "0"))
+CHECK_INTERVAL = 10
+TRACE_STEPS = 20
+
+@pytest.fixture(scope="module")
+def users(accounts):
+    return [accounts[i] for i in range(2, 8)]
+
+class Model:
+    """
+    Expected state of the contracts
+    """
+    def __init__(self, now, cache):
+        self.now = now
+        self.cache = cache
+        self.month = 0
+        self.expiration = 0
+        self.teams = {}
+        self.standing = {}
+        self.contributors = {}
+        self.trees = {}
+        self.claims = {}
+        self.nonces = {}
+        self.deposits = {}
+        self.locks = {}
+        self.price = 0
+        self.updated = 0
+        # cached oracle round: price and the time of the block it was cached in
+        self.round = (0, 0)
+        self.issued = 0
+
+    def allowance(self, allowances, account, now):
+        amount, month = allowances.get(account, (0, 0))
+        return amount if month == self.month and now < self.expiration else 0
+
+    def team_allowance(self, team, now):
+        if now >= self.expiration:
+            return 0
+        return self.stored_team_allowance(team)
+
+    def stored_team_allowance(self, team):
+        # teams without an allowance this month fall back to their standing allowance
+        amount, month = self.teams.get(team, (0, 0))
+        return amount if month == self.month else self.standing.get(team, 0)
+
+    def new_month(self):
+        self.month += 1
+        self.expiration = self.now + ALLOWANCE_EXPIRATION_TIME
+        self.issued = sum(self.standing.values())
+
+    def spot_price(self, now):
+        """
+        @return Price a purchase at `now` uses and whether it was read from the oracle, or None if it reverts
+        """
+        price, cached = self.round
+        if self.cache and cached == now:
+            return price, False
+        if now >= self.updated + ORACLE_STALE_TIME:
+            return None
+        return self.price, True
+
+    def update_spot_price(self, now):
+        """
+        @notice Price of a successful purchase at `now`, caching the oracle round like `_update_spot_price`
+        """
+        price, read = self.spot_price(now)
+        if read and self.cache:
+            self.round = (price, now)
+        return price
+
+class Fuzzer:
+    def __init__(self, seed, chain, deployer, management, users, yfi, veyfi, oracle, discount, sign):
+        self.rng = random.Random(seed)
+        self.chain = chain
+        self.deployer = deployer
+        self.management = management
+        self.users = users
+        self.yfi = yfi
+        self.veyfi = veyfi
+        self.oracle = oracle
+        self.discount = discount
+        self.sign = sign
+        self.model = Model(chain.pending_timestamp + 1, discount.oracle_cache())
+        self.spent = 0
+        self.bought = 0
+        self.steps = 0
+        self.trace = []
+
+    def log(self, step):
+        self.trace.append(step)
+
+    def transact(self, method, *args, reverts=False, **kwargs):
+        # pin the block timestamp, so the model knows when each transaction executes
+        self.chain.pending_timestamp = self.model.now
+        try:
+            if reverts:
+                with ape.reverts():
+                    method(*args, **kwargs)
+                return None
+            return method(*args, **kwargs)
+        finally:
+            self.model.now += self.rng.randrange(1, 60)
+
+    def pick(self, allowances):
+        # mostly pick accounts that have an allowance, to get past the first checks
+        funded = [u for u in self.users if self.model.allowance(allowances, u, self.model.now) > 0]
+        return self.rng.choice(funded if funded and self.rng.random() < 0.8 else self.users)
+
+    def pick_team(self):
+        m = self.model
+        funded = [u for u in self.users if m.team_allowance(u, m.now) > 0]
+        return self.rng.choice(funded if funded and self.rng.random() < 0.8 else self.users)
+
+    def amount(self, high):
+        # boundary values in a quarter of the cases
+        if self.rng.random() < 0.25:
+            return self.rng.choice([0, 1, high])
+        return self.rng.randrange(0, high + 1)
+
+    def new_month_flag(self):
+        # mostly start a new month once the current one has expired
+        m = self.model
+        return self.rng.random() < (0.9 if m.expiration <= m.now else 0.3)
+
+    def set_team_allowances(self):
+        m = self.model
+        new_month = self.new_month_flag()
+        teams = self.rng.sample(self.users, self.rng.randrange(1, 4))
+        amounts = [self.amount(10 * UNIT) for _ in teams]
+        self.log(f"set_team_allowances({[t.address[:6] for t in teams]}, {amounts}, {new_month})")
+
+        if not new_month and m.expiration <= m.now:
+            self.transact(self.discount.set_team_allowances, teams, amounts, False, sender=self.management, reverts=True)
+            return
+        if new_month:
+            m.new_month()
+            self.spent = 0
+        self.transact(self.discount.set_team_allowances, teams, amounts, new_month, sender=self.management)
+        for team, amount in zip(teams, amounts):
+            m.issued += amount - m.stored_team_allowance(team)
+            m.teams[team] = (amount, m.month)
+        self.check_views(teams)
+
+    def set_standing_allowances(self):
+        m = self.model
+        teams = self.rng.sample(self.users, self.rng.randrange(1, 3))
+        amounts = [self.rng.choice([0, self.amount(5 * UNIT)]) for _ in teams]
+        self.log(f"set_standing_allowances({[t.address[:6] for t in teams]}, {amounts})")
+
+        self.transact(self.discount.set_standing_allowances, teams, amounts, sender=self.management)
+        for team, amount in zip(teams, amounts):
+            # only teams that did not get or use an allowance this month see the change
+            if m.teams.get(team, (0, 0))[1] != m.month:
+                m.issued += amount - m.standing.get(team, 0)
+            m.standing[team] = amount
+        self.check_views(teams)
+
+    def new_month(self):
+        m = self.model
+        self.log("new_month()")
+        m.new_month()
+        self.spent = 0
+        self.transact(self.discount.new_month, sender=self.management)
+        self.check_views(self.users)
+
+    def set_contributor_allowances(self):
+        m = self.model
+        team = self.pick_team()
+        contributors = self.rng.sample(self.users, self.rng.randrange(1, 4))
+        available = m.team_allowance(team, m.now)
+        amounts = [self.amount(available // len(contributors) + self.rng.choice([0, 0, 0, UNIT])) for _ in contributors]
+        self.log(f"set_contributor_allowances({[c.address[:6] for c in contributors]}, {amounts}, sender={team.address[:6]})")
+
+        if available == 0 or sum(amounts) > available:
+            self.transact(self.discount.set_contributor_allowances, contributors, amounts, sender=team, reverts=True)
+            return
+        self.transact(self.discount.set_contributor_allowances, contributors, amounts, sender=team)
+        m.teams[team] = (available - sum(amounts), m.month)
+        for contributor, amount in zip(contributors, amounts):
+            if amount > 0:
+                m.contributors[contributor] = (m.allowance(m.contributors, contributor, m.now) + amount, m.month)
+        self.check_views([team, *contributors])
+
+    def set_contributor_root(self):
+        m = self.model
+        new_month = self.new_month_flag()
+        contributors = self.rng.sample(self.users, self.rng.randrange(1, len(self.users) + 1))
+        allowances = {c.address: self.amount(5 * UNIT) for c in contributors}
+        month = m.month + 1 if new_month else m.month
+        tree = MerkleTree(allowances, month)
+        self.log(f"set_contributor_root({ {c[:6]: a for c, a in allowances.items()} }, {new_month})")
+
+        if not new_month and m.expiration <= m.now:
+            self.transact(self.discount.set_contributor_root, tree.root, False, sender=self.management, reverts=True)
+            return
+        if new_month:
+            m.new_month()
+            self.spent = 0
+        self.transact(self.discount.set_contributor_root, tree.root, new_month, sender=self.management)
+        m.trees[month] = tree
+
+    def time_jump(self):
+        jump = self.rng.choice([ORACLE_STALE_TIME, DAY, DAY, WEEK, WEEK, ALLOWANCE_EXPIRATION_TIME]) + self.rng.randrange(-60, 60)
+        self.log(f"time_jump({jump})")
+        self.model.now += jump
+
+    def set_price(self):
+        m = self.model
+        price = self.rng.randrange(UNIT, 10 * UNIT)
+        updated = m.now - self.rng.choice([0, 0, 0, self.rng.randrange(ORACLE_STALE_TIME + 60)])
+        self.log(f"set_price({price}, {updated})")
+        self.transact(self.oracle.set_price, price, updated, sender=self.deployer)
+        m.price, m.updated = price, updated
+
+    def set_locked(self, account=None):
+        m = self.model
+        account = account or self.rng.choice(self.users)
+        amount = self.rng.choice([0, UNIT, self.rng.randrange(1, 100 * UNIT), self.rng.randrange(1, 100 * UNIT)])
+        end = (m.now // WEEK + self.rng.randrange(-2, 260)) * WEEK + self.rng.randrange(WEEK)
+        self.log(f"set_locked({account.address[:6]}, {amount}, {end})")
+        self.transact(self.veyfi.set_locked, account, amount, end, sender=self.deployer)
+        m.locks[account] = (amount, end)
+
+    def lock_status(self, lock, delegate):
+        amount, end = self.model.locks.get(lock, (0, 0))
+        return quote.preview([amount], [end], [1], [delegate], UNIT, self.model.now)[2][0]
+
+    def pick_purchase(self, allowances):
+        m = self.model
+        # mostly pick a contributor with allowance and a lock that is long enough
+        valid = [
+            (c, lock) for c in self.users for lock in self.users
+            if allowances(c) > 0 and (c == lock or self.rng.random() < 0.3)
+            and self.lock_status(lock, c != lock) == quote.OK
+        ]
+        if valid and self.rng.random() < 0.8:
+            return self.rng.choice(valid)
+        contributor = self.pick(m.contributors)
+        return contributor, contributor if self.rng.random() < 0.7 else self.rng.choice(self.users)
+
+    def preview(self, contributor, lock, amount_in, price, locks):
+        """
+        @return Expected amount of YFI and whether the lock and price allow the purchase
+        """
+        lock_amount, lock_end = locks.get(lock, (0, 0))
+        if lock_end == 0 or price is None:
+            return 0, False
+        amounts, _, statuses = quote.preview([lock_amount], [lock_end], [amount_in], [lock != contributor], price, self.model.now)
+        return amounts[0], statuses[0] == quote.OK
+
+    def min_locked(self, expected):
+        return expected + 1 if self.rng.random() < 0.1 else self.rng.choice([0, expected])
+
+    def bought_event(self, receipt, contributor, lock, amount_in, expected):
+        events = list(self.discount.Buy.from_receipt(receipt))
+        assert len(events) == 1
+        assert events[0].contributor == contributor
+        assert events[0].amount_in == amount_in
+        assert events[0].amount_out == expected
+        assert events[0].lock == lock
+
+    def settle_purchase(self, contributor, lock, allowance, amount_in, expected):
+        m = self.model
+        lock_amount, lock_end = m.locks.get(lock, (0, 0))
+        self.spent += amount_in
+        self.bought += expected
+        m.contributors[contributor] = (allowance - amount_in, m.month)
+        m.locks[lock] = (lock_amount + expected, lock_end)
+
+    def check_locks(self, locks):
+        for lock in locks:
+            assert self.veyfi.locked(lock).amount == self.model.locks[lock][0]
+        assert self.yfi.balanceOf(self.discount) == SUPPLY - self.bought
+
+    def buy(self):
+        m = self.model
+        contributor, lock = self.pick_purchase(lambda c: m.allowance(m.contributors, c, m.now))
+        allowance = m.allowance(m.contributors, contributor, m.now)
+        amount_in = max(self.amount(allowance) + self.rng.choice([0, 0, 0, 1]), 1)
+        spot = m.spot_price(m.now)
+        expected, ok = self.preview(contributor, lock, amount_in, spot and spot[0], m.locks)
+        min_locked = self.min_locked(expected)
+        self.log(f"buy({min_locked}, {lock.address[:6]}, value={amount_in}, sender={contributor.address[:6]})")
+
+        if amount_in > allowance or not ok or min_locked > expected or expected > SUPPLY - self.bought:
+            self.transact(self.discount.buy, min_locked, lock, value=amount_in, sender=contributor, reverts=True)
+            return
+
+        m.update_spot_price(m.now)
+        receipt = self.transact(self.discount.buy, min_locked, lock, value=amount_in, sender=contributor)
+        self.bought_event(receipt, contributor, lock, amount_in, expected)
+        self.settle_purchase(contributor, lock, allowance, amount_in, expected)
+        self.check_locks([lock])
+        self.check_views([contributor])
+
+    def buy_with_proof(self):
+        m = self.model
+        tree = m.trees.get(m.month)
+
+        def claimable(c):
+            if m.claims.get(c, 0) == m.month or tree is None:
+                return 0
+            return tree.allowances.get(c.address.lower(), 0)
+
+        contributor, lock = self.pick_purchase(lambda c: m.allowance(m.contributors, c, m.now) + claimable(c))
+        claimed = m.claims.get(contributor, 0) == m.month
+        member = tree is not None and contributor.address.lower() in tree.allowances
+        if member and self.rng.random() < 0.9:
+            claim, proof = tree.allowances[contributor.address.lower()], tree.proof(contributor)
+            # a wrong amount does not match the leaf
+            if self.rng.random() < 0.1:
+                claim += 1
+        else:
+            claim, proof = self.amount(5 * UNIT), []
+        valid = member and claim == tree.allowances[contributor.address.lower()]
+
+        allowance = m.allowance(m.contributors, contributor, m.now)
+        if not claimed:
+            allowance += claim if valid else 0
+        amount_in = max(self.amount(allowance) + self.rng.choice([0, 0, 0, 1]), 1)
+        spot = m.spot_price(m.now)
+        expected, ok = self.preview(contributor, lock, amount_in, spot and spot[0], m.locks)
+        min_locked = self.min_locked(expected)
+        self.log(f"buy_with_proof({claim}, {len(proof)}, {min_locked}, {lock.address[:6]}, value={amount_in}, sender={contributor.address[:6]})")
+
+        if (
+            m.expiration <= m.now or (not claimed and not valid) or amount_in > allowance or not ok
+            or min_locked > expected or expected > SUPPLY - self.bought
+        ):
+            self.transact(self.discount.buy_with_proof, claim, proof, min_locked, lock, value=amount_in, sender=contributor, reverts=True)
+            return
+
+        m.update_spot_price(m.now)
+        receipt = self.transact(self.discount.buy_with_proof, claim, proof, min_locked, lock, value=amount_in, sender=contributor)
+        if not claimed:
+            m.claims[contributor] = m.month
+            m.issued += claim
+        self.bought_event(receipt, contributor, lock, amount_in, expected)
+        self.settle_purchase(contributor, lock, allowance, amount_in, expected)
+        self.check_locks([lock])
+        self.check_views([contributor])
+
+    def deposit(self):
+        m = self.model
+        contributor = self.rng.choice(self.users)
+        # deposits are made by the contributor or on its behalf
+        sender = contributor if self.rng.random() < 0.5 else self.deployer
+        amount = 0 if self.rng.random() < 0.1 else self.rng.randrange(1, 3 * UNIT)
+        self.log(f"deposit({contributor.address[:6]}, value={amount}, sender={sender.address[:6]})")
+        if amount == 0:
+            self.transact(self.discount.deposit, contributor, value=amount, sender=sender, reverts=True)
+            return
+        self.transact(self.discount.deposit, contributor, value=amount, sender=sender)
+        m.deposits[contributor] = m.deposits.get(contributor, 0) + amount
+
+    def withdraw_deposit(self):
+        m = self.model
+        funded = [u for u in self.users if m.deposits.get(u, 0) > 0]
+        contributor = self.rng.choice(funded if funded and self.rng.random() < 0.8 else self.users)
+        deposit = m.deposits.get(contributor, 0)
+        amount = self.rng.choice([0, deposit, deposit + 1, self.rng.randrange(0, deposit + 1)])
+        self.log(f"withdraw_deposit({amount}, sender={contributor.address[:6]})")
+        if amount == 0 or amount > deposit:
+            self.transact(self.discount.withdraw_deposit, amount, sender=contributor, reverts=True)
+            return
+        self.transact(self.discount.withdraw_deposit, amount, sender=contributor)
+        m.deposits[contributor] = deposit - amount
+
+    def settle(self):
+        m = self.model
+        contributors = dict(m.contributors)
+        deposits = dict(m.deposits)
+        nonces = dict(m.nonces)
+        locks = dict(m.locks)
+        spot = m.spot_price(m.now)
+        price = spot and spot[0]
+        valid = m.expiration > m.now and spot is not None
+        intents = []
+        purchases = []
+        bought = self.bought
+        count = self.rng.choice([1, 1, 2, 3])
+        # break one of the intents in a third of the batches, which reverts the whole batch
+        corrupt = self.rng.randrange(count) if self.rng.random() < 0.3 else None
+        for i in range(count):
+            corruption = self.rng.choice(["amount", "min_locked", "nonce", "deadline", "signer"]) if i == corrupt else None
+            contributor, lock = self.pick_purchase(lambda c: min(m.allowance(contributors, c, m.now), deposits.get(c, 0)))
+            allowance = m.allowance(contributors, contributor, m.now)
+            deposit = deposits.get(contributor, 0)
+            funded = min(allowance, deposit)
+            amount_in = funded + 1 if corruption == "amount" else max(self.amount(funded), 1)
+            expected, ok = self.preview(contributor, lock, amount_in, price, locks)
+            min_locked = expected + 1 if corruption == "min_locked" else self.rng.choice([0, expected])
+            nonce = nonces.get(contributor, 0) + (1 if corruption == "nonce" else 0)
+            deadline = m.now + (-1 if corruption == "deadline" else DAY)
+            intent = Intent(contributor.address, amount_in, min_locked, lock.address, ZERO_ADDRESS, deadline, nonce)
+            signer = self.rng.choice([u for u in self.users if u != contributor]) if corruption == "signer" else contributor
+            intents.append(self.sign(signer, self.discount, intent))
+
+            valid = valid and (
+                deadline >= m.now and signer == contributor and nonce == nonces.get(contributor, 0)
+                and 0 < amount_in <= min(allowance, deposit) and ok
+                and intent.min_locked <= expected and expected <= SUPPLY - bought
+            )
+            if not valid:
+                continue
+            # later intents see the state left by earlier ones
+            lock_amount, lock_end = locks.get(lock, (0, 0))
+            contributors[contributor] = (allowance - amount_in, m.month)
+            deposits[contributor] = deposit - amount_in
+            nonces[contributor] = nonce + 1
+            locks[lock] = (lock_amount + expected, lock_end)
+            bought += expected
+            purchases.append((contributor, lock, allowance, amount_in, expected))
+        self.log(f"settle({[(i.contributor[:6], i.amount_in, i.min_locked, i.lock[:6], i.nonce) for i in intents]})")
+
+        tuples = [intent.as_tuple() for intent in intents]
+        if not valid:
+            self.transact(self.discount.settle, tuples, sender=self.deployer, reverts=True)
+            return
+
+        m.update_spot_price(m.now)
+        receipt = self.transact(self.discount.settle, tuples, sender=self.deployer)
+        events = list(self.discount.Buy.from_receipt(receipt))
+        assert [(e.contributor, e.amount_in, e.amount_out) for e in events] == [
+            (c.address, amount_in, expected) for c, _, _, amount_in, expected in purchases
+        ]
+        for contributor, lock, allowance, amount_in, expected in purchases:
+            m.deposits[contributor] -= amount_in
+            m.nonces[contributor] = m.nonces.get(contributor, 0) + 1
+            self.settle_purchase(contributor, lock, allowance, amount_in, expected)
+        self.check_locks({lock for _, lock, *_ in purchases})
+        self.check_views({c for c, *_ in purchases})
+
+    def read(self, slot, key=None, key_type="address"):
+        if key is not None:
+            slot = int.from_bytes(keccak(encode(["uint256", key_type], [slot, key])), "big")
+        return int.from_bytes(self.chain.provider.get_storage(self.discount.address, slot), "big")
+
+    def storage(self, slot, account=None):
+        value = self.read(slot, account and account.address)
+        return value & ALLOWANCE_MASK, value >> MONTH_SHIFT
+
+    def check_views(self, accounts):
+        m = self.model
+        now = self.chain.pending_timestamp
+        for account in accounts:
+            assert self.discount.team_allowance(account) == m.team_allowance(account, now)
+            assert self.discount.contributor_allowance(account) == m.allowance(m.contributors, account, now)
+
+    def check(self):
+        m = self.model
+        assert self.storage(SLOTS["packed_month"]) == (m.expiration, m.month)
+        current = 0
+        for user in self.users:
+            team = self.storage(SLOTS["team_allowances"], user)
+            contributor = self.storage(SLOTS["contributor_allowances"], user)
+            assert team == m.teams.get(user, (0, 0))
+            assert contributor == m.contributors.get(user, (0, 0))
+            current += m.stored_team_allowance(user)
+            current += contributor[0] if contributor[1] == m.month else 0
+
+        # allowances are only issued by management or claimed from the root, moved from teams to contributors and spent
+        assert current + self.spent == m.issued
+
+    def check_storage(self):
+        m = self.model
+        price, cached = m.round
+        # the cache slot is never written without the cache
+        assert self.read(SLOTS["packed_round"]) == price | cached << ROUND_CACHED_SHIFT
+        if m.month in m.trees:
+            assert self.read(SLOTS["contributor_roots"], m.month, "uint256") == int.from_bytes(m.trees[m.month].root, "big")
+        for user in self.users:
+            assert self.read(SLOTS["standing_allowances"], user.address) == m.standing.get(user, 0)
+            assert self.read(SLOTS["contributor_claims"], user.address) == m.claims.get(user, 0)
+            assert self.read(SLOTS["nonces"], user.address) == m.nonces.get(user, 0)
+            assert self.read(SLOTS["deposits"], user.address) == m.deposits.get(user, 0)
+
+    def check_balances(self):
+        # every YFI out of the contract is accounted for by a Buy event, the only ETH left is deposited
+        assert self.yfi.balanceOf(self.discount) == SUPPLY - self.bought
+        assert self.yfi.balanceOf(self.veyfi) - self.initial_locked == self.bought
+        assert self.discount.balance == sum(self.model.deposits.values())
+        for user in self.users:
+            assert self.veyfi.locked(user).amount == self.model.locks.get(user, (0, 0))[0]
+
+    def run(self, steps):
+        actions = [
+            (self.set_team_allowances, 3),
+            (self.set_standing_allowances, 1),
+            (self.new_month, 1),
+            (self.set_contributor_allowances, 5),
+            (self.set_contributor_root, 2),
+            (self.time_jump, 1),
+            (self.set_price, 3),
+            (self.set_locked, 2),
+            (self.buy, 6),
+            (self.buy_with_proof, 3),
+            (self.deposit, 3),
+            (self.withdraw_deposit, 1),
+            (self.settle, 4),
+        ]
+        self.initial_locked = self.yfi.balanceOf(self.veyfi)
+        try:
+            self.set_price()
+            for user in self.users:
+                self.set_locked(user)
+            for _ in range(steps):
+                action = self.rng.choices([a for a, _ in actions], [w for _, w in actions])[0]
+                action()
+                self.check()
+                self.steps += 1
+                if self.steps % CHECK_INTERVAL == 0:
+                    self.check_storage()
+            self.check_storage()
+            self.check_balances()
+        except AssertionError as e:
+            trace = "\n".join(self.trace[-TRACE_STEPS:])
+            raise AssertionError(f"{e}\nafter step {self.steps}, cache {self.model.cache}, last steps:\n{trace}") from e
+
+@pytest.mark.parametrize("seed", range(SEED, SEED + RUNS))
+def test_fuzz(seed, chain, deployer, management, users, yfi, veyfi, oracle, discount, cached_discount, sign):
+    # runs alternate between the deployments without and with oracle cache
+    discount = cached_discount if seed % 2 else discount
+    yfi.mint(discount, SUPPLY, sender=deployer)
+    fuzzer = Fuzzer(seed, chain, deployer, management, users, yfi, veyfi, oracle, discount, sign)
+    fuzzer.run(STEPS)
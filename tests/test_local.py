@@ -1,6 +1,10 @@
 import ape
 import pytest
 
+from scripts.merkle import MerkleTree
+from scripts.packed import encode_allowances
+from scripts.relayer import ZERO_ADDRESS, Intent
+
 DAY = 24 * 60 * 60
 WEEK = 7 * DAY
 ALLOWANCE_EXPIRATION_TIME = 30 * DAY
@@ -8,46 +12,15 @@ UNIT = 10**18
 MAX_DISCOUNT = 59_999_584
 DISCOUNT_SCALE = 100_000_000
 MIN_MULTIPLIER = DISCOUNT_SCALE - MAX_DISCOUNT
+GAS_LIMIT = 1_000_000
 
-@pytest.fixture
-def deployer(accounts):
-    return accounts[0]
-
-@pytest.fixture
-def management(accounts):
-    return accounts[1]
-
-@pytest.fixture
-def alice(accounts):
-    return accounts[2]
-
-@pytest.fixture
-def bob(accounts):
-    return accounts[3]
-
-@pytest.fixture
-def charlie(accounts):
-    return accounts[4]
-
-@pytest.fixture
-def yfi(project, deployer):
-    return project.MockToken.deploy(sender=deployer)
-
-@pytest.fixture
-def veyfi(project, deployer, yfi):
-    return project.MockVotingEscrow.deploy(yfi, sender=deployer)
-
-@pytest.fixture
-def oracle(project, deployer):
-    return project.MockPriceOracle.deploy(sender=deployer)
-
-@pytest.fixture
-def discount(project, deployer, management, yfi, veyfi, oracle):
-    return project.Discount.deploy(yfi, veyfi, oracle, management, sender=deployer)
-
-@pytest.fixture
-def callback(project, deployer):
-    return project.MockCallback.deploy(sender=deployer)
+# status codes of the bulk views
+OK = 0
+NO_LOCK = 1
+LOCK_EXPIRED = 2
+LOCK_TOO_SHORT = 3
+DELEGATE_LOCK_TOO_SHORT = 4
+INVALID_PRICE = 5
 
 @pytest.mark.parametrize("weeks,target", [(4, 10), (24, 14.9), (52, 21.8), (104, 34.5), (208, 60), (300, 60), (400, 60)])
 def test_discount(chain, deployer, alice, veyfi, discount, weeks, target):
@@ -57,13 +30,13 @@ def test_discount(chain, deployer, alice, veyfi, discount, weeks, target):
 
 def test_chainlink_oracle(project, deployer, management, yfi, veyfi):
     chainlink_oracle = project.MockPriceOracle.deploy(sender=deployer)
-    discount = project.Discount.deploy(yfi, veyfi, chainlink_oracle, management, sender=deployer)
+    discount = project.Discount.deploy(yfi, veyfi, chainlink_oracle, management, False, sender=deployer)
     chainlink_oracle.set_price(2 * UNIT, sender=deployer)
     assert discount.spot_price() == 2 * UNIT
 
 def test_stale_chainlink_oracle(project, chain, deployer, management, yfi, veyfi):
     chainlink_oracle = project.MockPriceOracle.deploy(sender=deployer)
-    discount = project.Discount.deploy(yfi, veyfi, chainlink_oracle, management, sender=deployer)
+    discount = project.Discount.deploy(yfi, veyfi, chainlink_oracle, management, False, sender=deployer)
     chainlink_oracle.set_price(2 * UNIT, sender=deployer)
     assert discount.spot_price() == 2 * UNIT
 
@@ -71,6 +44,112 @@ def test_stale_chainlink_oracle(project, chain, deployer, management, yfi, veyfi
     with ape.reverts():
         discount.spot_price()
 
+def test_oracle_cache_flag(discount, cached_discount):
+    assert not discount.oracle_cache()
+    assert cached_discount.oracle_cache()
+
+def test_oracle_cache(chain, deployer, bob, charlie, veyfi, oracle, cached_discount, setup_oracle_cache, same_block):
+    discount = cached_discount
+    setup_oracle_cache(discount, [bob, charlie])
+    expected = discount.preview(bob, UNIT // 2, False)
+
+    # the round read by the first purchase of a block is reused by the later ones in it
+    same_block(
+        lambda: discount.buy(0, value=UNIT // 2, sender=bob, gas_limit=GAS_LIMIT),
+        lambda: oracle.set_price(4 * UNIT, sender=deployer, gas_limit=GAS_LIMIT),
+        lambda: discount.buy(0, value=UNIT // 2, sender=charlie, gas_limit=GAS_LIMIT),
+    )
+    assert veyfi.locked(bob).amount == UNIT + expected
+    assert veyfi.locked(charlie).amount == UNIT + expected
+
+    # views and purchases of the next block read the newer oracle round
+    assert discount.spot_price() == 4 * UNIT
+    assert discount.preview(bob, UNIT // 2, False) < expected
+    discount.buy(0, value=UNIT // 2, sender=bob)
+    assert veyfi.locked(bob).amount < UNIT + 2 * expected
+
+def test_oracle_cache_spot_price(chain, deployer, bob, oracle, cached_discount, setup_oracle_cache):
+    discount = cached_discount
+    setup_oracle_cache(discount, [bob])
+    discount.buy(0, value=UNIT // 2, sender=bob)
+    oracle.set_price(4 * UNIT, sender=deployer)
+    assert discount.spot_price() == 4 * UNIT
+
+def test_oracle_cache_disabled(deployer, bob, charlie, veyfi, oracle, discount, setup_oracle_cache, same_block):
+    setup_oracle_cache(discount, [bob, charlie])
+    expected = discount.preview(bob, UNIT // 2, False)
+    same_block(
+        lambda: discount.buy(0, value=UNIT // 2, sender=bob, gas_limit=GAS_LIMIT),
+        lambda: oracle.set_price(4 * UNIT, sender=deployer, gas_limit=GAS_LIMIT),
+        lambda: discount.buy(0, value=UNIT // 2, sender=charlie, gas_limit=GAS_LIMIT),
+    )
+    assert veyfi.locked(bob).amount == UNIT + expected
+    assert veyfi.locked(charlie).amount < UNIT + expected
+
+def test_oracle_cache_stale(chain, deployer, bob, charlie, oracle, cached_discount, setup_oracle_cache):
+    discount = cached_discount
+    setup_oracle_cache(discount, [bob, charlie])
+    oracle.set_price(2 * UNIT, chain.pending_timestamp - 2 * 60 * 60 + 60, sender=deployer)
+    discount.buy(0, value=UNIT // 2, sender=bob)
+
+    # a round cached in an earlier block is not reused once the oracle round is stale
+    chain.mine(timestamp=chain.pending_timestamp + 60)
+    with ape.reverts():
+        discount.spot_price()
+    with ape.reverts():
+        discount.buy(0, value=UNIT // 2, sender=charlie)
+
+def test_bulk_allowances(management, alice, bob, charlie, discount):
+    assert discount.bulk_team_allowances([alice, bob]) == [0, 0]
+    discount.set_standing_allowances([bob], [2 * UNIT], sender=management)
+    discount.set_team_allowances([alice], [3 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob, charlie], [UNIT, 2 * UNIT], sender=alice)
+    teams = [alice, bob, charlie]
+    assert discount.bulk_team_allowances(teams) == [discount.team_allowance(t) for t in teams] == [0, 2 * UNIT, 0]
+    assert discount.bulk_contributor_allowances(teams) == [discount.contributor_allowance(c) for c in teams] == [0, UNIT, 2 * UNIT]
+    assert discount.bulk_contributor_allowances([]) == []
+
+def test_bulk_discounts(chain, deployer, alice, bob, charlie, veyfi, discount):
+    week = chain.pending_timestamp // WEEK * WEEK
+    veyfi.set_locked(alice, UNIT, week + 52 * WEEK, sender=deployer)
+    veyfi.set_locked(bob, UNIT, week - 2 * WEEK, sender=deployer)
+    rows = discount.bulk_discounts([alice, bob, charlie])
+    assert [(r.weeks, r.discount, r.status) for r in rows] == [
+        (52, discount.discount(alice), OK), (0, 0, LOCK_EXPIRED), (0, 0, NO_LOCK)
+    ]
+
+def test_bulk_previews(accounts, chain, deployer, alice, bob, charlie, veyfi, oracle, discount):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    week = chain.pending_timestamp // WEEK * WEEK
+    now = chain.pending_timestamp
+    veyfi.set_locked(alice, UNIT, week + 200 * WEEK, sender=deployer)
+    veyfi.set_locked(bob, UNIT, week + 52 * WEEK, sender=deployer)
+    veyfi.set_locked(charlie, UNIT, week + 2 * WEEK, sender=deployer)
+    others = [accounts.generate_test_account() for _ in range(2)]
+    veyfi.set_locked(others[0], UNIT, week - WEEK, sender=deployer)
+    requests = [
+        (alice, UNIT, False), (alice, 2 * UNIT, True), (bob, UNIT, False), (bob, UNIT, True),
+        (charlie, UNIT, False), (others[0], UNIT, False), (others[1], UNIT, True),
+    ]
+    rows = discount.bulk_previews(requests)
+    assert [r.status for r in rows] == [
+        OK, OK, OK, DELEGATE_LOCK_TOO_SHORT,
+        LOCK_TOO_SHORT, LOCK_EXPIRED, NO_LOCK,
+    ]
+    for (lock, amount_in, delegate), row in zip(requests, rows):
+        if row.status == OK:
+            assert row.amount == discount.preview(lock, amount_in, delegate)
+            assert row.discount == (10**17 if delegate else discount.discount(lock))
+        else:
+            assert row.amount == row.discount == 0
+            with ape.reverts():
+                discount.preview(lock, amount_in, delegate)
+
+    # a stale price is reported for every row with a lock
+    oracle.set_price(2 * UNIT, now - 2 * 60 * 60, sender=deployer)
+    rows = discount.bulk_previews(requests)
+    assert [r.status for r in rows] == [INVALID_PRICE] * 6 + [NO_LOCK]
+
 def test_set_team_allowances_privilege(alice, discount):
     with ape.reverts():
         discount.set_team_allowances([alice], [UNIT], sender=alice)
@@ -322,6 +401,19 @@ def test_buy_no_lock(chain, deployer, management, alice, bob, yfi, veyfi, oracle
     veyfi.set_locked(bob, UNIT, now + 4 * WEEK, sender=deployer)
     discount.buy(0, value=UNIT, sender=bob)
 
+def test_buy_check_order(chain, deployer, management, alice, bob, yfi, veyfi, oracle, discount):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    discount.set_team_allowances([alice], [3 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob], [3 * UNIT], sender=alice)
+    yfi.mint(discount, 10 * UNIT, sender=deployer)
+
+    # without a lock, a purchase reverts before it reads the oracle, stale or not
+    fresh = discount.buy(0, value=UNIT, sender=bob, gas_limit=GAS_LIMIT, raise_on_revert=False)
+    chain.mine(timestamp=chain.pending_timestamp + 2 * 60 * 60)
+    stale = discount.buy(0, value=UNIT, sender=bob, gas_limit=GAS_LIMIT, raise_on_revert=False)
+    assert fresh.failed and stale.failed
+    assert stale.gas_used == fresh.gas_used
+
 def test_buy_callback(chain, deployer, management, alice, bob, yfi, veyfi, oracle, discount, callback):
     oracle.set_price(2 * UNIT, sender=deployer)
     discount.set_team_allowances([alice], [UNIT], sender=management)
@@ -388,3 +480,281 @@ def test_buy_delegate_no_lock(chain, deployer, management, alice, bob, charlie,
 
     veyfi.set_locked(charlie, UNIT, now + 5 * 52 * WEEK, sender=deployer)
     discount.buy(0, charlie, value=UNIT, sender=bob)
+
+def test_set_contributor_root_privilege(alice, discount):
+    with ape.reverts():
+        discount.set_contributor_root(b"\x01" * 32, sender=alice)
+
+def test_set_contributor_root(chain, management, alice, bob, discount):
+    discount.set_team_allowances([alice], [UNIT], sender=management)
+    ts = chain.pending_timestamp + ALLOWANCE_EXPIRATION_TIME
+    tree = MerkleTree({bob.address: UNIT}, 2)
+    discount.set_contributor_root(tree.root, sender=management)
+    assert discount.month() == 2
+    assert discount.expiration() == ts
+    assert discount.contributor_roots(2) == tree.root
+    assert discount.team_allowance(alice) == 0
+
+    tree = MerkleTree({bob.address: 2 * UNIT}, 2)
+    discount.set_contributor_root(tree.root, False, sender=management)
+    assert discount.month() == 2
+    assert discount.contributor_roots(2) == tree.root
+
+def test_buy_with_proof(chain, deployer, management, alice, bob, charlie, yfi, veyfi, oracle, discount):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    value = UNIT * 18 // 10
+    tree = MerkleTree({bob.address: 2 * value, charlie.address: UNIT}, 1)
+    discount.set_contributor_root(tree.root, sender=management)
+    veyfi.set_locked(bob, UNIT, chain.pending_timestamp // WEEK * WEEK + 4 * WEEK, sender=deployer)
+    yfi.mint(discount, 10 * UNIT, sender=deployer)
+
+    # proof for a different allowance
+    with ape.reverts('invalid proof'):
+        discount.buy_with_proof(3 * value, tree.proof(bob), 0, value=value, sender=bob)
+
+    discount.buy_with_proof(2 * value, tree.proof(bob), 0, value=value, sender=bob)
+    assert discount.contributor_claims(bob) == 1
+    assert discount.contributor_allowance(bob) == value
+    assert veyfi.locked(bob).amount == 2 * UNIT
+
+    # claim only counts once, proof is ignored afterwards
+    discount.buy_with_proof(2 * value, [], 0, value=value, sender=bob)
+    assert discount.contributor_allowance(bob) == 0
+    assert veyfi.locked(bob).amount == 3 * UNIT
+    with ape.reverts():
+        discount.buy_with_proof(2 * value, tree.proof(bob), 0, value=1, sender=bob)
+
+def test_buy_with_proof_add(chain, deployer, management, alice, bob, yfi, veyfi, oracle, discount):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    tree = MerkleTree({bob.address: UNIT}, 1)
+    discount.set_contributor_root(tree.root, sender=management)
+    discount.set_team_allowances([alice], [UNIT], False, sender=management)
+    discount.set_contributor_allowances([bob], [UNIT], sender=alice)
+    veyfi.set_locked(bob, UNIT, chain.pending_timestamp // WEEK * WEEK + 4 * WEEK, sender=deployer)
+    yfi.mint(discount, 10 * UNIT, sender=deployer)
+
+    discount.buy_with_proof(UNIT, tree.proof(bob), 0, value=UNIT, sender=bob)
+    assert discount.contributor_allowance(bob) == UNIT
+
+def test_buy_with_proof_expire(chain, deployer, management, bob, yfi, veyfi, oracle, discount):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    tree = MerkleTree({bob.address: UNIT}, 1)
+    discount.set_contributor_root(tree.root, sender=management)
+    veyfi.set_locked(bob, UNIT, chain.pending_timestamp // WEEK * WEEK + 5 * 52 * WEEK, sender=deployer)
+    yfi.mint(discount, 10 * UNIT, sender=deployer)
+
+    chain.pending_timestamp += ALLOWANCE_EXPIRATION_TIME
+    with ape.reverts('allowance expired'):
+        discount.buy_with_proof(UNIT, tree.proof(bob), 0, value=UNIT, sender=bob)
+
+def test_buy_with_proof_new_month(chain, deployer, management, alice, bob, yfi, veyfi, oracle, discount):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    tree = MerkleTree({bob.address: UNIT}, 1)
+    discount.set_contributor_root(tree.root, sender=management)
+    discount.set_team_allowances([alice], [UNIT], sender=management)
+    veyfi.set_locked(bob, UNIT, chain.pending_timestamp // WEEK * WEEK + 5 * 52 * WEEK, sender=deployer)
+    yfi.mint(discount, 10 * UNIT, sender=deployer)
+
+    with ape.reverts('invalid proof'):
+        discount.buy_with_proof(UNIT, tree.proof(bob), 0, value=UNIT, sender=bob)
+
+def test_set_standing_allowances_privilege(alice, discount):
+    with ape.reverts():
+        discount.set_standing_allowances([alice], [UNIT], sender=alice)
+
+def test_new_month_privilege(alice, discount):
+    with ape.reverts():
+        discount.new_month(sender=alice)
+
+def test_standing_allowances(chain, management, alice, bob, charlie, discount):
+    discount.set_standing_allowances([alice, bob], [UNIT, 2 * UNIT], sender=management)
+    assert discount.standing_allowances(alice) == UNIT
+    assert discount.team_allowance(alice) == 0
+
+    ts = chain.pending_timestamp + ALLOWANCE_EXPIRATION_TIME
+    discount.new_month(sender=management)
+    assert discount.month() == 1
+    assert discount.expiration() == ts
+    assert discount.team_allowance(alice) == UNIT
+    assert discount.team_allowance(bob) == 2 * UNIT
+
+    discount.set_contributor_allowances([charlie], [UNIT // 4], sender=alice)
+    assert discount.team_allowance(alice) == 3 * UNIT // 4
+    assert discount.contributor_allowance(charlie) == UNIT // 4
+
+    # allowance is reset in full every month
+    discount.new_month(sender=management)
+    assert discount.team_allowance(alice) == UNIT
+    assert discount.contributor_allowance(charlie) == 0
+    discount.set_contributor_allowances([charlie], [UNIT], sender=alice)
+    assert discount.team_allowance(alice) == 0
+
+    chain.pending_timestamp += ALLOWANCE_EXPIRATION_TIME
+    chain.mine()
+    assert discount.team_allowance(bob) == 0
+
+def test_standing_allowances_override(management, alice, bob, discount):
+    discount.set_standing_allowances([alice, bob], [UNIT, UNIT], sender=management)
+    discount.set_team_allowances([alice], [3 * UNIT], sender=management)
+    assert discount.team_allowance(alice) == 3 * UNIT
+    assert discount.team_allowance(bob) == UNIT
+
+    discount.set_team_allowances([bob], [0], False, sender=management)
+    assert discount.team_allowance(bob) == 0
+    with ape.reverts():
+        discount.set_contributor_allowances([alice], [UNIT], sender=bob)
+
+    discount.new_month(sender=management)
+    assert discount.team_allowance(alice) == UNIT
+    assert discount.team_allowance(bob) == UNIT
+
+def test_standing_allowances_remove(management, alice, bob, discount):
+    discount.set_standing_allowances([alice], [UNIT], sender=management)
+    discount.new_month(sender=management)
+    discount.set_standing_allowances([alice], [0], sender=management)
+    assert discount.team_allowance(alice) == 0
+
+    with ape.reverts('allowance expired'):
+        discount.set_contributor_allowances([bob], [UNIT], sender=alice)
+
+def test_set_team_allowances_packed(chain, management, alice, bob, discount):
+    ts = chain.pending_timestamp + ALLOWANCE_EXPIRATION_TIME
+    discount.set_team_allowances_packed([alice, bob], encode_allowances([UNIT, 2 * UNIT]), sender=management)
+    assert discount.month() == 1
+    assert discount.expiration() == ts
+    assert discount.team_allowance(alice) == UNIT
+    assert discount.team_allowance(bob) == 2 * UNIT
+
+    discount.set_team_allowances_packed([bob], encode_allowances([3 * UNIT]), False, sender=management)
+    assert discount.month() == 1
+    assert discount.team_allowance(alice) == UNIT
+    assert discount.team_allowance(bob) == 3 * UNIT
+
+def test_set_team_allowances_packed_amounts(accounts, management, discount):
+    # amounts across word boundaries, including the largest amount
+    teams = accounts[5:10]
+    allowances = [0, 10**9, (2**64 - 1) * 10**9, 5 * 10**9, 123456789 * 10**9]
+    discount.set_team_allowances_packed(teams, encode_allowances(allowances), sender=management)
+    assert [discount.team_allowance(team) for team in teams] == allowances
+
+    discount.set_team_allowances_packed([], [], sender=management)
+    assert discount.month() == 2
+
+def test_set_team_allowances_packed_privilege(alice, discount):
+    with ape.reverts():
+        discount.set_team_allowances_packed([alice], encode_allowances([UNIT]), sender=alice)
+
+def test_set_team_allowances_packed_invalid(management, alice, bob, discount):
+    with ape.reverts():
+        # words do not match the number of teams
+        discount.set_team_allowances_packed([alice], encode_allowances([UNIT] * 5), sender=management)
+    with ape.reverts():
+        discount.set_team_allowances_packed([alice, bob], [], sender=management)
+    with ape.reverts():
+        # unused amount of the last word is not zero
+        discount.set_team_allowances_packed([alice], encode_allowances([UNIT, UNIT]), sender=management)
+    with ape.reverts():
+        discount.set_team_allowances_packed([ZERO_ADDRESS], encode_allowances([UNIT]), sender=management)
+
+def test_set_contributor_allowances_packed(management, alice, bob, charlie, discount):
+    discount.set_team_allowances([alice], [4 * UNIT], sender=management)
+    discount.set_contributor_allowances_packed([bob, charlie, bob], encode_allowances([UNIT, 2 * UNIT, 0]), sender=alice)
+    assert discount.team_allowance(alice) == UNIT
+    assert discount.contributor_allowance(bob) == UNIT
+    assert discount.contributor_allowance(charlie) == 2 * UNIT
+
+    with ape.reverts():
+        discount.set_contributor_allowances_packed([bob], encode_allowances([2 * UNIT]), sender=alice)
+    with ape.reverts():
+        discount.set_contributor_allowances_packed([bob], encode_allowances([0, UNIT]), sender=alice)
+
+def test_set_contributor_allowances_packed_expiry(chain, management, alice, bob, discount):
+    discount.set_team_allowances([alice], [UNIT], sender=management)
+    chain.pending_timestamp += ALLOWANCE_EXPIRATION_TIME
+    with ape.reverts('allowance expired'):
+        discount.set_contributor_allowances_packed([bob], encode_allowances([UNIT]), sender=alice)
+
+def test_settle(chain, deployer, management, alice, bob, charlie, yfi, veyfi, oracle, discount, callback, sign):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    value = UNIT * 18 // 10
+    discount.set_team_allowances([alice], [3 * value], sender=management)
+    discount.set_contributor_allowances([bob, charlie], [value, 2 * value], sender=alice)
+    now = chain.pending_timestamp // WEEK * WEEK
+    veyfi.set_locked(bob, UNIT, now + 4 * WEEK, sender=deployer)
+    veyfi.set_locked(alice, UNIT, now + 5 * 52 * WEEK, sender=deployer)
+    yfi.mint(discount, 10 * UNIT, sender=deployer)
+
+    deadline = chain.pending_timestamp + DAY
+    intents = [
+        sign(bob, discount, Intent(bob.address, value, UNIT, bob.address, ZERO_ADDRESS, deadline, 0)),
+        sign(charlie, discount, Intent(charlie.address, value, UNIT, alice.address, callback.address, deadline, 0)),
+        sign(charlie, discount, Intent(charlie.address, value, UNIT, alice.address, ZERO_ADDRESS, deadline, 1)),
+    ]
+    discount.deposit(value=value, sender=bob)
+    discount.deposit(charlie, value=2 * value, sender=deployer)
+    prev = management.balance
+    tx = discount.settle([i.as_tuple() for i in intents], sender=deployer)
+    assert veyfi.locked(bob).amount == 2 * UNIT
+    assert veyfi.locked(alice).amount == 3 * UNIT
+    assert discount.contributor_allowance(bob) == 0
+    assert discount.contributor_allowance(charlie) == 0
+    assert discount.nonces(charlie) == 2
+    assert callback.last_account() == charlie
+    assert management.balance == prev + 3 * value
+    assert discount.deposits(bob) == discount.deposits(charlie) == 0
+    assert [log.contributor for log in tx.decode_logs(discount.Buy)] == [bob, charlie, charlie]
+
+def test_deposit(deployer, bob, charlie, discount):
+    tx = discount.deposit(value=UNIT, sender=bob)
+    assert [log.contributor for log in tx.decode_logs(discount.Deposit)] == [bob]
+    discount.deposit(bob, value=UNIT, sender=deployer)
+    assert discount.deposits(bob) == 2 * UNIT
+    with ape.reverts():
+        discount.deposit(sender=bob)
+
+    with ape.reverts('insufficient deposit'):
+        discount.withdraw_deposit(UNIT, sender=charlie)
+    with ape.reverts('insufficient deposit'):
+        discount.withdraw_deposit(3 * UNIT, sender=bob)
+    prev = bob.balance
+    tx = discount.withdraw_deposit(UNIT // 2, sender=bob)
+    assert [log.amount for log in tx.decode_logs(discount.Withdraw)] == [UNIT // 2]
+    assert discount.deposits(bob) == 3 * UNIT // 2
+    assert bob.balance == prev + UNIT // 2 - tx.total_fees_paid
+
+def test_settle_invalid(chain, deployer, management, alice, bob, yfi, veyfi, oracle, discount, sign):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    discount.set_team_allowances([alice], [2 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob], [2 * UNIT], sender=alice)
+    veyfi.set_locked(bob, UNIT, chain.pending_timestamp // WEEK * WEEK + 4 * WEEK, sender=deployer)
+    yfi.mint(discount, 10 * UNIT, sender=deployer)
+    discount.deposit(value=UNIT, sender=bob)
+    deadline = chain.pending_timestamp + DAY
+
+    # signed by someone else
+    intent = sign(alice, discount, Intent(bob.address, UNIT, 0, bob.address, ZERO_ADDRESS, deadline, 0))
+    with ape.reverts('invalid signature'):
+        discount.settle([intent.as_tuple()], sender=deployer)
+
+    # not covered by the deposit
+    intent = sign(bob, discount, Intent(bob.address, 2 * UNIT, 0, bob.address, ZERO_ADDRESS, deadline, 0))
+    with ape.reverts('insufficient deposit'):
+        discount.settle([intent.as_tuple()], sender=deployer)
+    intent = sign(bob, discount, Intent(bob.address, UNIT, 0, bob.address, ZERO_ADDRESS, deadline, 0))
+
+    # slippage
+    slippage = sign(bob, discount, Intent(bob.address, UNIT, UNIT, bob.address, ZERO_ADDRESS, deadline, 0))
+    with ape.reverts('price change'):
+        discount.settle([slippage.as_tuple()], sender=deployer)
+
+    # replay
+    discount.settle([intent.as_tuple()], sender=deployer)
+    with ape.reverts('invalid signature'):
+        discount.settle([intent.as_tuple()], sender=deployer)
+
+    # expired
+    intent = sign(bob, discount, Intent(bob.address, UNIT, 0, bob.address, ZERO_ADDRESS, deadline, 1))
+    chain.pending_timestamp = deadline + 1
+    oracle.set_price(2 * UNIT, sender=deployer)
+    with ape.reverts('intent expired'):
+        discount.settle([intent.as_tuple()], sender=deployer)
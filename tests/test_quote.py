@@ -0,0 +1,304 @@
+"""
+Tests of the off-chain quote, liability and backtest tooling, which needs numpy and aiohttp.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+import ape
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("aiohttp")
+
+from scripts import backtest, bulk, liability, quote, quote_service, snapshot  # noqa: E402
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+ALLOWANCE_EXPIRATION_TIME = 30 * DAY
+UNIT = 10**18
+
+def test_quote_matches_preview(chain, deployer, alice, veyfi, oracle, discount):
+    rng = random.Random(66)
+    oracle.set_price(rng.randrange(UNIT // 10, 10 * UNIT), sender=deployer)
+    price = discount.spot_price()
+    rows = []
+    for _ in range(40):
+        lock_amount = rng.choice([0, UNIT])
+        lock_end = (chain.pending_timestamp // WEEK + rng.randrange(-4, 260)) * WEEK + rng.randrange(WEEK)
+        amount_in = rng.randrange(1, 1000 * UNIT)
+        delegate = rng.random() < 0.5
+        veyfi.set_locked(alice, lock_amount, lock_end, sender=deployer)
+        now = chain.blocks.head.timestamp
+        amounts, discounts, status = quote.preview([lock_amount], [lock_end], [amount_in], [delegate], price, now)
+        if status[0] == quote.OK:
+            assert discount.preview(alice, amount_in, delegate) == amounts[0]
+        else:
+            with ape.reverts():
+                discount.preview(alice, amount_in, delegate)
+        rows.append((lock_amount, lock_end, amount_in, delegate, now, amounts[0], status[0]))
+
+    # evaluating all rows at once gives the same result as one at a time
+    for now in {row[4] for row in rows}:
+        batch = [row for row in rows if row[4] == now]
+        amounts, discounts, status = quote.preview(*zip(*[row[:4] for row in batch]), price, now)
+        assert list(amounts) == [row[5] for row in batch]
+        assert list(status) == [row[6] for row in batch]
+
+@pytest.mark.parametrize("price", [0, 1])
+def test_quote_invalid_price(accounts, chain, deployer, veyfi, oracle, discount, price):
+    week = chain.pending_timestamp // WEEK * WEEK
+    locks = [accounts.generate_test_account() for _ in range(3)]
+    ends = [week + 200 * WEEK, week - WEEK, 0]
+    for lock, end in zip(locks, ends):
+        if end:
+            veyfi.set_locked(lock, UNIT, end, sender=deployer)
+    oracle.set_price(price, sender=deployer)
+
+    now = chain.blocks.head.timestamp
+    amounts, discounts, status = quote.preview([UNIT, UNIT, 0], ends, [UNIT] * 3, [False] * 3, price, now)
+    rows = discount.bulk_previews([(lock, UNIT, False) for lock in locks])
+    assert list(status) == [r.status for r in rows]
+    assert status[0] == quote.INVALID_PRICE and status[2] == quote.NO_LOCK
+    assert list(amounts) == [0] * 3
+    if price == 0:
+        # a negative answer is rejected like a zero one
+        assert list(quote.preview([UNIT, UNIT, 0], ends, [UNIT] * 3, [False] * 3, -UNIT, now)[2]) == list(status)
+
+@pytest.mark.parametrize("weeks,target", [(4, 10), (24, 14.9), (52, 21.8), (104, 34.5), (208, 60), (300, 60)])
+def test_quote_discount(chain, deployer, alice, veyfi, discount, weeks, target):
+    ts = (chain.pending_timestamp // WEEK + weeks) * WEEK
+    veyfi.set_locked(alice, 1, ts, sender=deployer)
+    assert quote.discount([ts], chain.blocks.head.timestamp)[1][0] == discount.discount(alice)
+
+def to_rpc(value):
+    if isinstance(value, dict):
+        return {k: to_rpc(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_rpc(v) for v in value]
+    if isinstance(value, bytes):
+        return "0x" + value.hex()
+    if isinstance(value, int) and not isinstance(value, bool):
+        return hex(value)
+    return value
+
+class Node(snapshot.BaseHTTPRequestHandler):
+    # serves JSON-RPC requests from the local test chain
+    lock = threading.Lock()
+
+    def do_POST(self):
+        from ape import accounts, chain
+
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        responses = []
+        with self.lock:
+            for r in request if isinstance(request, list) else [request]:
+                if r["method"] == "eth_call":
+                    # the tester requires a funded sender for calls
+                    r["params"][0].setdefault("from", accounts.test_accounts[0].address)
+                if r["method"] in ("eth_call", "eth_getStorageAt") and r["params"][-1].startswith("0x"):
+                    # the tester only takes block numbers as integers
+                    r["params"][-1] = int(r["params"][-1], 16)
+                try:
+                    response = to_rpc(chain.provider.web3.provider.make_request(r["method"], r["params"]))
+                except Exception as e:
+                    response = {"error": {"code": -32000, "message": str(e)}}
+                responses.append({**response, "jsonrpc": "2.0", "id": r["id"]})
+        data = json.dumps(responses if isinstance(request, list) else responses[0]).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def node():
+    server = snapshot.ThreadingHTTPServer(("127.0.0.1", 0), Node)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+def test_quote_service(chain, node, deployer, management, alice, bob, charlie, veyfi, oracle, discount):
+    discount.set_team_allowances([alice], [3 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob], [UNIT], sender=alice)
+    veyfi.set_locked(bob, UNIT, chain.pending_timestamp + 110 * WEEK, sender=deployer)
+    oracle.set_price(2 * UNIT, sender=deployer)
+
+    async def run():
+        async with quote_service.Rpc(node) as rpc:
+            service = await quote_service.QuoteService.connect(rpc, discount.address, window=0.05)
+            quotes = await asyncio.gather(
+                *(service.quote(a.address) for a in [bob, charlie] * 10), service.quote(alice.address, UNIT, bob.address)
+            )
+            requests = rpc.requests
+            again = await service.quote(bob.address, UNIT // 2)
+            return quotes, requests, rpc.requests, again
+
+    quotes, requests, total, again = asyncio.run(run())
+    # one request for the contract, one for the oracle round and one for the state of all accounts
+    assert requests == 3
+    # the cached round is reused
+    assert total == 4
+    assert quotes[0]["spot_price"] == discount.spot_price()
+    assert quotes[0]["allowance"] == discount.contributor_allowance(bob) == UNIT
+    assert quotes[0]["discount"] == discount.discount(bob)
+    assert quotes[0]["amount_out"] == discount.preview(bob, UNIT, False)
+    assert quotes[0]["status"] == quote.OK
+    assert quotes[1]["status"] == quote.NO_LOCK and quotes[1]["amount_out"] == 0
+    assert quotes[-1]["allowance"] == 0
+    assert quotes[-1]["discount"] == 10**17
+    assert quotes[-1]["amount_out"] == discount.preview(bob, UNIT, True)
+    assert again["amount_out"] == discount.preview(bob, UNIT // 2, False)
+
+    oracle.set_price(2 * UNIT, chain.pending_timestamp - 2 * 60 * 60, sender=deployer)
+
+    async def stale():
+        async with quote_service.Rpc(node) as rpc:
+            service = await quote_service.QuoteService.connect(rpc, discount.address)
+            return await asyncio.gather(service.quote(bob.address), service.quote(charlie.address))
+
+    quotes = asyncio.run(stale())
+    assert [q["status"] for q in quotes] == [quote.INVALID_PRICE, quote.NO_LOCK]
+
+def test_quote_service_oracle_cache(node, deployer, bob, charlie, oracle, cached_discount, setup_oracle_cache):
+    discount = cached_discount
+    setup_oracle_cache(discount, [bob, charlie])
+    discount.buy(0, value=UNIT // 2, sender=bob)
+    oracle.set_price(4 * UNIT, sender=deployer)
+
+    async def run():
+        async with quote_service.Rpc(node) as rpc:
+            service = await quote_service.QuoteService.connect(rpc, discount.address)
+            return await service.quote(charlie.address)
+
+    # the round cached by the purchase is not reused in later blocks, quotes use the oracle
+    result = asyncio.run(run())
+    assert result["spot_price"] == discount.spot_price() == 4 * UNIT
+    assert result["amount_out"] == discount.preview(charlie, UNIT, False)
+
+def test_bulk_report(accounts, chain, node, deployer, veyfi, cached_discount, setup_oracle_cache):
+    discount = cached_discount
+    contributors = [accounts.generate_test_account() for _ in range(10)]
+    setup_oracle_cache(discount, contributors[:7])
+    veyfi.set_locked(contributors[0], 0, 0, sender=deployer)
+    veyfi.set_locked(contributors[8], UNIT, chain.pending_timestamp // WEEK * WEEK + 2 * WEEK, sender=deployer)
+
+    rows = asyncio.run(bulk.report(node, discount.address, [c.address for c in contributors], page_size=4))
+    assert [r["account"] for r in rows] == [c.address for c in contributors]
+    assert [r["allowance"] for r in rows] == [UNIT] * 7 + [0] * 3
+    assert [r["status"] for r in rows] == ["no lock"] + ["ok"] * 6 + ["no lock", "ok", "no lock"]
+    assert [r["preview_status"] for r in rows] == ["no lock"] + ["ok"] * 6 + ["no lock", "lock too short", "no lock"]
+    assert rows[1]["amount_out"] == discount.preview(contributors[1], UNIT, False)
+    assert rows[1]["discount"] == discount.discount(contributors[1])
+    assert rows[8]["weeks"] == 2
+
+def test_quote_service_benchmark(node, discount, alice, bob):
+    naive = asyncio.run(quote_service.benchmark(node, discount.address, [alice.address, bob.address], 20, naive=True))
+    service = asyncio.run(quote_service.benchmark(node, discount.address, [alice.address, bob.address], 20))
+    assert naive["requests"] == naive["calls"] == 80
+    assert service["requests"] == 2
+    assert service["calls"] == 2 + 1 + 2 * 20
+
+def test_liability(chain, node, accounts, deployer, management, alice, yfi, veyfi, oracle, discount):
+    contributors = [accounts.generate_test_account() for _ in range(4)]
+    discount.set_team_allowances([alice], [10 * UNIT], sender=management)
+    discount.set_contributor_allowances(contributors[:3], [UNIT, 2 * UNIT, 3 * UNIT], sender=alice)
+    now = chain.pending_timestamp
+    for contributor, weeks in zip(contributors, [10, 300, 2]):
+        veyfi.set_locked(contributor, UNIT, now + weeks * WEEK, sender=deployer)
+    oracle.set_price(2 * UNIT, sender=deployer)
+    yfi.mint(discount, 5 * UNIT, sender=deployer)
+
+    state = asyncio.run(liability.load(node, discount.address, [c.address for c in contributors]))
+    assert state["allowances"] == [UNIT, 2 * UNIT, 3 * UNIT, 0]
+    assert state["balance"] == 5 * UNIT
+    assert state["price"] == 2 * UNIT
+    assert state["expiration"] == discount.expiration()
+
+    times = liability.exercise_times(state["timestamp"], state["expiration"])
+    assert len(times) == 30
+    args = state["allowances"], state["lock_amounts"], state["lock_ends"], times, [state["price"], 2 * state["price"]]
+    own = liability.outflow(*args, delegate=False)
+    expected = discount.preview(contributors[0], UNIT, False) + discount.preview(contributors[1], 2 * UNIT, False)
+    assert own[0, 0] == expected
+    assert own[1, 0] == pytest.approx(own[0, 0] / 2)
+    # discounts shrink as locks get closer to their end
+    assert (np.diff(own[0]) <= 0).all()
+
+    delegated = liability.outflow(*args)
+    expected += discount.preview(contributors[1], 3 * UNIT, True)
+    assert delegated[0, 0] == expected
+
+def test_liability_oracle_cache(node, deployer, bob, charlie, oracle, cached_discount, setup_oracle_cache):
+    discount = cached_discount
+    setup_oracle_cache(discount, [bob, charlie])
+    discount.buy(0, value=UNIT // 2, sender=bob)
+    oracle.set_price(4 * UNIT, sender=deployer)
+
+    state = asyncio.run(liability.load(node, discount.address, [bob.address, charlie.address]))
+    assert state["price"] == discount.spot_price() == 4 * UNIT
+    grid = liability.outflow(state["allowances"], state["lock_amounts"], state["lock_ends"], [state["timestamp"]], [state["price"]])
+    assert grid[0, 0] == discount.preview(bob, UNIT // 2, False) + discount.preview(charlie, UNIT, False)
+
+def test_liability_speed():
+    n = 50_000
+    rng = np.random.default_rng(0)
+    now = 1_700_000_000
+    times = liability.exercise_times(now, now + ALLOWANCE_EXPIRATION_TIME, DAY // 4)
+    start = time.perf_counter()
+    grid = liability.outflow(
+        rng.integers(1, 10**18, n), rng.integers(0, 2, n), now + rng.integers(0, 250 * WEEK, n), times, [UNIT * f for f in liability.PRICE_FACTORS]
+    )
+    assert time.perf_counter() - start < 1
+    assert grid.shape == (len(liability.PRICE_FACTORS), 120)
+
+def test_backtest_oracle(project, deployer):
+    yfi_feed = project.MockChainlinkFeed.deploy(sender=deployer)
+    eth_feed = project.MockChainlinkFeed.deploy(sender=deployer)
+    oracle = project.DoubleChainlinkOracle.deploy(yfi_feed, eth_feed, sender=deployer)
+    yfi_rounds = [(100, 5_000 * 10**8), (400, 5_100 * 10**8 + 7), (500, 4_900 * 10**8)]
+    eth_rounds = [(200, 1_800 * 10**8), (300, 1_750 * 10**8 + 3), (600, 1_900 * 10**8)]
+    feeds = {0: yfi_feed, 1: eth_feed}
+    events = sorted([(t, 0, a) for t, a in yfi_rounds] + [(t, 1, a) for t, a in eth_rounds])
+    combined = list(backtest.combined_rounds(yfi_rounds, eth_rounds))
+    assert len(combined) == len(events) - 1
+    for timestamp, feed, answer in events:
+        feeds[feed].set_price(answer, timestamp, sender=deployer)
+        if timestamp < 200:
+            continue
+        data = oracle.latestRoundData()
+        assert combined.pop(0) == (timestamp, data.answer, data.updated)
+
+def write_rounds(path, rounds):
+    path.write_text("round_id,answer,updated_at\n" + "".join(f"{i},{a},{t}\n" for i, (t, a) in enumerate(rounds)))
+    return str(path)
+
+def test_backtest(tmp_path):
+    start = 1_600_000_000
+    hours = 24 * 90
+    yfi = write_rounds(tmp_path / "yfi.csv", [(start + h * 3600, (5_000 + h % 100) * 10**8) for h in range(hours)])
+    # the eth feed stops updating for ten days
+    eth = write_rounds(tmp_path / "eth.csv", [(start + h * 3600 + 60, 2_000 * 10**8) for h in range(hours) if not 500 <= h < 740])
+    population = backtest.Population(contributors=40)
+    current = backtest.Parameters()
+    generous = backtest.Parameters("generous", price_discount_slope=current.price_discount_slope * 6 // 5)
+    rows = backtest.run(yfi, eth, [current, generous], population, workers=2)
+    assert rows[0] == backtest.backtest(yfi, eth, current, population)
+
+    row = rows[0]
+    assert row["missed"] > 0 and row["rejected"] > 0
+    assert row["purchases"] + row["missed"] + row["rejected"] <= 3 * 40
+    assert row["eth_in"] == row["purchases"] * population.allowance
+    assert 0 < row["effective_discount"] < 0.6
+    assert rows[1]["purchases"] == row["purchases"]
+    assert rows[1]["cost"] > row["cost"]
+
+    weeks = [4, 13, 208, 300]
+    amounts, _, _ = quote.preview([1] * 4, [w * WEEK for w in weeks], [UNIT] * 4, [False] * 4, 2 * UNIT, 0)
+    assert [current.preview(w, False, 2 * UNIT, UNIT) for w in weeks] == list(amounts)
+    assert current.preview(3, False, 2 * UNIT, UNIT) is None
+    assert current.preview(100, True, 2 * UNIT, UNIT) is None
@@ -0,0 +1,392 @@
+"""
+Tests of the tooling in `scripts/` that drives the contract: relayer, indexer, fork snapshots,
+load simulation, allocation and gas profiling.
+"""
+import json
+import shutil
+import threading
+
+import pytest
+from eth_abi import encode
+from eth_hash.auto import keccak
+from eth_keys import keys
+
+from scripts import allocate, layout, profiler, simulate, snapshot
+from scripts.indexer import Indexer
+from scripts.merkle import MerkleTree, leaf, verify
+from scripts.packed import decode_allowances, encode_allowances
+from scripts.relayer import ZERO_ADDRESS, Intent, Relayer, domain_separator, recover, sign_intent
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+UNIT = 10**18
+
+def test_intent_signature(chain, discount):
+    key = keys.PrivateKey(b"\x01" * 32)
+    domain = domain_separator(discount.address, chain.chain_id)
+    assert domain == discount.domain_separator()
+    intent = Intent(key.public_key.to_checksum_address(), UNIT, 0, ZERO_ADDRESS, ZERO_ADDRESS, 2**64, 0)
+    assert recover(sign_intent(intent, domain, key.to_bytes()), domain) == intent.contributor
+
+def test_relayer(chain, deployer, management, alice, bob, charlie, yfi, veyfi, oracle, discount, sign):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    discount.set_team_allowances([alice], [10 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob, charlie], [5 * UNIT, 5 * UNIT], sender=alice)
+    now = chain.pending_timestamp // WEEK * WEEK
+    veyfi.set_locked(bob, UNIT, now + 4 * WEEK, sender=deployer)
+    veyfi.set_locked(charlie, UNIT, now + 4 * WEEK, sender=deployer)
+    yfi.mint(discount, 100 * UNIT, sender=deployer)
+
+    discount.deposit(value=3 * UNIT, sender=bob)
+    discount.deposit(value=3 * UNIT, sender=charlie)
+
+    relayer = Relayer(discount, chain.chain_id, max_intents=2)
+    deadline = chain.pending_timestamp + DAY
+    for nonce in range(3):
+        for account in [bob, charlie]:
+            relayer.add(sign(account, discount, Intent(account.address, UNIT, 0, account.address, ZERO_ADDRESS, deadline, nonce)))
+    with pytest.raises(ValueError, match='invalid nonce'):
+        relayer.add(sign(bob, discount, Intent(bob.address, UNIT, 0, bob.address, ZERO_ADDRESS, deadline, 5)))
+    with pytest.raises(ValueError, match='invalid signature'):
+        relayer.add(sign(charlie, discount, Intent(bob.address, UNIT, 0, bob.address, ZERO_ADDRESS, deadline, 3)))
+    with pytest.raises(ValueError, match='insufficient deposit'):
+        relayer.add(sign(bob, discount, Intent(bob.address, UNIT, 0, bob.address, ZERO_ADDRESS, deadline, 3)))
+
+    assert [len(batch) for batch in relayer.batches(chain.pending_timestamp)] == [2, 2, 2]
+    # intents that are no longer covered after a withdrawal are dropped
+    discount.withdraw_deposit(UNIT, sender=charlie)
+    receipts, dropped = relayer.submit(deployer, chain.pending_timestamp)
+    assert len(receipts) == 3
+    assert [(intent.contributor, intent.nonce) for intent in dropped] == [(charlie.address, 2)]
+    assert relayer.pending == []
+    assert discount.contributor_allowance(bob) == 2 * UNIT
+    assert discount.contributor_allowance(charlie) == 3 * UNIT
+    assert discount.nonces(charlie) == 2
+    assert discount.deposits(bob) == discount.deposits(charlie) == 0
+
+def test_relayer_simulate(chain, deployer, management, alice, bob, charlie, yfi, veyfi, oracle, discount, sign):
+    oracle.set_price(2 * UNIT, sender=deployer)
+    discount.set_team_allowances([alice], [10 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob, charlie], [5 * UNIT, 5 * UNIT], sender=alice)
+    now = chain.pending_timestamp // WEEK * WEEK
+    veyfi.set_locked(bob, UNIT, now + 4 * WEEK, sender=deployer)
+    veyfi.set_locked(charlie, UNIT, now + 4 * WEEK, sender=deployer)
+    yfi.mint(discount, 100 * UNIT, sender=deployer)
+    discount.deposit(value=3 * UNIT, sender=bob)
+    discount.deposit(value=3 * UNIT, sender=charlie)
+
+    relayer = Relayer(discount, chain.chain_id)
+    deadline = chain.pending_timestamp + DAY
+    min_locked = [0, 10 * UNIT, 0]
+    for nonce in range(3):
+        for account in [bob, charlie]:
+            relayer.add(sign(account, discount, Intent(account.address, UNIT, min_locked[nonce], account.address, ZERO_ADDRESS, deadline, nonce)))
+    # the lock of bob is gone by the time the intents are submitted
+    veyfi.set_locked(bob, 0, 0, sender=deployer)
+
+    # reverting intents are dropped instead of reverting the batch, with the later intents of their contributor
+    receipts, dropped = relayer.submit(deployer, chain.pending_timestamp)
+    assert len(receipts) == 1
+    assert [(intent.contributor, intent.nonce) for intent in dropped] == [
+        (bob.address, 0), (bob.address, 1), (charlie.address, 1), (bob.address, 2), (charlie.address, 2),
+    ]
+    assert discount.nonces(bob) == 0
+    assert discount.nonces(charlie) == 1
+    assert discount.deposits(charlie) == 2 * UNIT
+
+def test_indexer(tmp_path, chain, deployer, management, alice, bob, charlie, yfi, veyfi, oracle, discount):
+    start = chain.blocks.height
+    oracle.set_price(2 * UNIT, sender=deployer)
+    now = chain.pending_timestamp // WEEK * WEEK
+    veyfi.set_locked(bob, UNIT, now + 4 * WEEK, sender=deployer)
+    veyfi.set_locked(charlie, UNIT, now + 208 * WEEK, sender=deployer)
+    yfi.mint(discount, 100 * UNIT, sender=deployer)
+    discount.set_team_allowances([alice, bob], [3 * UNIT, UNIT], sender=management)
+    discount.set_contributor_allowances([bob, charlie], [UNIT, UNIT], sender=alice)
+    discount.set_contributor_allowances([bob], [UNIT], sender=bob)
+    discount.buy(0, value=UNIT, sender=bob)
+
+    indexer = Indexer(discount, tmp_path / "discount.db", start, page_size=3)
+    assert indexer.sync() == 7
+    assert indexer.checkpoint == chain.blocks.height
+    assert indexer.team_spend(1) == {alice.address: (2 * UNIT, UNIT // 2), bob.address: (UNIT, UNIT // 2)}
+
+    # only new blocks are indexed on the next run
+    discount.buy(0, charlie, value=UNIT, sender=bob)
+    discount.buy(0, value=UNIT, sender=charlie)
+    assert indexer.sync() == 2
+    assert indexer.sync() == 0
+    assert indexer.team_spend(1) == {alice.address: (2 * UNIT, 2 * UNIT), bob.address: (UNIT, UNIT)}
+    distribution = indexer.discount_distribution(1)
+    assert [(d, n) for d, n, _, _ in distribution] == [(UNIT // 10, 2), (discount.discount(charlie), 1)]
+    delegation = indexer.delegation(1)
+    assert delegation["self"][:2] == (2, 2 * UNIT)
+    assert delegation["delegated"][:2] == (1, UNIT)
+    assert indexer.team_spend(2) == {}
+
+def test_indexer_reorg(tmp_path, chain, deployer, management, alice, bob, charlie, yfi, veyfi, oracle, discount):
+    start = chain.blocks.height
+    oracle.set_price(2 * UNIT, sender=deployer)
+    veyfi.set_locked(bob, UNIT, chain.pending_timestamp // WEEK * WEEK + 4 * WEEK, sender=deployer)
+    yfi.mint(discount, 100 * UNIT, sender=deployer)
+    discount.set_team_allowances([alice], [3 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob], [2 * UNIT], sender=alice)
+
+    indexer = Indexer(discount, tmp_path / "discount.db", start)
+    assert indexer.sync() == 3
+    snapshot = chain.snapshot()
+    discount.buy(0, value=UNIT, sender=bob)
+    discount.set_contributor_allowances([charlie], [UNIT], sender=alice)
+    assert indexer.sync() == 2
+
+    # replace the last blocks with a different history
+    chain.restore(snapshot)
+    chain.mine()
+    discount.set_contributor_allowances([bob], [UNIT], sender=alice)
+    discount.buy(0, value=2 * UNIT, sender=bob)
+    assert indexer.sync() == 2
+    assert indexer.checkpoint == chain.blocks.height
+    assert indexer.team_spend(1) == {alice.address: (3 * UNIT, 2 * UNIT)}
+    assert indexer.balance(1, bob.address) == UNIT
+    assert indexer.balance(1, charlie.address) == 0
+
+def test_merkle_tree():
+    allowances = {f"0x{i + 1:040x}": i * UNIT for i in range(1, 1001)}
+    tree = MerkleTree(allowances, 1)
+    for contributor, allowance in list(allowances.items())[::97]:
+        assert verify(tree.proof(contributor), tree.root, leaf(contributor, allowance, 1))
+        assert not verify(tree.proof(contributor), tree.root, leaf(contributor, allowance + 1, 1))
+
+def test_packed_encoding():
+    allowances = [UNIT, 0, 15 * 10**17, (2**64 - 1) * 10**9, 10**9]
+    data = encode_allowances(allowances)
+    assert len(data) == 2
+    assert data[1] == 1 << 192
+    assert decode_allowances(data, len(allowances)) == allowances
+    assert encode_allowances([]) == []
+
+    with pytest.raises(ValueError, match="out of range"):
+        encode_allowances([2**64 * 10**9])
+    with pytest.raises(ValueError, match="whole gwei"):
+        encode_allowances([UNIT + 1])
+    with pytest.raises(ValueError, match="too many"):
+        encode_allowances([UNIT] * 257)
+    with pytest.raises(ValueError, match="do not hold"):
+        decode_allowances(data, 9)
+
+def test_snapshot_recording():
+    # upstream that answers every state lookup with a fixed value
+    class Upstream(snapshot.BaseHTTPRequestHandler):
+        def do_POST(self):
+            request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            results = {"eth_getCode": "0x6001", "eth_getBalance": "0x5", "eth_getTransactionCount": "0x0", "eth_getStorageAt": "0x07"}
+            data = json.dumps({"jsonrpc": "2.0", "id": request["id"], "result": results.get(request["method"], "0x1")}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    upstream = snapshot.ThreadingHTTPServer(("127.0.0.1", 0), Upstream)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    address = "0x0bc529c00C6401aEF6D220BE8C6Ea1667F6Ad93e"
+    with snapshot.RecordingProxy(f"http://127.0.0.1:{upstream.server_address[1]}") as proxy:
+        assert snapshot.rpc(proxy.uri, "eth_getCode", [address, "latest"]) == "0x6001"
+        assert snapshot.rpc(proxy.uri, "eth_getStorageAt", [address, "0x2", "latest"]) == "0x07"
+        assert snapshot.rpc(proxy.uri, "eth_blockNumber", []) == "0x1"
+        proxy.record(
+            [{"id": 1, "method": "eth_getBalance", "params": [address, "latest"]}, {"id": 2, "method": "eth_getCode", "params": [ZERO_ADDRESS, "latest"]}],
+            [{"id": 2, "result": "0x"}, {"id": 1, "result": "0x5"}],
+        )
+    upstream.shutdown()
+
+    accounts = snapshot.touched(proxy.accounts)
+    assert list(accounts) == [address.lower()]
+    assert accounts[address.lower()] == {
+        "code": "0x6001", "balance": "0x5", "nonce": "0x0", "storage": {"0x" + "00" * 31 + "02": "0x" + "00" * 31 + "07"},
+    }
+    genesis = snapshot.to_genesis({"block": {"number": 17_000_000, "timestamp": 1681000000}, "accounts": accounts})
+    assert genesis["number"] == hex(17_000_000)
+    assert genesis["alloc"] == accounts
+
+@pytest.mark.skipif(shutil.which("anvil") is None, reason="requires anvil")
+def test_snapshot_replay():
+    # contract that returns its storage slot 0
+    address = "0x" + "12" * 20
+    holder = "0x" + "34" * 20
+    state = {
+        "block": {"number": 17_000_000, "timestamp": 1681000000},
+        "accounts": {
+            address: {"code": "0x60005460005260206000f3", "balance": "0x0", "nonce": "0x1", "storage": {"0x" + "00" * 32: "0x" + "00" * 31 + "07"}},
+            holder: {"code": "0x", "balance": hex(5 * UNIT), "nonce": "0x2", "storage": {}},
+        },
+    }
+    with snapshot.replay(state) as (uri, startup):
+        assert startup > 0
+        assert int(snapshot.rpc(uri, "eth_blockNumber", []), 16) == 17_000_000
+        block = snapshot.rpc(uri, "eth_getBlockByNumber", ["latest", False])
+        assert int(block["timestamp"], 16) == 1681000000
+        assert int(snapshot.rpc(uri, "eth_chainId", []), 16) == snapshot.CHAIN_ID
+        assert snapshot.rpc(uri, "eth_getCode", [address, "latest"]) == "0x60005460005260206000f3"
+        assert int(snapshot.rpc(uri, "eth_getStorageAt", [address, "0x0", "latest"]), 16) == 7
+        assert int(snapshot.rpc(uri, "eth_call", [{"to": address, "data": "0x"}, "latest"]), 16) == 7
+        assert int(snapshot.rpc(uri, "eth_getBalance", [holder, "latest"]), 16) == 5 * UNIT
+        assert int(snapshot.rpc(uri, "eth_getTransactionCount", [holder, "latest"]), 16) == 2
+
+def test_simulate():
+    rows = simulate.simulate(2, 6, 0.5, 0.5, 0)
+    assert [row["phase"] for row in rows] == ["set_team_allowances", "set_contributor_allowances", "buy", "total"]
+    assert [row["transactions"] for row in rows] == [1, 2, 3, 6]
+    assert rows[-1]["gas"] == sum(row["gas"] for row in rows[:-1])
+    assert rows[-1]["gas_per_contributor"] == round(rows[-1]["gas"] / 6)
+
+def write_allocations(path, rows):
+    path.write_text("account,allowance\n" + "".join(f"{a},{v}\n" for a, v in rows))
+    return str(path)
+
+def test_allocate_plan():
+    rows = [(f"0x{i + 1:040x}", i) for i in range(300)]
+    assert [len(b) for b in allocate.plan_batches(rows, 50_000, 25_000)] == [150, 150]
+    assert [len(b) for b in allocate.plan_batches(rows, 50_000, 25_000, 1_050_000)] == [38] * 4 + [37] * 4
+    assert allocate.plan_batches([], 50_000, 25_000) == []
+    with pytest.raises(ValueError, match="too small"):
+        allocate.plan_batches(rows, 50_000, 25_000, 60_000)
+
+def test_allocate_read(tmp_path, alice, bob):
+    path = write_allocations(tmp_path / "rows.csv", [(str(alice).lower(), UNIT), (bob, 0)])
+    assert allocate.read_allocations(path) == [(alice.address, UNIT), (bob.address, 0)]
+    with pytest.raises(ValueError, match="line 3: duplicate"):
+        allocate.read_allocations(write_allocations(tmp_path / "dup.csv", [(alice, 1), (alice, 2)]))
+    with pytest.raises(ValueError, match="line 2: invalid allowance -1"):
+        allocate.read_allocations(write_allocations(tmp_path / "neg.csv", [(alice, -1)]))
+    with pytest.raises(ValueError, match="line 2: invalid allowance 'one'"):
+        allocate.read_allocations(write_allocations(tmp_path / "word.csv", [(alice, "one")]))
+    with pytest.raises(ValueError, match="line 3: invalid account"):
+        allocate.read_allocations(write_allocations(tmp_path / "account.csv", [(alice, 1), ("0x1234", 1)]))
+    with pytest.raises(ValueError, match="line 2: zero address"):
+        allocate.read_allocations(write_allocations(tmp_path / "zero.csv", [("0x" + "00" * 20, 1)]))
+
+def test_allocate_teams(tmp_path, accounts, management, alice, bob, charlie, discount):
+    discount.set_standing_allowances([charlie], [UNIT], sender=management)
+    rows = [(alice.address, UNIT), (bob.address, 0), (charlie.address, 0), (accounts[5].address, 2 * UNIT)]
+    allocation = allocate.Allocation(discount, management, allocate.TEAMS, rows, tmp_path / "journal.json", gas_budget=110_000)
+    # zero rows only remain if they override a standing allowance
+    assert [b["accounts"] for b in allocation.journal.batches] == [[alice.address, charlie.address], [accounts[5].address]]
+    batches = allocation.run()
+    assert [b["status"] for b in batches] == ["confirmed", "confirmed"]
+    assert discount.month() == 1
+    assert discount.team_allowance(alice) == UNIT
+    assert discount.team_allowance(charlie) == 0
+    assert discount.team_allowance(accounts[5]) == 2 * UNIT
+
+    with pytest.raises(allocate.AllocationError, match="management"):
+        allocate.Allocation(discount, alice, allocate.TEAMS, rows, tmp_path / "other.json").run()
+
+def test_allocate_contributors_exceed(tmp_path, management, alice, bob, charlie, discount):
+    discount.set_team_allowances([alice], [UNIT], sender=management)
+    rows = [(bob.address, UNIT), (charlie.address, 1)]
+    allocation = allocate.Allocation(discount, alice, allocate.CONTRIBUTORS, rows, tmp_path / "journal.json")
+    with pytest.raises(allocate.AllocationError, match="exceeds team allowance"):
+        allocation.run()
+    assert discount.contributor_allowance(bob) == 0
+    assert not (tmp_path / "journal.json").exists()
+    with pytest.raises(ValueError, match="invalid mode"):
+        allocate.Allocation(discount, alice, "team", rows, tmp_path / "journal.json")
+
+def test_allocate_contributors_resume(chain, tmp_path, accounts, management, alice, discount, sign):
+    contributors = [accounts.generate_test_account() for _ in range(6)]
+    discount.set_team_allowances([alice], [10 * UNIT], sender=management)
+    rows = [(c.address, UNIT) for c in contributors]
+    journal = tmp_path / "journal.json"
+    allocation = allocate.Allocation(discount, alice, allocate.CONTRIBUTORS, rows, journal, gas_budget=120_000)
+    assert [len(b["accounts"]) for b in allocation.journal.batches] == [2, 2, 2]
+
+    # only the first batch is broadcast, the nonce of the second is used by another transaction
+    allocation.sign(allocation.journal.batches)
+    allocation.broadcast(allocation.journal.batches[:1])
+    alice.transfer(alice, 0, nonce=allocation.journal.batches[0]["nonce"] + 1)
+
+    resumed = allocate.Allocation(discount, alice, allocate.CONTRIBUTORS, rows, journal, gas_budget=120_000)
+    batches = resumed.run()
+    assert [b["status"] for b in batches] == ["confirmed"] * 3
+    for contributor in contributors:
+        assert discount.contributor_allowance(contributor) == UNIT
+    assert discount.team_allowance(alice) == 4 * UNIT
+
+    # nothing is sent again once every batch is confirmed
+    nonce = alice.nonce
+    assert allocate.Allocation(discount, alice, allocate.CONTRIBUTORS, rows, journal, gas_budget=120_000).run() == batches
+    assert alice.nonce == nonce
+
+    with pytest.raises(ValueError, match="different allocation"):
+        allocate.Allocation(discount, alice, allocate.CONTRIBUTORS, rows[1:], journal)
+
+def test_profiler(alice, management):
+    discount, oracle = "0x" + "11" * 20, "0x" + "22" * 20
+    buy = keccak(b"buy(uint256)")[:4]
+    latest = keccak(b"latestRoundData()")[:4]
+    slot = keccak(encode(["uint256", "address"], [layout.SLOTS["contributor_allowances"], alice.address]))
+    memory = [f"{layout.SLOTS['contributor_allowances']:064x}", alice.address[2:].lower().rjust(64, "0"), latest.hex().ljust(64, "0")]
+
+    def log(op, gas, cost, depth=1, stack=()):
+        return {"op": op, "gas": gas, "gasCost": cost, "depth": depth, "stack": list(stack), "memory": memory}
+
+    logs = [
+        log("PUSH1", 100_000, 3),
+        log("SLOAD", 99_997, 2100, stack=[hex(layout.SLOTS["packed_month"])]),
+        log("SHA3", 97_897, 42, stack=["0x40", "0x0"]),
+        log("SLOAD", 97_855, 2100, stack=["0x" + slot.hex()]),
+        log("STATICCALL", 95_755, 2600, stack=["0x20", "0x0", "0x4", "0x40", oracle, "0xffff"]),
+        log("PUSH1", 60_000, 3, depth=2),
+        log("SLOAD", 59_997, 2100, depth=2, stack=["0x0"]),
+        log("RETURN", 57_897, 0, depth=2),
+        log("CALL", 93_000, 9000, stack=["0x0", "0x0", "0x0", "0x0", "0x1", management.address, "0xffff"]),
+        log("SSTORE", 84_000, 2900, stack=["0x1", "0x" + slot.hex()]),
+        log("STOP", 81_100, 0),
+    ]
+    data = buy + encode(["uint256"], [1])
+    intrinsic = profiler.intrinsic_gas(data)
+    profile = profiler.Profiler(
+        discount, {discount: "Discount", oracle: "Oracle", management.address: "management"}, {buy.hex(): "buy", latest.hex(): "latestRoundData"}
+    )
+    stacks = profile.add(logs, discount, data, intrinsic + 18_900 - 4800)
+    assert stacks == {
+        ("Discount.buy",): 45,
+        ("Discount.buy", "SLOAD packed_month"): 2100,
+        ("Discount.buy", "SLOAD contributor_allowances"): 2100,
+        ("Discount.buy", "Oracle.latestRoundData"): 655,
+        ("Discount.buy", "Oracle.latestRoundData", "SLOAD"): 2100,
+        ("Discount.buy", "management.transfer"): 9000,
+        ("Discount.buy", "SSTORE contributor_allowances"): 2900,
+        ("Discount.buy", "[intrinsic]"): intrinsic,
+    }
+    assert profile.refunds == 4800
+
+    profile.add(logs, discount, data, intrinsic + 18_900)
+    assert profile.transactions == 2
+    assert "Discount.buy;Oracle.latestRoundData;SLOAD 4200" in profile.folded()
+    summary = dict(profile.summary())
+    assert summary[("Discount.buy",)] == 18_900 + intrinsic
+    assert summary[("Discount.buy", "Oracle.latestRoundData")] == 2755
+
+def test_profiler_selectors():
+    selectors = profiler.method_selectors()
+    assert selectors[keccak(b"buy(uint256,address,address)")[:4].hex()] == "buy"
+    assert selectors[keccak(b"latestRoundData()")[:4].hex()] == "latestRoundData"
+
+def test_layout(chain, management, alice, bob, discount):
+    assert layout.compile_layout() == layout.LAYOUT
+    discount.set_team_allowances([alice], [3 * UNIT], sender=management)
+    discount.set_contributor_allowances([bob], [UNIT], sender=alice)
+
+    def storage(name, key=None):
+        slot = layout.SLOTS[name]
+        if key is not None:
+            slot = int.from_bytes(keccak(encode(["uint256", "address"], [slot, key])), "big")
+        return int.from_bytes(chain.provider.get_storage(discount.address, slot), "big")
+
+    assert storage("packed_month") == discount.expiration() | discount.month() << 192
+    assert storage("team_allowances", alice.address) == 2 * UNIT | 1 << 192
+    assert storage("contributor_allowances", bob.address) == UNIT | 1 << 192